@@ -4,12 +4,16 @@ API包初始化模块。
 """
 from fastapi import APIRouter
 from warehouse_assistant.app.api.routes.trace import router as trace_router
+from warehouse_assistant.app.api.routes.metrics import router as metrics_router
+from warehouse_assistant.app.api.routes.health import router as health_router
 
 # 创建主路由器
 router = APIRouter()
 
 # 注册子路由器
 router.include_router(trace_router)
+router.include_router(metrics_router)
+router.include_router(health_router)
 
 # 可以在这里注册更多的路由器，例如：
 # router.include_router(ask_router)
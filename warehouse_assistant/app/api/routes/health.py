@@ -0,0 +1,47 @@
+"""
+健康检查API路由模块。
+提供存活探针 (/healthz) 和就绪探针 (/readyz)。
+
+AI 组件（嵌入模型和向量库）在后台预热，预热期间追溯接口即可正常服务，
+因此默认的就绪判断只依赖数据库；需要等待 AI 组件就绪时使用 /readyz?require_ai=true。
+"""
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+
+from warehouse_assistant.app.services.ai.knowledge_base import KnowledgeBaseService
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+
+# 创建路由器
+router = APIRouter(tags=["health"])
+
+
+@router.get("/healthz")
+async def healthz():
+    """存活探针：事件循环能响应即视为存活，不检查任何依赖"""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz(require_ai: bool = Query(False, description="是否要求嵌入模型和向量库已加载")):
+    """
+    就绪探针，不触发任何加载。
+
+    Returns:
+        各组件状态；数据库不可用（或 require_ai 时知识库未就绪）时返回 503
+    """
+    db_service = get_db_service()
+    database = {
+        "status": "ok" if db_service.client is not None or db_service.use_local_file else "unavailable",
+        "mode": "local_file" if db_service.use_local_file else "mongodb",
+    }
+    knowledge_base = KnowledgeBaseService().status_info()
+
+    ready = database["status"] == "ok" and (not require_ai or knowledge_base["status"] == "ready")
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "database": database,
+            "knowledge_base": knowledge_base,
+        }
+    )
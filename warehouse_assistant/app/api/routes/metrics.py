@@ -0,0 +1,25 @@
+"""
+运行指标API路由模块。
+提供风险评估各阶段耗时、token 用量等直方图指标的查询接口。
+"""
+from fastapi import APIRouter
+from typing import Any, Dict
+
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
+
+# 创建路由器
+router = APIRouter(
+    prefix="/api/metrics",
+    tags=["metrics"]
+)
+
+@router.get("", response_model=Dict[str, Any])
+async def get_metrics():
+    """
+    获取进程内汇总的运行指标。
+
+    Returns:
+        包含 histograms（各阶段耗时、各 Agent token 用量、检索/嵌入/数据库读写耗时）、
+        counters 和 gauges 的字典
+    """
+    return get_metrics_registry().snapshot()
@@ -3,10 +3,12 @@
 提供物料追溯相关的API接口。
 """
 from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
-from warehouse_assistant.app.models.schemas import TraceResponse, TraceEventResponse, RiskAssessmentResponse
+from warehouse_assistant.app.models.schemas import (
+    TraceResponse, TraceEventResponse, RiskAssessmentResponse, BatchRiskScoreResponse
+)
 from warehouse_assistant.app.services.database import DatabaseService
 from warehouse_assistant.app.services.ai.crews.risk_crew import run_risk_assessment_for_event
 
@@ -93,6 +95,42 @@ async def trace_by_batch_id(
         events=events
     )
 
+# 注意：该路由必须声明在 /{batch_id} 之前，否则 risky-batches 会被当作批次号
+@router.get("/risky-batches", response_model=List[BatchRiskScoreResponse])
+async def get_risky_batches(
+    limit: int = Query(10, ge=1, le=100, description="返回的批次数"),
+    open_only: bool = Query(True, description="是否只返回在途（尚未出库）的批次"),
+    db_service: DatabaseService = Depends(get_db_service)
+):
+    """
+    查询当前风险最高的批次。
+    
+    批次风险分在每次写入风险评估时增量更新，查询直接走 (is_open, risk_score) 索引，不需要扫描事件。
+    
+    Args:
+        limit: 返回的批次数
+        open_only: 是否只返回在途批次
+        db_service: 数据库服务实例（通过依赖注入）
+    
+    Returns:
+        按风险分降序排列的批次风险分列表
+    """
+    scores = db_service.get_risky_batches(limit=limit, open_only=open_only)
+    return [
+        BatchRiskScoreResponse(
+            batch_id=score["_id"],
+            risk_score=score.get("risk_score", 0),
+            max_level=score.get("max_level"),
+            counts_by_level=score.get("counts_by_level", {}),
+            counts_by_type=score.get("counts_by_type", {}),
+            assessed_events=score.get("assessed_events", 0),
+            last_high_risk_event=score.get("last_high_risk_event"),
+            is_open=score.get("is_open", True),
+            updated_at=score.get("updated_at")
+        )
+        for score in scores
+    ]
+
 @router.get("/{batch_id}", response_model=TraceResponse)
 async def trace_by_batch_id_path(
     batch_id: str,
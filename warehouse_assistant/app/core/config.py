@@ -16,13 +16,55 @@ class Settings(BaseSettings):
     # MongoDB 设置
     MONGODB_CONNECTION_STRING: str = "mongodb://localhost:27017"
     MONGODB_DB_NAME: str = "warehouse_assistant"
+    # 新事件接入方式：auto（副本集/分片集群使用 Change Stream，单机版回退到轮询）、change_stream、polling
+    EVENT_INGESTION_MODE: str = "auto"
+    # Change Stream 连接中断后重新连接前的等待（秒），重连后从持久化的恢复令牌继续
+    CHANGE_STREAM_RETRY_SECONDS: float = 5.0
+    # Change Stream 模式下拾取重新排队事件的间隔（秒）
+    REQUEUE_SWEEP_INTERVAL_SECONDS: float = 30.0
 
 
     # ChromaDB 设置
     # 使用 os.path.join 确保路径正确
     CHROMA_PERSIST_DIRECTORY: str = os.path.join(BASE_DIR, "chroma_db_store")
+    # 知识库集合的基础名称；每次构建写入新的版本化集合 <基础名称>_v<时间戳>，清单指向当前集合
     KNOWLEDGE_BASE_COLLECTION_NAME: str = "enterprise_knowledge_base"
+    # 保留的版本化集合数（当前集合和之前的若干个），更早的集合在构建完成后删除；
+    # 至少为 2，保证其他进程切换到新集合之前仍可读取上一个集合
+    KB_COLLECTION_RETENTION: int = 2
     EMBEDDING_MODEL_NAME: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    # 嵌入模型后端：torch（HuggingFaceEmbeddings）或 onnx（ONNX Runtime，
+    # 需先运行 scripts/export_onnx_embedding_model.py 导出；切换后端后需重建知识库）
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_ONNX_DIR: str = os.path.join(BASE_DIR, "onnx_models", "paraphrase-multilingual-MiniLM-L12-v2")
+    EMBEDDING_ONNX_QUANTIZED: bool = True
+    # ONNX Runtime 算子内线程数，0 表示使用默认值
+    EMBEDDING_ONNX_THREADS: int = 0
+    # 共享嵌入服务地址（scripts/run_embedding_server.py 启动），如 http://127.0.0.1:8765 或
+    # unix:///tmp/warehouse_embedding.sock；为空则每个进程各自加载模型。
+    # 服务端使用自己的 EMBEDDING_BACKEND 配置，模型标识与本进程配置不一致时拒绝使用
+    EMBEDDING_SERVICE_URL: str = ""
+    EMBEDDING_SERVICE_TIMEOUT_SECONDS: float = 30.0
+    # 查询向量缓存：内存 LRU 条目数、SQLite 磁盘层路径（为空则只用内存）、启动时从磁盘预热的条目数
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 2048
+    EMBEDDING_CACHE_PATH: str = os.path.join(BASE_DIR, "embedding_cache", "query_embeddings.sqlite3")
+    EMBEDDING_CACHE_WARMUP_ENTRIES: int = 512
+    # 嵌入请求微批处理：并发的编码请求最多等待 EMBEDDING_BATCH_MAX_WAIT_MS 或凑满
+    # EMBEDDING_BATCH_MAX_SIZE 条后合并为一次前向计算
+    EMBEDDING_MICRO_BATCHING: bool = True
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0
+    # 检索结果缓存的最大条目数（按知识库构建隔离，重建后自动失效）
+    SEARCH_RESULT_CACHE_MAX_ENTRIES: int = 1024
+    # 知识库（嵌入模型和向量库）加载失败后的重试退避：首次等待秒数，连续失败时翻倍，不超过上限
+    KB_LOAD_RETRY_BACKOFF_SECONDS: float = 30.0
+    KB_LOAD_RETRY_MAX_BACKOFF_SECONDS: float = 600.0
+    # 向量检索后端：chroma，或 snapshot（内存映射的 NumPy 向量快照，多个 worker 通过页缓存共享；
+    # 快照由 init_knowledge_base.py 或 scripts/export_vector_snapshot.py 导出，与当前知识库构建不一致时回退到 chroma）
+    VECTOR_INDEX_BACKEND: str = "chroma"
+    VECTOR_SNAPSHOT_DIRECTORY: str = os.path.join(BASE_DIR, "vector_snapshot")
+    # 快照向量精度：float16 或 int8
+    VECTOR_SNAPSHOT_DTYPE: str = "float16"
 
 
     # 火山引擎 DeepSeek 设置
@@ -31,6 +73,47 @@ class Settings(BaseSettings):
     VOLCANO_MODEL_ENDPOINT_ID: str = os.getenv("MODEL_ENDPOINT_ID")
     
 
+    # LLM 提供方设置
+    # deepseek: DeepSeek 官方 API；stub: 本地确定性桩模型（离线压测用，不产生费用）
+    LLM_PROVIDER: str = "deepseek"
+    # 桩模型的随机种子，相同种子和提示词得到相同的延迟、token 数和输出
+    STUB_LLM_SEED: int = 42
+    # 桩模型单次调用延迟的中位数（毫秒）和对数正态分布形状参数
+    STUB_LLM_LATENCY_MS: float = 800.0
+    STUB_LLM_LATENCY_SIGMA: float = 0.3
+    # 桩模型单次调用输出 token 数的均值和标准差
+    STUB_LLM_COMPLETION_TOKENS_MEAN: int = 200
+    STUB_LLM_COMPLETION_TOKENS_STD: int = 60
+    # 桩模型预设回复文件（JSON 列表，每项 {"match": ..., "response": ...}），为空则使用规则生成
+    STUB_LLM_RESPONSES_FILE: str = ""
+    # 单次 LLM 请求超时（秒），防止挂起的请求长期占用线程
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 60.0
+
+    # 风险评估设置
+    # 分析结果未通过 RiskAssessment 模型校验时的最大重试次数（只重跑分析步骤）
+    RISK_OUTPUT_MAX_RETRIES: int = 2
+    # 批次上下文缓存最多保留的批次数（LRU 淘汰）
+    BATCH_CONTEXT_MAX_BATCHES: int = 256
+    # 提供给分析步骤的同批次历史摘要的 token 预算
+    BATCH_HISTORY_TOKEN_BUDGET: int = 600
+    # 知识检索：每条查询返回的结果数，以及多查询合并去重后最多提供给分析步骤的结果数
+    RETRIEVAL_K_PER_QUERY: int = 3
+    RETRIEVAL_MAX_RESULTS: int = 8
+    # 预计算知识上下文表：固定查询直接查表（scripts/build_context_table.py 构建），
+    # 表与当前知识库构建不一致或未构建时全部走向量检索
+    CONTEXT_TABLE_ENABLED: bool = True
+    # 知识上下文压缩：合并相邻文本块的重叠部分，丢弃距离超过 最佳距离×(1+KNOWLEDGE_SCORE_RELATIVE_MARGIN) 的结果
+    # （至少保留 KNOWLEDGE_MIN_RESULTS 条），并按相关度把知识输入裁剪到 KNOWLEDGE_CONTEXT_TOKEN_BUDGET 以内
+    KNOWLEDGE_CONTEXT_COMPRESSION: bool = True
+    KNOWLEDGE_SCORE_RELATIVE_MARGIN: float = 0.5
+    KNOWLEDGE_MIN_RESULTS: int = 2
+    KNOWLEDGE_CONTEXT_TOKEN_BUDGET: int = 1200
+    # 单次风险评估的整体超时和单阶段超时（秒），<=0 表示不限
+    RISK_RUN_TIMEOUT_SECONDS: float = 300.0
+    RISK_STAGE_TIMEOUT_SECONDS: float = 120.0
+    # 超时的事件最多自动重新排队的次数
+    RISK_TIMEOUT_MAX_REQUEUES: int = 2
+
     # 应用设置
     LOG_LEVEL: str = "INFO"
 
@@ -7,15 +7,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
 from warehouse_assistant.app.core.config import settings # 导入配置，确保日志已初始化
-# 导入轮询监听器替代Change Stream
-from warehouse_assistant.app.services.background.polling_listener import (
-    start_polling_task,
-    stop_polling_task
+# 新事件接入：副本集使用 Change Stream，单机版回退到轮询
+from warehouse_assistant.app.services.background.event_ingestion import (
+    get_ingestion_mode,
+    start_event_ingestion,
+    stop_event_ingestion
 )
 # 导入数据库服务用于应用关闭时清理连接（如果需要）
 from warehouse_assistant.app.services.database.mongo_service import get_db_service
 from warehouse_assistant.app.api import router as api_router
-from warehouse_assistant.app.services.ai.knowledge_base import get_knowledge_service # <--- 确保这行导入存在
+from warehouse_assistant.app.services.ai.knowledge_base import KnowledgeBaseService, warm_up_knowledge_base
 # 导入后台任务管理器
 from warehouse_assistant.app.services.background.task_manager import task_manager
 
@@ -27,18 +28,17 @@ async def lifespan(app: FastAPI):
     logger.info("FastAPI application startup...")
     # 启动数据库服务（单例模式下会自动初始化）
     get_db_service()
-    # 启动知识库服务（单例模式下会自动初始化）
-    from warehouse_assistant.app.services.ai.knowledge_base import get_knowledge_service
-    get_knowledge_service()
-    # 启动轮询任务替代Change Stream
-    await start_polling_task()
+    # 在后台预热知识库（加载嵌入模型和向量库），不阻塞应用启动，预热期间追溯接口即可服务
+    await task_manager.start_task("knowledge_base_warmup", warm_up_knowledge_base)
+    # 启动新事件接入（Change Stream 或轮询）
+    await start_event_ingestion()
     # 启动所有后台任务
     await task_manager.start_all_tasks()
     yield
     # Clean up on shutdown
     logger.info("FastAPI application shutdown...")
-    # 停止轮询任务
-    await stop_polling_task()
+    # 停止新事件接入
+    await stop_event_ingestion()
     # 关闭数据库连接（如果使用单例）
     db_service = get_db_service()
     db_service.close()
@@ -71,15 +71,16 @@ app.include_router(api_router)
 async def root():
     db_service = get_db_service()
     db_status = "Connected" if not db_service.use_local_file and db_service.client else "Local File Mode or Connection Failed"
-    kb_service = get_knowledge_service()
-    kb_status = "Loaded" if kb_service.vectorstore else "Not Loaded"
+    # 只读取加载状态，不触发加载
+    kb_status = "Loaded" if KnowledgeBaseService().is_ready else "Not Loaded"
 
     return {
         "name": "智能仓储助手API",
         "version": app.version,
         "status": "运行中",
         "database_status": db_status,
-        "knowledge_base_status": kb_status
+        "knowledge_base_status": kb_status,
+        "event_ingestion": get_ingestion_mode()
     }
 
 @app.on_event("startup")
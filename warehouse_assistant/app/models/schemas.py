@@ -3,7 +3,7 @@ API模型定义模块。
 使用Pydantic定义API请求和响应的数据模型。
 """
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from pydantic import BaseModel, Field
 
 # 物料追溯相关模型
@@ -169,6 +169,58 @@ class TraceResponse(BaseModel):
             }
         }
 
+class RiskAssessment(BaseModel):
+    """
+    风险评估结果模型。
+    风险分析步骤的结构化输出，校验通过后才会写回数据库。
+    """
+    risk_level: Literal["高", "中", "低", "无"] = Field(..., description="风险等级：高、中、低或无")
+    risk_type: str = Field(..., min_length=1, description="风险类型，如参数偏差、质量问题、程序违规、无")
+    reason: str = Field(..., min_length=1, description="对评估结果的简明解释")
+    suggestion: Optional[str] = Field(None, description="后续行动或预防措施建议")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "risk_level": "高",
+                "risk_type": "参数偏差",
+                "reason": "轧制速度超出标准范围，可能导致厚度不均",
+                "suggestion": "降低轧制速度至20米/分钟以下，增加质检频率"
+            }
+        }
+
+class BatchRiskScoreResponse(BaseModel):
+    """批次风险分响应模型，随每次风险评估写入增量维护"""
+    batch_id: str = Field(..., description="批次号")
+    risk_score: int = Field(..., description="批次风险分（各事件风险等级加权求和，高=10、中=3、低=1）")
+    max_level: Optional[str] = Field(None, description="批次内事件的最高风险等级")
+    counts_by_level: Dict[str, int] = Field(default_factory=dict, description="各风险等级的事件数")
+    counts_by_type: Dict[str, int] = Field(default_factory=dict, description="各风险类型的事件数")
+    assessed_events: int = Field(0, description="已完成风险评估的事件数")
+    last_high_risk_event: Optional[Dict[str, Any]] = Field(None, description="最近一次高风险事件")
+    is_open: bool = Field(True, description="批次是否在途（尚未出库）")
+    updated_at: Optional[datetime] = Field(None, description="最近更新时间")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "batch_id": "P20230815001",
+                "risk_score": 23,
+                "max_level": "高",
+                "counts_by_level": {"高": 2, "中": 1, "无": 5},
+                "counts_by_type": {"质量问题": 2, "参数偏差": 1, "无": 5},
+                "assessed_events": 8,
+                "last_high_risk_event": {
+                    "event_id": "64db1f0c2f8b9a0012345678",
+                    "risk_type": "质量问题",
+                    "reason": "质检发现严重缺陷",
+                    "timestamp": "2023-08-16T14:20:00"
+                },
+                "is_open": True,
+                "updated_at": "2023-08-16T14:25:00"
+            }
+        }
+
 class RiskAssessmentResponse(BaseModel):
     """风险评估结果响应模型"""
     event_id: str = Field(..., description="事件ID")
@@ -1,47 +1,28 @@
 from crewai import Agent
-from langchain_openai import ChatOpenAI  # 使用langchain_openai
 from warehouse_assistant.app.core.config import settings #导入配置
+from warehouse_assistant.app.services.ai.llm_provider import create_llm
 from warehouse_assistant.app.services.ai.tools.db_tools import GetEventTool, UpdateRiskTool
-from warehouse_assistant.app.services.ai.tools.knowledge_tools import KnowledgeSearchTool
+from warehouse_assistant.app.services.ai.tools.knowledge_tools import GetRuleTool, KnowledgeSearchTool
 import logging
-import os
 
 logger = logging.getLogger(__name__)
 
-# --- DeepSeek 官方 API 配置 ---
-# 优先从环境变量获取，提供一个明确的占位符
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "YOUR_DEEPSEEK_API_KEY_PLACEHOLDER")
-# 使用带提供商前缀的模型名称
-DEEPSEEK_MODEL_WITH_PROVIDER = "deepseek/deepseek-chat"  # 或者 "deepseek/deepseek-coder"
-
-# 配置 DeepSeek LLM
+# 按 settings.LLM_PROVIDER 配置 LLM（deepseek 或本地桩模型 stub）
 try:
-    # 检查 DeepSeek API Key
-    if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == "YOUR_DEEPSEEK_API_KEY_PLACEHOLDER":
-        raise ValueError("DeepSeek API Key 未配置。请设置 DEEPSEEK_API_KEY 环境变量。")
-    
-    logger.info(f"使用 DeepSeek 模型 (带提供商前缀): {DEEPSEEK_MODEL_WITH_PROVIDER}")
-    
-    # 创建 ChatOpenAI 实例，明确传入模型名称和 API Key
-    llm = ChatOpenAI(
-        model=DEEPSEEK_MODEL_WITH_PROVIDER,
-        api_key=DEEPSEEK_API_KEY,
-        temperature=0.7,
-        max_tokens=2000
-    )
-    
-    logger.info("已初始化LLM，使用DeepSeek官方API")
-except Exception as ve: # 捕获配置错误
+    llm = create_llm()
+    logger.info(f"已初始化LLM，提供方: {settings.LLM_PROVIDER}")
+except ValueError as ve: # 捕获配置错误
     logger.error(f"LLM 配置错误: {ve}")
     raise ve # 重新抛出，组织应用继续运行
 except Exception as e:
-    logger.error(f"使用DeepSeek初始化LLM失败: {e}。请检查 API Key 和网络连接。", exc_info=True)
+    logger.error(f"初始化LLM失败: {e}。请检查 API Key 和网络连接。", exc_info=True)
     raise e
 
 # 初始化工具
 get_event_tool = GetEventTool()
 update_risk_tool = UpdateRiskTool()
 knowledge_search_tool = KnowledgeSearchTool()
+get_rule_tool = GetRuleTool()
 
 # 定义Agent
 data_fetcher_agent = Agent(
@@ -87,8 +68,9 @@ risk_analyzer_agent = Agent(
         "你是一位严谨的分析师，对钢铁仓储流程和质量控制有深入了解。"
         "你会根据既定规范和知识库背景严格评估运营数据。"
         "你的输出是一个结构化、可操作的 JSON 格式风险评估报告。"
-        "你不直接使用工具，而是综合处理提供给你的信息。"
+        "你主要综合处理提供给你的信息；需要核对某条规则的完整原文时，使用 'get_rule_tool' 按规则编号查询。"
     ),
+    tools=[get_rule_tool],
     llm=llm,  # 使用配置好的LLM
     verbose=True,
     allow_delegation=False,
@@ -0,0 +1,213 @@
+"""
+批次上下文缓存模块
+按批次缓存历史事件，为风险分析提供同批次的历史摘要，避免每个事件都重复查询整个批次
+"""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+from warehouse_assistant.app.services.ai.run_timeline import timed
+from warehouse_assistant.app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 摘要中每个事件最多展示的参数个数
+MAX_PARAMS_PER_EVENT = 4
+
+
+def _timestamp_key(value: Any) -> datetime:
+    """将事件时间统一转换为可比较的 naive UTC datetime"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return datetime.min
+    if not isinstance(value, datetime):
+        return datetime.min
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _compact_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留生成历史摘要所需的字段，控制缓存占用的内存"""
+    params = event.get("parameters") or event.get("equipment_params") or {}
+    key_params = {
+        name: value for name, value in params.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+    quality = event.get("quality_inspection") or {}
+    defect = event.get("defect_info") or quality.get("defect_info") or {}
+    risk = event.get("risk_assessment") or {}
+    return {
+        "_id": str(event.get("_id", "")),
+        "timestamp": _timestamp_key(event.get("timestamp")),
+        "operation_type": event.get("operation_type", "未知操作"),
+        "location": event.get("location_name") or event.get("location"),
+        "params": dict(list(key_params.items())[:MAX_PARAMS_PER_EVENT]),
+        "quality_result": quality.get("overall_result"),
+        "defect_type": defect.get("defect_type") if defect.get("has_defect") else None,
+        "risk_level": risk.get("risk_level"),
+    }
+
+
+def _format_event_line(event: Dict[str, Any]) -> str:
+    """将精简后的事件格式化为一行摘要"""
+    parts = [
+        event["timestamp"].strftime("%Y-%m-%d %H:%M") if event["timestamp"] != datetime.min else "时间未知",
+        event["operation_type"],
+    ]
+    if event["location"]:
+        parts.append(event["location"])
+    if event["params"]:
+        parts.append("参数: " + ", ".join(f"{k}={v}" for k, v in event["params"].items()))
+    if event["quality_result"]:
+        parts.append(f"质检: {event['quality_result']}")
+    if event["defect_type"]:
+        parts.append(f"缺陷: {event['defect_type']}")
+    if event["risk_level"]:
+        parts.append(f"风险: {event['risk_level']}")
+    return " | ".join(parts)
+
+
+class BatchContextCache:
+    """
+    批次上下文缓存。
+
+    每个批次首次被用到时通过 (batch_id, timestamp) 索引一次性加载全部历史事件，
+    之后新事件到达时增量追加；缓存的批次数按 LRU 淘汰。
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(BatchContextCache, cls).__new__(cls)
+                    cls._instance._init_cache()
+        return cls._instance
+
+    def _init_cache(self):
+        """初始化缓存"""
+        self._lock = threading.RLock()
+        self._batches: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self.max_batches = settings.BATCH_CONTEXT_MAX_BATCHES
+
+    def _load_batch(self, batch_id: str) -> List[Dict[str, Any]]:
+        """从数据库加载一个批次的全部历史事件（已按时间排序）"""
+        logger.info(f"加载批次 {batch_id} 的历史事件到上下文缓存")
+        with timed("db_read"):
+            events = get_db_service().get_trace_events_by_batch_id(batch_id)
+        return [_compact_event(event) for event in events]
+
+    def get_history(self, batch_id: str) -> List[Dict[str, Any]]:
+        """
+        获取批次的历史事件（精简后），未缓存时从数据库加载一次。
+
+        Args:
+            batch_id: 批次号
+
+        Returns:
+            按时间排序的精简事件列表
+        """
+        with self._lock:
+            if batch_id in self._batches:
+                self._batches.move_to_end(batch_id)
+                return list(self._batches[batch_id])
+
+        events = self._load_batch(batch_id)
+
+        with self._lock:
+            # 加载期间可能已有其他线程写入，保留较新的那份
+            if batch_id not in self._batches:
+                self._batches[batch_id] = events
+                while len(self._batches) > self.max_batches:
+                    self._batches.popitem(last=False)
+            self._batches.move_to_end(batch_id)
+            return list(self._batches[batch_id])
+
+    def observe_event(self, event: Dict[str, Any]) -> None:
+        """
+        新事件到达时增量追加到已缓存的批次中；批次未缓存时不做任何事（首次使用时再加载）。
+
+        Args:
+            event: 事件数据
+        """
+        batch_id = event.get("batch_id")
+        if not batch_id:
+            return
+        compact = _compact_event(event)
+        with self._lock:
+            events = self._batches.get(batch_id)
+            if events is None:
+                return
+            for i, existing in enumerate(events):
+                if existing["_id"] == compact["_id"]:
+                    events[i] = compact
+                    return
+            events.append(compact)
+            # 新事件通常是最新的，只有乱序到达时才需要重新排序
+            if len(events) > 1 and events[-2]["timestamp"] > compact["timestamp"]:
+                events.sort(key=lambda e: e["timestamp"])
+
+    def record_risk(self, batch_id: str, event_id: str, risk_level: Optional[str]) -> None:
+        """风险评估写回后同步更新缓存中对应事件的风险等级"""
+        with self._lock:
+            for event in self._batches.get(batch_id) or []:
+                if event["_id"] == event_id:
+                    event["risk_level"] = risk_level
+                    return
+
+    def summarize_history(self, event: Dict[str, Any], token_budget: Optional[int] = None) -> str:
+        """
+        生成当前事件之前同批次事件的精简摘要，总长度不超过 token 预算。
+
+        预算不足时优先保留最近的事件。
+
+        Args:
+            event: 当前事件数据
+            token_budget: token 预算，默认使用 settings.BATCH_HISTORY_TOKEN_BUDGET
+
+        Returns:
+            多行摘要文本；没有历史事件时返回空字符串
+        """
+        batch_id = event.get("batch_id")
+        if not batch_id:
+            return ""
+        if token_budget is None:
+            token_budget = settings.BATCH_HISTORY_TOKEN_BUDGET
+
+        current_id = str(event.get("_id", ""))
+        current_time = _timestamp_key(event.get("timestamp"))
+        history = [
+            e for e in self.get_history(batch_id)
+            if e["_id"] != current_id and e["timestamp"] <= current_time
+        ]
+
+        lines: List[str] = []
+        used_tokens = 0
+        for past_event in reversed(history):
+            line = _format_event_line(past_event)
+            line_tokens = estimate_tokens(line) + 1
+            if used_tokens + line_tokens > token_budget:
+                break
+            lines.append(line)
+            used_tokens += line_tokens
+
+        omitted = len(history) - len(lines)
+        lines.reverse()
+        if omitted > 0:
+            lines.insert(0, f"（更早的 {omitted} 条事件已省略）")
+        return "\n".join(lines)
+
+
+# 获取批次上下文缓存实例
+def get_batch_context_cache() -> BatchContextCache:
+    return BatchContextCache()
@@ -0,0 +1,198 @@
+"""
+知识上下文构建模块
+把检索结果压缩后再放入提示词，减少分析步骤的 prompt token：
+1. 合并重叠：同一文件同一页中位置重叠的相邻文本块（切割时有 chunk_overlap 重叠）合并为一段，重叠部分只出现一次；
+2. 自适应阈值：以本次最相关结果的距离为基准，丢弃距离超过 最佳距离×(1+KNOWLEDGE_SCORE_RELATIVE_MARGIN) 的结果，
+   至少保留 KNOWLEDGE_MIN_RESULTS 条；
+3. token 预算：按相关度依次放入，超出 KNOWLEDGE_CONTEXT_TOKEN_BUDGET 后停止（第一段超出时截断）。
+节省的 token 数记录到当前运行的时间线和 /api/metrics。
+"""
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.run_timeline import record_context_compression
+from warehouse_assistant.app.utils.metrics import TOKEN_BUCKETS, get_metrics_registry
+from warehouse_assistant.app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 截断文本的结尾标记
+TRUNCATION_MARK = "……"
+
+
+def format_knowledge_entry(index: int, result: Dict[str, Any]) -> str:
+    """将一条检索结果格式化为分析步骤知识输入中的一段"""
+    source = result["metadata"].get("source", "未知来源")
+    rule_id = result["metadata"].get("rule_id")
+    if rule_id:
+        source = f"{source} 规则 {rule_id}"
+    matched = "；".join(result.get("matched_queries", []))
+    header = f"[{index}] 来源: {source}（相关查询: {matched}）" if matched else f"[{index}] 来源: {source}"
+    return f"{header}\n{result['content']}"
+
+
+def format_knowledge(results: List[Dict[str, Any]]) -> str:
+    """将检索结果格式化为分析步骤的知识输入"""
+    return "\n\n".join(format_knowledge_entry(i, result) for i, result in enumerate(results, 1))
+
+
+def _context_tokens(results: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(format_knowledge_entry(i, result)) + 1 for i, result in enumerate(results, 1))
+
+
+def _filter_by_score(results: List[Dict[str, Any]], relative_margin: float,
+                     min_results: int) -> List[Dict[str, Any]]:
+    """丢弃距离明显大于本次最佳结果的命中（results 按距离升序）"""
+    if not results:
+        return results
+    threshold = results[0]["score"] * (1 + relative_margin)
+    return [result for i, result in enumerate(results) if i < min_results or result["score"] <= threshold]
+
+
+def _merge_overlaps(results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    合并同一文件同一页中位置重叠的文本块。
+
+    合并后的段落使用各文本块中最小的距离和最相关文本块的元数据，命中查询取并集，
+    metadata 的 merged_chunk_ids 记录被合并的文本块。
+
+    Returns:
+        (按距离升序的结果, 合并掉的文本块数)
+    """
+    groups: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+    passages: List[Dict[str, Any]] = []
+    for result in results:
+        if result["metadata"].get("start_index") is None:
+            passages.append(result)
+        else:
+            groups.setdefault((result["metadata"].get("source"), result["metadata"].get("page")), []).append(result)
+
+    merged_count = 0
+    for members in groups.values():
+        members.sort(key=lambda r: r["metadata"]["start_index"])
+        current = None
+        for result in members:
+            start = result["metadata"]["start_index"]
+            if current is not None:
+                current_start = current["metadata"]["start_index"]
+                overlap = current_start + len(current["content"]) - start
+                content = result["content"]
+                # 只在重叠部分的文本确实一致时合并（start_index 异常时保持原样）
+                if overlap >= len(content) and content in current["content"]:
+                    _absorb(current, result, current["content"])
+                    merged_count += 1
+                    continue
+                if 0 < overlap < len(content) and current["content"].endswith(content[:overlap]):
+                    _absorb(current, result, current["content"] + content[overlap:])
+                    merged_count += 1
+                    continue
+                passages.append(current)
+            current = {
+                **result,
+                "metadata": dict(result["metadata"]),
+                "matched_queries": list(result.get("matched_queries", [])),
+            }
+        if current is not None:
+            passages.append(current)
+
+    passages.sort(key=lambda r: r["score"])
+    return passages, merged_count
+
+
+def _absorb(passage: Dict[str, Any], result: Dict[str, Any], content: str) -> None:
+    """把 result 并入 passage（passage 的起始位置不变）"""
+    start_index = passage["metadata"]["start_index"]
+    if result["score"] < passage["score"]:
+        passage["metadata"] = dict(result["metadata"])
+        passage["score"] = result["score"]
+    passage["metadata"]["start_index"] = start_index
+    merged_ids = passage["metadata"].setdefault(
+        "merged_chunk_ids", [passage["metadata"].get("chunk_id")]
+    )
+    if result["metadata"].get("chunk_id") not in merged_ids:
+        merged_ids.append(result["metadata"].get("chunk_id"))
+    passage["content"] = content
+    for query in result.get("matched_queries", []):
+        if query not in passage["matched_queries"]:
+            passage["matched_queries"].append(query)
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本使其估算 token 数不超过 max_tokens（含结尾标记）"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle] + TRUNCATION_MARK) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + TRUNCATION_MARK
+
+
+def _apply_budget(results: List[Dict[str, Any]], token_budget: int) -> List[Dict[str, Any]]:
+    """按相关度依次放入结果，总 token 数不超过预算；第一段就超出时截断它"""
+    kept: List[Dict[str, Any]] = []
+    used_tokens = 0
+    for result in results:
+        entry_tokens = estimate_tokens(format_knowledge_entry(len(kept) + 1, result)) + 1
+        if used_tokens + entry_tokens > token_budget:
+            if not kept:
+                header_tokens = estimate_tokens(format_knowledge_entry(1, {**result, "content": ""})) + 1
+                content_budget = max(1, token_budget - header_tokens)
+                kept.append({**result, "content": _truncate_to_tokens(result["content"], content_budget)})
+            break
+        kept.append(result)
+        used_tokens += entry_tokens
+    return kept
+
+
+def compress_knowledge(results: List[Dict[str, Any]],
+                       token_budget: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    压缩检索结果：合并重叠、按自适应阈值过滤低相关结果、裁剪到 token 预算。
+
+    统计同时上报到当前运行的时间线和指标。KNOWLEDGE_CONTEXT_COMPRESSION 关闭时原样返回。
+
+    Args:
+        results: 按距离升序排列的检索结果（search / search_many / merge_query_results 的输出）
+        token_budget: token 预算，默认使用 settings.KNOWLEDGE_CONTEXT_TOKEN_BUDGET
+
+    Returns:
+        (压缩后按距离升序的结果, 统计)，统计包含 tokens_before、tokens_after、tokens_saved、
+        merged_chunks、dropped_low_score、dropped_over_budget
+    """
+    if not settings.KNOWLEDGE_CONTEXT_COMPRESSION or not results:
+        return results, {}
+    if token_budget is None:
+        token_budget = settings.KNOWLEDGE_CONTEXT_TOKEN_BUDGET
+
+    tokens_before = _context_tokens(results)
+    filtered = _filter_by_score(
+        results, settings.KNOWLEDGE_SCORE_RELATIVE_MARGIN, max(1, settings.KNOWLEDGE_MIN_RESULTS)
+    )
+    passages, merged_chunks = _merge_overlaps(filtered)
+    compressed = _apply_budget(passages, token_budget)
+    tokens_after = _context_tokens(compressed)
+
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": max(0, tokens_before - tokens_after),
+        "merged_chunks": merged_chunks,
+        "dropped_low_score": len(results) - len(filtered),
+        "dropped_over_budget": len(passages) - len(compressed),
+    }
+    record_context_compression(stats)
+    registry = get_metrics_registry()
+    registry.observe("knowledge_context.tokens", tokens_after, TOKEN_BUCKETS)
+    registry.observe("knowledge_context.tokens_saved", stats["tokens_saved"], TOKEN_BUCKETS)
+    registry.increment("knowledge_context.tokens_saved_total", stats["tokens_saved"])
+    logger.debug(f"知识上下文压缩: {stats}")
+    return compressed, stats
+
+
+def build_knowledge_context(results: List[Dict[str, Any]], token_budget: Optional[int] = None) -> str:
+    """压缩检索结果并格式化为分析步骤的知识输入"""
+    compressed, _ = compress_knowledge(results, token_budget)
+    return format_knowledge(compressed)
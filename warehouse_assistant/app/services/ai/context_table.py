@@ -0,0 +1,198 @@
+"""
+预计算知识上下文表模块
+事件的操作类型来自固定词表，检索查询由固定模板生成（见 event_features），因此可以在构建知识库后
+为每个操作类型的每条固定查询预先执行检索，把结果保存为查找表 (context_table.json，位于 ChromaDB 持久化目录)。
+风险评估时命中表的查询直接查表，只有表中没有的查询（如附带缺陷类型的质检查询、词表外的操作类型）才做向量检索。
+
+查找表记录构建时的知识库构建标识（见 kb_manifest.kb_build_id）和查询模板版本，与当前知识库构建不一致时
+（包括文本不变的重新标注和重新嵌入）整体失效，回退到向量检索。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.event_features import (
+    OPERATION_TYPES, enumerate_table_queries, group_queries_by_filter, query_filter
+)
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TABLE_FILE_NAME = "context_table.json"
+
+
+def context_table_path(persist_directory: Optional[str] = None) -> str:
+    """查找表文件路径，位于 ChromaDB 持久化目录下"""
+    return os.path.join(persist_directory or settings.CHROMA_PERSIST_DIRECTORY, CONTEXT_TABLE_FILE_NAME)
+
+
+def table_version(operation_types: Iterable[str], k: int) -> str:
+    """查询集合、各查询的过滤条件和每条查询结果数的摘要；修改查询模板、过滤规则或词表后自动失效"""
+    digest = hashlib.sha1()
+    for operation_type in operation_types:
+        for query in enumerate_table_queries(operation_type):
+            search_filter = json.dumps(query_filter(operation_type, query), sort_keys=True, ensure_ascii=False)
+            digest.update(f"{operation_type}\t{query}\t{search_filter}\n".encode("utf-8"))
+    digest.update(f"k={k}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def build_context_table(knowledge_service, operation_types: Iterable[str] = OPERATION_TYPES,
+                        k: Optional[int] = None) -> Dict[str, Any]:
+    """
+    为每个操作类型的全部固定查询执行检索，生成查找表。
+
+    检索条件与风险评估一致：按 group_queries_by_filter 分组过滤（质检查询额外包含质检类规则），
+    某组过滤后没有结果时该组不过滤重试。
+
+    Args:
+        knowledge_service: 已加载的 KnowledgeBaseService
+        operation_types: 操作类型词表
+        k: 每条查询保存的结果数，默认 RETRIEVAL_K_PER_QUERY
+
+    Returns:
+        {"kb_version", "build_id", "table_version", "k", "built_at", "entries": {operation_type: {query: [result, ...]}}}
+    """
+    if not knowledge_service.is_ready:
+        raise RuntimeError("知识库尚未加载，无法构建知识上下文表")
+    operation_types = list(operation_types)
+    k = k or settings.RETRIEVAL_K_PER_QUERY
+    kb_version = knowledge_service.kb_version
+    build_id = knowledge_service.build_id
+
+    entries: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    for operation_type in operation_types:
+        queries = enumerate_table_queries(operation_type)
+        entries[operation_type] = {}
+        for search_filter, group in group_queries_by_filter(operation_type, queries):
+            all_results = knowledge_service.search_per_query(group, k=k, filter=search_filter)
+            if search_filter is not None and not any(all_results):
+                all_results = knowledge_service.search_per_query(group, k=k)
+            entries[operation_type].update(zip(group, all_results))
+        logger.info(f"操作类型 {operation_type}: 预计算 {len(queries)} 条查询")
+
+    if knowledge_service.build_id != build_id:
+        raise RuntimeError(f"构建期间知识库已重建 ({build_id} -> {knowledge_service.build_id})，请重新构建")
+    return {
+        "kb_version": kb_version,
+        "build_id": build_id,
+        "table_version": table_version(operation_types, k),
+        "operation_types": operation_types,
+        "k": k,
+        "built_at": datetime.utcnow().isoformat(),
+        "entries": entries,
+    }
+
+
+def save_context_table(table: Dict[str, Any], persist_directory: Optional[str] = None) -> None:
+    """原子地写入查找表"""
+    path = context_table_path(persist_directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def rebuild_context_table(persist_directory: Optional[str] = None) -> Dict[str, Any]:
+    """加载知识库服务（当前进程中尚未加载时），构建并写入查找表，返回查找表"""
+    from warehouse_assistant.app.services.ai.knowledge_base import KnowledgeBaseService
+
+    knowledge_service = KnowledgeBaseService()
+    if not knowledge_service.ensure_loaded():
+        raise RuntimeError(f"知识库加载失败: {knowledge_service.last_error}")
+    table = build_context_table(knowledge_service)
+    save_context_table(table, persist_directory)
+    return table
+
+
+class ContextTable:
+    """查找表的只读访问，文件被替换后自动重新加载"""
+
+    def __init__(self, persist_directory: Optional[str] = None):
+        self.path = context_table_path(persist_directory)
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._table: Optional[Dict[str, Any]] = None
+        self._stale_warned: Optional[Tuple[Optional[str], Optional[str]]] = None
+        # 当前查找表在各 k 下应有的查询模板版本，重新加载后清空
+        self._expected_versions: Dict[int, str] = {}
+
+        registry = get_metrics_registry()
+        registry.register_gauge("context_table.kb_version", lambda: (self._table or {}).get("kb_version"))
+
+    def _refresh(self) -> Optional[Dict[str, Any]]:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self._table = None
+                self._expected_versions = {}
+                if mtime is not None:
+                    try:
+                        with open(self.path, 'r', encoding='utf-8') as f:
+                            self._table = json.load(f)
+                        logger.info(f"已加载知识上下文表，知识库版本 {self._table.get('kb_version')}")
+                    except Exception as e:
+                        logger.error(f"读取知识上下文表失败: {e}", exc_info=True)
+            return self._table
+
+    def _usable(self, table: Optional[Dict[str, Any]], build_id: Optional[str], k: int) -> bool:
+        """查找表与当前知识库构建、查询模板和结果数一致时才可用"""
+        if table is None or build_id is None:
+            return False
+        expected = self._expected_versions.get(k)
+        if expected is None:
+            expected = self._expected_versions[k] = table_version(table.get("operation_types", []), k)
+        if table.get("build_id") == build_id and table.get("k") == k and table.get("table_version") == expected:
+            return True
+        if self._stale_warned != (table.get("build_id"), build_id):
+            self._stale_warned = (table.get("build_id"), build_id)
+            logger.warning(
+                f"知识上下文表 (知识库构建 {table.get('build_id')}) 与当前知识库构建 {build_id} 或查询模板不一致，"
+                f"回退到向量检索，请运行 scripts/build_context_table.py 重新构建"
+            )
+        return False
+
+    def lookup(self, operation_type: Optional[str], queries: List[str], build_id: Optional[str],
+               k: int) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+        """
+        查表获取各查询的检索结果。
+
+        Args:
+            operation_type: 事件操作类型
+            queries: 事件的检索查询
+            build_id: 当前知识库构建标识
+            k: 每条查询的结果数
+
+        Returns:
+            (命中的 {query: results}, 未命中需要向量检索的查询列表)
+        """
+        table = self._refresh()
+        if not settings.CONTEXT_TABLE_ENABLED or not operation_type or not self._usable(table, build_id, k):
+            return {}, list(queries)
+        entries = table["entries"].get(operation_type, {})
+        hits = {query: entries[query] for query in queries if query in entries}
+        misses = [query for query in queries if query not in entries]
+        registry = get_metrics_registry()
+        registry.increment("context_table.hit", len(hits))
+        registry.increment("context_table.miss", len(misses))
+        return hits, misses
+
+
+_context_table: Optional[ContextTable] = None
+
+
+def get_context_table() -> ContextTable:
+    """获取知识上下文表单例"""
+    global _context_table
+    if _context_table is None:
+        _context_table = ContextTable()
+    return _context_table
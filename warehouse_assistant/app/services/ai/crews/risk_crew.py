@@ -1,105 +1,380 @@
 from crewai import Crew, Process, Task
+import json
 import logging
-from warehouse_assistant.app.services.ai.agents.risk_agents import (
-    data_fetcher_agent, knowledge_retriever_agent, 
-    risk_analyzer_agent, result_writer_agent,
-    get_event_tool, update_risk_tool, knowledge_search_tool
-)
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.models.schemas import RiskAssessment
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+from warehouse_assistant.app.services.ai.batch_context import get_batch_context_cache
+from warehouse_assistant.app.services.ai.event_features import build_retrieval_queries, group_queries_by_filter
+from warehouse_assistant.app.services.ai.context_builder import build_knowledge_context
+from warehouse_assistant.app.services.ai.context_table import get_context_table
+from warehouse_assistant.app.services.ai.knowledge_base import get_knowledge_service, merge_query_results
+from warehouse_assistant.app.services.ai.rule_index import get_rule_index
+from warehouse_assistant.app.services.ai.run_control import RunCancelled, RunDeadline
+from warehouse_assistant.app.services.ai.run_timeline import RunTimeline, record_knowledge_refs, timed
+from warehouse_assistant.app.services.ai.agents.risk_agents import risk_analyzer_agent
 
 logger = logging.getLogger(__name__)
 
+# 匹配输出文本中的 JSON 对象（从第一个 "{" 到最后一个 "}"）
+_JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+# 事件上的风险评估记录字段（上一次的结果、失败原因、运行时间线等），不提供给分析步骤
+EVENT_BOOKKEEPING_FIELDS = (
+    "risk_assessment", "previous_risk_assessment", "risk_assessment_error", "requeue_reason",
+    "risk_timeout_count", "risk_run_timeline",
+)
+
+# 分析步骤的输出格式要求
+RISK_OUTPUT_INSTRUCTIONS = (
+    "请严格输出一个 JSON 对象，不要包含其他文字，字段如下：\n"
+    "- risk_level: 风险等级，只能是 '高'、'中'、'低'、'无' 之一\n"
+    "- risk_type: 风险类型，如 '参数偏差'、'质量问题'、'程序违规'、'操作延迟'、'数据不一致'、'无'\n"
+    "- reason: 对评估结果的简明解释\n"
+    "- suggestion: 简短的后续行动或预防措施（可选）"
+)
+
+
+def parse_risk_assessment(output: Any) -> RiskAssessment:
+    """
+    将分析步骤的输出解析并校验为 RiskAssessment 模型。
+
+    优先使用 CrewAI 任务输出中已经结构化的 pydantic / json_dict 结果，
+    否则从原始文本中提取 JSON 对象再校验。
+
+    Args:
+        output: CrewAI 的 TaskOutput / CrewOutput 或纯文本
+
+    Returns:
+        校验通过的 RiskAssessment 实例
+
+    Raises:
+        ValueError: 输出中没有 JSON 对象或未通过模型校验（pydantic 的 ValidationError 是其子类）
+    """
+    pydantic_output = getattr(output, "pydantic", None)
+    if isinstance(pydantic_output, RiskAssessment):
+        return pydantic_output
+
+    json_output = getattr(output, "json_dict", None)
+    if json_output:
+        return RiskAssessment.model_validate(json_output)
+
+    text = str(getattr(output, "raw", output) or "")
+    match = _JSON_OBJECT_PATTERN.search(text)
+    if not match:
+        raise ValueError(f"输出中未找到 JSON 对象: {text[:200]}")
+    return RiskAssessment.model_validate_json(match.group(0))
+
+
 class RiskAssessmentCrew:
     """
     风险评估Crew，负责协调多个Agent完成对事件的风险评估。
+
+    上下文加载、知识检索和风险分析按顺序分阶段执行；事件数据和批次历史直接从数据库预取，
+    知识检索根据事件特征确定性地构建多条查询并行检索，都不经过 LLM，只有风险分析阶段调用 LLM。分析结果必须通过
+    RiskAssessment 模型校验，校验失败时只重跑分析阶段（次数受
+    settings.RISK_OUTPUT_MAX_RETRIES 限制），校验通过后直接写回数据库。
+    每次运行的各阶段耗时和 token 用量记录在 RunTimeline 中，并随事件一起保存。
+    每个 LLM 阶段受 RunDeadline 的阶段超时和整体截止时间约束，超时的运行以 timed_out 结束，
+    并在次数上限内重新排队。
     """
 
     def __init__(self, event_id: str):
         """
         初始化风险评估Crew。
-        
+
         Args:
             event_id: 要评估的事件ID
         """
         self.event_id = event_id
-        
-        # 为Agent添加工具 - 使用正确的方式添加工具
-        data_fetcher_agent.tools = [get_event_tool]
-        knowledge_retriever_agent.tools = [knowledge_search_tool]
-        result_writer_agent.tools = [update_risk_tool]
-        
-        # 创建任务
-        fetch_data_task = Task(
-            description=f"获取事件ID为 {event_id} 的完整数据",
-            expected_output="事件的完整JSON数据",
-            agent=data_fetcher_agent
+        self.max_retries = max(0, settings.RISK_OUTPUT_MAX_RETRIES)
+        self.event: Dict[str, Any] = {}
+        self.batch_history = ""
+        self.timeline = RunTimeline(event_id)
+        self.deadline = RunDeadline(settings.RISK_RUN_TIMEOUT_SECONDS, settings.RISK_STAGE_TIMEOUT_SECONDS)
+
+    def _load_context(self) -> None:
+        """预取事件并生成同批次历史摘要（在阶段线程中执行，受阶段超时和整体截止时间约束）"""
+        with self.timeline.stage("load_context"):
+            self.event, self.batch_history = self.deadline.call(
+                "load_context", self._read_context, context=self.timeline.activate
+            )
+
+    def _read_context(self) -> Tuple[Dict[str, Any], str]:
+        """读取事件和同批次历史摘要（批次历史由缓存一次加载、增量追加），出库事件同时关闭所属批次"""
+        db_service = get_db_service()
+        with timed("db_read"):
+            event = db_service.get_event_by_id(self.event_id) or {}
+        # 出库事件无论评估结果如何都关闭所属批次（外部系统直接写入的事件不经过 insert_trace_event）
+        db_service.close_batch_if_outbound(event)
+        batch_history = ""
+        if event.get("batch_id"):
+            batch_cache = get_batch_context_cache()
+            batch_cache.observe_event(event)
+            batch_history = batch_cache.summarize_history(event)
+        return event, batch_history
+
+    def _run_stage(self, stage_name: str, agent, task: Task) -> Any:
+        """
+        以单任务 Crew 的形式运行一个阶段，返回该任务的输出。
+
+        Args:
+            stage_name: 阶段名称（记录到时间线）
+            agent: 执行该阶段的 Agent
+            task: 该阶段的任务
+
+        Returns:
+            任务输出（TaskOutput），旧版本 CrewAI 下可能是字符串
+        """
+        with self.timeline.stage(stage_name, agent=agent.role) as stage:
+            crew = Crew(
+                agents=[agent],
+                tasks=[task],
+                process=Process.sequential,
+                verbose=True,
+                memory=False,
+                step_callback=self._on_agent_step
+            )
+            # 在独立线程中执行，超时后不再等待；阶段线程中同样激活本次运行的时间线
+            result = self.deadline.call(stage_name, crew.kickoff, context=self.timeline.activate)
+            # LLM 实现未直接上报用量时，使用 CrewAI 统计的本阶段 token 用量
+            usage = getattr(result, "token_usage", None)
+            if usage is not None and not (stage["prompt_tokens"] or stage["completion_tokens"]):
+                stage["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+                stage["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+        return task.output if task.output is not None else result
+
+    def _on_agent_step(self, step: Any) -> None:
+        """Agent 每完成一步的回调，作为协作式取消的检查点"""
+        self.deadline.check()
+
+    def _format_event_data(self) -> str:
+        """将预取的事件格式化为分析步骤的事件数据（去掉风险评估记录字段）"""
+        event = {key: value for key, value in self.event.items() if key not in EVENT_BOOKKEEPING_FIELDS}
+        if "_id" in event:
+            event["_id"] = str(event["_id"])
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+    def _retrieve_knowledge(self) -> str:
+        """
+        阶段二：检索与事件相关的知识。
+
+        根据操作类型、超出范围的参数和质检结果构建多条查询，合并去重后直接作为分析步骤的知识输入，不需要 LLM 参与。
+        固定模板生成的查询直接从预计算的知识上下文表取结果；表中没有的查询（附带缺陷类型的质检查询、
+        词表外的操作类型等）一次批量向量化后并行检索。
+        检索只在适用于事件操作类别的文本块中进行，质检结果查询额外包含质检类规则（查询按过滤条件分组批量检索）；
+        某组过滤后没有结果（如知识库尚未按新规则标注）时该组不过滤重试。
+        结果经 context_builder 合并重叠、过滤低相关结果并裁剪到 token 预算后再提供给分析步骤。
+        检索（包括等待知识库加载、嵌入服务和 ChromaDB 调用）在阶段线程中执行，受阶段超时和整体截止时间约束。
+        """
+        with self.timeline.stage("retrieve_knowledge"):
+            return self.deadline.call("retrieve_knowledge", self._search_knowledge, context=self.timeline.activate)
+
+    def _search_knowledge(self) -> str:
+        """构建检索查询，查表并检索表中没有的查询，返回压缩后的知识输入"""
+        queries = build_retrieval_queries(self.event)
+        if not queries:
+            logger.warning(f"事件 {self.event_id} 缺少可用于检索的特征，跳过知识检索")
+            return ""
+        knowledge_service = get_knowledge_service()
+        self.deadline.check()
+        k = settings.RETRIEVAL_K_PER_QUERY
+        kb_version, build_id = knowledge_service.current_build()
+        with timed("context_table_lookup"):
+            table_results, remaining = get_context_table().lookup(
+                self.event.get("operation_type"), queries, build_id, k
+            )
+        if not remaining:
+            results = merge_query_results(
+                list(table_results), list(table_results.values()), settings.RETRIEVAL_MAX_RESULTS
+            )
+            record_knowledge_refs((r["metadata"].get("chunk_id") for r in results), kb_version)
+            return build_knowledge_context(results)
+
+        per_query = dict(table_results)
+        for search_filter, group in group_queries_by_filter(self.event.get("operation_type"), remaining):
+            self.deadline.check()
+            searched = knowledge_service.search_many(group, k=k, filter=search_filter)
+            if not searched and search_filter is not None:
+                logger.info(f"事件 {self.event_id} 按操作类型过滤后没有检索结果，改为不过滤检索: {group}")
+                searched = knowledge_service.search_many(group, k=k)
+            # 向量检索的结果已按查询合并，拆回逐查询的形式，与其他组和查表结果一起按文本块去重
+            for query in group:
+                per_query[query] = [r for r in searched if query in r["matched_queries"]]
+        ordered = [query for query in queries if query in per_query]
+        results = merge_query_results(
+            ordered, [per_query[query] for query in ordered], settings.RETRIEVAL_MAX_RESULTS
         )
-        
-        retrieve_knowledge_task = Task(
-            description="基于事件数据，从知识库中检索相关的标准、规范或历史风险模式",
-            expected_output="与事件相关的知识库内容",
-            agent=knowledge_retriever_agent
+        record_knowledge_refs((r["metadata"].get("chunk_id") for r in results), kb_version)
+        return build_knowledge_context(results)
+
+    def _analyze_risk(self, event_data: str, knowledge: str, feedback: Optional[str] = None) -> Any:
+        """
+        阶段三：分析风险，输出 RiskAssessment 结构。
+
+        Args:
+            event_data: 事件数据
+            knowledge: 知识检索结果
+            feedback: 上一次输出的校验错误，重试时提供给 Agent 修正
+
+        Returns:
+            分析任务的输出
+        """
+        description = (
+            "分析以下事件数据和知识库信息，评估潜在风险并提出建议。\n\n"
+            f"事件数据：\n{event_data}\n\n"
+            f"知识库信息：\n{knowledge}\n\n"
         )
-        
+        if self.batch_history:
+            description += f"同批次此前的事件（按时间顺序）：\n{self.batch_history}\n\n"
+        rule_catalog = get_rule_index().catalog()
+        if rule_catalog:
+            # 只列编号和标题，需要原文时由 Agent 通过 get_rule_tool 按编号精确获取
+            catalog_lines = "\n".join(f"规则 {rule['rule_id']}: {rule['title']}" for rule in rule_catalog)
+            description += f"可按编号查询原文的规则（使用 get_rule_tool）：\n{catalog_lines}\n\n"
+        description += RISK_OUTPUT_INSTRUCTIONS
+        if feedback:
+            description += f"\n\n上一次的输出未通过格式校验，请修正后重新输出。校验错误：{feedback}"
+
         analyze_risk_task = Task(
-            description="分析事件数据和知识库信息，评估潜在风险并提出建议",
-            expected_output="包含风险等级、类型、原因和建议的风险评估结果",
-            agent=risk_analyzer_agent
-        )
-        
-        write_result_task = Task(
-            description=f"将风险评估结果更新到事件 {event_id} 中",
-            expected_output="更新操作的结果确认",
-            agent=result_writer_agent
+            description=description,
+            expected_output="包含 risk_level、risk_type、reason、suggestion 字段的 JSON 风险评估结果",
+            agent=risk_analyzer_agent,
+            output_pydantic=RiskAssessment
         )
-        
-        # 创建Crew
-        self.crew = Crew(
-            agents=[
-                data_fetcher_agent,
-                knowledge_retriever_agent,
-                risk_analyzer_agent,
-                result_writer_agent
-            ],
-            tasks=[
-                fetch_data_task,
-                retrieve_knowledge_task,
-                analyze_risk_task,
-                write_result_task
-            ],
-            process=Process.sequential,
-            verbose=True,
-            memory=False
-        )
-    
-    def run(self):
+        return self._run_stage("analyze_risk", risk_analyzer_agent, analyze_risk_task)
+
+    def _write_result(self, assessment: RiskAssessment) -> bool:
+        """将校验通过的风险评估结果写回数据库"""
+        risk_assessment = assessment.model_dump()
+        risk_assessment["analysis_timestamp"] = datetime.utcnow()
+        # 记录本次引用的知识库文本块和版本，知识库更新后据此选择性重新评估
+        risk_assessment["knowledge_refs"] = self.timeline.knowledge_refs()
+        with self.timeline.stage("write_result"), timed("db_write"):
+            updated = get_db_service().update_event_risk(self.event_id, risk_assessment)
+        if not updated:
+            return False
+        if self.event.get("batch_id"):
+            get_batch_context_cache().record_risk(self.event["batch_id"], self.event_id, assessment.risk_level)
+        return True
+
+    def _record_failure(self, attempts: int, errors: List[str]) -> None:
+        """记录分析结果始终未通过校验的原因"""
+        get_db_service().record_risk_failure(self.event_id, {
+            "reason": "validation_failed",
+            "attempts": attempts,
+            "errors": errors,
+            "timestamp": datetime.utcnow()
+        })
+
+    def _record_timeout(self, error: RunCancelled) -> bool:
+        """
+        记录超时，并在次数上限内将事件重新排队。
+
+        Returns:
+            是否已重新排队
+        """
+        timeout_count = int(self.event.get("risk_timeout_count", 0) or 0)
+        requeue = timeout_count < settings.RISK_TIMEOUT_MAX_REQUEUES
+        get_db_service().record_risk_timeout(self.event_id, {
+            "reason": "timed_out",
+            "stage": getattr(error, "stage", None),
+            "message": str(error),
+            "timestamp": datetime.utcnow()
+        }, requeue=requeue)
+        return requeue
+
+    def run(self) -> Dict[str, Any]:
         """
         运行风险评估Crew。
-        
+
         Returns:
-            风险评估的结果
+            风险评估的结果，包含 status、message、attempts、validation_errors 和 timeline
         """
+        with self.timeline.activate():
+            result = self._execute()
+        self.timeline.finish(result.get("status", "error"))
+        timeline = self.timeline.to_dict()
+        # 时间线与评估结果一起保存在事件上，失败的运行同样保存
+        if not get_db_service().save_risk_run_timeline(self.event_id, timeline):
+            logger.warning(f"事件 {self.event_id} 的运行时间线保存失败")
+        result["timeline"] = timeline
+        return result
+
+    def _execute(self) -> Dict[str, Any]:
+        """依次执行各阶段，返回风险评估结果"""
         try:
             logger.info(f"开始为事件 {self.event_id} 运行风险评估，将使用知识库进行分析")
-            
-            # 运行Crew
-            result = self.crew.kickoff()
-            
-            # 记录原始结果以便调试
-            logger.info(f"Crew返回的原始结果: '{result}'")
-            
-            # 更宽松的成功判断逻辑
-            if isinstance(result, str):
-                result_lower = result.lower()
-                success_indicators = ["success", "updated", "完成", "成功"]
-                
-                if any(indicator in result_lower for indicator in success_indicators):
-                    logger.info(f"事件 {self.event_id} 的风险评估成功完成: {result}")
-                    return {"status": "success", "message": result}
-            
-            # 如果不符合成功条件，则视为失败
-            logger.error(f"事件 {self.event_id} 的风险评估更新可能失败。最后输出: {result}")
-            return {"status": "error", "message": f"更新失败或确认信息不明确: {result}"}
-            
+
+            self._load_context()
+            if not self.event:
+                logger.error(f"未找到事件 {self.event_id}，无法进行风险评估")
+                return {"status": "error", "message": f"未找到ID为 {self.event_id} 的事件"}
+            event_data = self._format_event_data()
+            knowledge = self._retrieve_knowledge()
+
+            validation_errors: List[str] = []
+            assessment: Optional[RiskAssessment] = None
+            attempts = 0
+            # 首次分析 + 最多 max_retries 次仅因校验失败触发的重试
+            while attempts <= self.max_retries:
+                attempts += 1
+                feedback = validation_errors[-1] if validation_errors else None
+                output = self._analyze_risk(event_data, knowledge, feedback)
+                try:
+                    assessment = parse_risk_assessment(output)
+                    break
+                except ValueError as ve:
+                    error = str(ve)
+                    validation_errors.append(error)
+                    logger.warning(
+                        f"事件 {self.event_id} 的分析输出未通过校验（第 {attempts} 次）: {error}"
+                    )
+
+            if assessment is None:
+                logger.error(f"事件 {self.event_id} 的分析输出在 {attempts} 次尝试后仍未通过校验")
+                self._record_failure(attempts, validation_errors)
+                return {
+                    "status": "error",
+                    "message": "风险分析输出未通过校验",
+                    "attempts": attempts,
+                    "validation_errors": validation_errors
+                }
+
+            if not self._write_result(assessment):
+                logger.error(f"事件 {self.event_id} 的风险评估结果写入数据库失败")
+                return {
+                    "status": "error",
+                    "message": "风险评估结果写入数据库失败",
+                    "risk_assessment": assessment.model_dump(),
+                    "attempts": attempts,
+                    "validation_errors": validation_errors
+                }
+
+            logger.info(f"事件 {self.event_id} 的风险评估成功完成: {assessment.model_dump()}")
+            return {
+                "status": "success",
+                "message": f"Successfully updated risk assessment for event {self.event_id}",
+                "risk_assessment": assessment.model_dump(),
+                "attempts": attempts,
+                "validation_errors": validation_errors
+            }
+
+        except RunCancelled as e:
+            requeued = self._record_timeout(e)
+            logger.error(
+                f"事件 {self.event_id} 的风险评估超时: {e}"
+                + ("，已重新排队" if requeued else "，已达到重新排队次数上限")
+            )
+            return {
+                "status": "timed_out",
+                "message": f"风险评估超时: {e}",
+                "stage": getattr(e, "stage", None),
+                "requeued": requeued
+            }
         except Exception as e:
             logger.error(f"执行 event_id {self.event_id} 的 Crew 流程时发生异常: {e}", exc_info=True)
             return {"status": "error", "message": f"Crew 执行失败: {str(e)}"}
@@ -107,22 +382,22 @@ class RiskAssessmentCrew:
 def run_risk_assessment_for_event(event_id: str):
     """
     为指定的事件运行风险评估。
-    
+
     Args:
         event_id: 要评估的事件ID
-        
+
     Returns:
         风险评估的结果
     """
     try:
         logger.info(f"开始为事件 {event_id} 运行风险评估...")
-        
+
         # 创建风险评估Crew
         crew = RiskAssessmentCrew(event_id)
-        
+
         # 运行风险评估
         result = crew.run()
-        
+
         logger.info(f"事件 {event_id} 的风险评估完成，结果: {result}")
         return result
     except Exception as e:
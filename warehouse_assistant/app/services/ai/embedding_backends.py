@@ -0,0 +1,141 @@
+"""
+嵌入模型后端模块
+根据 EMBEDDING_BACKEND 创建底层嵌入模型：
+
+- torch: 通过 HuggingFaceEmbeddings (sentence-transformers) 加载；
+- onnx: 使用 ONNX Runtime 运行同一模型导出的（可选 int8 动态量化）计算图，
+  CPU 上延迟和常驻内存都明显低于 torch。模型需先用 scripts/export_onnx_embedding_model.py 导出。
+
+配置了 EMBEDDING_SERVICE_URL 时不在本进程加载模型，改为调用共享嵌入服务（见 embedding_client）。
+
+不同后端（以及量化与否）产生的向量存在细微差异，知识库清单记录构建时的嵌入模型标识，
+标识变化时 init_knowledge_base.py 自动全量重建，查询向量缓存也按该标识隔离。
+"""
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from warehouse_assistant.app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ("torch", "onnx")
+
+# 导出目录中的文件名
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_int8.onnx"
+ONNX_CONFIG_FILE = "embedding_config.json"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    ONNX Runtime 嵌入函数，与 sentence-transformers 的均值池化保持一致（不做归一化，
+    与 HuggingFaceEmbeddings 的默认行为相同），超过 max_seq_length 的文本同样被截断。
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = True, intra_op_threads: int = 0, batch_size: int = 32):
+        """
+        Args:
+            model_dir: 导出目录（包含 ONNX 模型、tokenizer.json 和 embedding_config.json）
+            quantized: 是否使用 int8 量化模型
+            intra_op_threads: ONNX Runtime 算子内线程数，0 表示使用默认值
+            batch_size: 单次前向计算的最大文本数（限制填充长度和内存占用）
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self.model_name = config["model_name"]
+        self.max_seq_length = int(config.get("max_seq_length", 128))
+        self.batch_size = max(1, batch_size)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=int(config.get("pad_token_id", 0)))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+        logger.info(f"Loaded ONNX embedding model {self.model_name} ({model_file})")
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        token_embeddings = self.session.run(None, feeds)[0]
+        # 均值池化：只对非填充位置求平均
+        mask = attention_mask[..., None].astype(np.float32)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = [
+            self._embed_batch(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        return np.concatenate(vectors).astype(np.float32).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def embedding_model_id(backend: Optional[str] = None) -> str:
+    """
+    嵌入模型标识：torch 后端为模型名称（与旧版清单兼容），onnx 后端附加量化方式。
+    标识不同的向量不能混用。
+    """
+    backend = backend or settings.EMBEDDING_BACKEND
+    if backend == "onnx":
+        precision = "int8" if settings.EMBEDDING_ONNX_QUANTIZED else "fp32"
+        return f"{settings.EMBEDDING_MODEL_NAME}@onnx-{precision}"
+    return settings.EMBEDDING_MODEL_NAME
+
+
+def create_base_embeddings(backend: Optional[str] = None) -> Embeddings:
+    """
+    按配置创建底层嵌入模型（不含缓存和微批处理）。
+
+    未指定 backend 且配置了 EMBEDDING_SERVICE_URL 时返回共享嵌入服务的客户端（创建时检查服务可用、
+    模型标识一致）；显式指定 backend 时总是在本进程加载模型（嵌入服务本身和后端对比脚本使用）。
+
+    Raises:
+        ValueError: 未知的后端名称
+        EmbeddingServiceError: 嵌入服务不可用或模型标识不一致
+    """
+    if backend is None and settings.EMBEDDING_SERVICE_URL:
+        from warehouse_assistant.app.services.ai.embedding_client import RemoteEmbeddings
+        remote = RemoteEmbeddings(
+            settings.EMBEDDING_SERVICE_URL,
+            timeout=settings.EMBEDDING_SERVICE_TIMEOUT_SECONDS,
+            expected_model=embedding_model_id(),
+        )
+        info = remote.check()
+        logger.info(f"Using shared embedding service at {settings.EMBEDDING_SERVICE_URL} ({info.get('model')})")
+        return remote
+    backend = backend or settings.EMBEDDING_BACKEND
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL_NAME)
+    if backend == "onnx":
+        return OnnxEmbeddings(
+            settings.EMBEDDING_ONNX_DIR,
+            quantized=settings.EMBEDDING_ONNX_QUANTIZED,
+            intra_op_threads=settings.EMBEDDING_ONNX_THREADS,
+        )
+    raise ValueError(f"未知的嵌入模型后端: {backend}，可选值: {', '.join(EMBEDDING_BACKENDS)}")
@@ -0,0 +1,91 @@
+"""
+嵌入请求微批处理模块
+多个风险评估线程同时检索时，各自的单句编码会分别执行一次模型前向计算，
+单次调用的固定开销和 torch 线程争用浪费大量 CPU。微批处理器把并发到达的编码请求
+收集起来（最多等待几毫秒或凑满 N 条），合并成一次批量前向计算后再按请求拆分结果。
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# 批大小直方图分桶
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """
+    微批处理嵌入函数。
+
+    调用方线程提交请求后阻塞等待结果；后台线程以第一个请求到达为起点，最多等待
+    max_wait_ms 或累计 max_batch_size 条文本，然后一次性调用底层模型。
+    """
+
+    def __init__(self, base: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        """
+        Args:
+            base: 底层嵌入函数
+            max_batch_size: 单批最多合并的文本数（单个请求超过该数量时整体作为一批）
+            max_wait_ms: 收集一批请求的最长等待时间（毫秒）
+        """
+        self.base = base
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def _collect_batch(self) -> List[Tuple[List[str], Future]]:
+        """阻塞等待第一个请求，然后在等待窗口内继续收集请求"""
+        batch = [self._queue.get()]
+        count = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request[0])
+        return batch
+
+    def _run(self) -> None:
+        registry = get_metrics_registry()
+        while True:
+            batch = self._collect_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = self.base.embed_documents(texts)
+            except Exception as e:
+                logger.error(f"批量编码 {len(texts)} 条文本失败: {e}", exc_info=True)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+            registry.observe("embedding_batcher.batch_size", len(texts), BATCH_SIZE_BUCKETS)
+            registry.observe("embedding_batcher.requests_per_batch", len(batch), BATCH_SIZE_BUCKETS)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        future: Future = Future()
+        self._queue.put((list(texts), future))
+        return future.result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
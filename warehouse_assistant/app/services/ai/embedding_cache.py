@@ -0,0 +1,226 @@
+"""
+查询向量缓存模块
+在嵌入模型前加一层缓存，避免语义相同的检索查询反复在 CPU 上重新编码：
+
+- 键为 (模型名称, 规范化后的查询文本)；
+- 内存中为 LRU 缓存，可选的磁盘层为 SQLite（向量以 float32 存储），进程重启后仍然有效；
+- 启动时从磁盘层按最近使用时间预热内存缓存；
+- 命中率等指标通过 /api/metrics 输出。
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：Unicode NFKC（全角转半角等）并合并空白字符"""
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class SqliteEmbeddingStore:
+    """向量缓存的 SQLite 磁盘层"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL, "
+            "vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings (model, last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _encode(vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """批量读取，并刷新命中条目的最近使用时间"""
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM query_embeddings WHERE key IN ({placeholders})", keys
+            ).fetchall()
+            if rows:
+                self._conn.executemany(
+                    "UPDATE query_embeddings SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key, _ in rows]
+                )
+                self._conn.commit()
+        return {key: self._decode(blob) for key, blob in rows}
+
+    def put_many(self, entries: List[tuple]) -> None:
+        """批量写入 (key, model, text, vector)"""
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO query_embeddings (key, model, text, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(key, model, text, self._encode(vector), now) for key, model, text, vector in entries]
+            )
+            self._conn.commit()
+
+    def recent(self, model: str, limit: int) -> List[tuple]:
+        """按最近使用时间倒序读取 (key, vector)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, vector FROM query_embeddings WHERE model = ? ORDER BY last_used DESC LIMIT ?",
+                (model, limit)
+            ).fetchall()
+        return [(key, self._decode(blob)) for key, blob in rows]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带缓存的嵌入函数。
+
+    embed_query / embed_queries 走缓存；embed_documents 用于文档入库，直接委托给底层模型。
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, max_entries: int = 2048,
+                 disk_path: Optional[str] = None):
+        """
+        Args:
+            base: 底层嵌入函数
+            model_name: 模型名称（作为缓存键的一部分，换模型后旧缓存自动失效）
+            max_entries: 内存 LRU 的最大条目数
+            disk_path: SQLite 磁盘层路径，为空则只使用内存缓存
+        """
+        self.base = base
+        self.model_name = model_name
+        self.max_entries = max(0, max_entries)
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.store: Optional[SqliteEmbeddingStore] = None
+        if disk_path:
+            try:
+                self.store = SqliteEmbeddingStore(disk_path)
+            except Exception as e:
+                logger.error(f"查询向量缓存磁盘层不可用，只使用内存缓存: {e}", exc_info=True)
+
+        registry = get_metrics_registry()
+        registry.register_gauge("embedding_cache.hit_rate", self.hit_rate)
+        registry.register_gauge("embedding_cache.memory_entries", lambda: len(self._memory))
+
+    def _key(self, normalized: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        """写入内存 LRU（调用方需持有锁）"""
+        if self.max_entries == 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        """内存和磁盘层合计的命中率"""
+        counters = get_metrics_registry().counters
+        hits = counters.get("embedding_cache.memory_hits", 0) + counters.get("embedding_cache.disk_hits", 0)
+        total = hits + counters.get("embedding_cache.misses", 0)
+        return round(hits / total, 4) if total else 0.0
+
+    def warm_up(self, limit: int) -> int:
+        """
+        从磁盘层按最近使用时间预热内存缓存。
+
+        Returns:
+            预热的条目数
+        """
+        if self.store is None or limit <= 0:
+            return 0
+        entries = self.store.recent(self.model_name, min(limit, self.max_entries))
+        with self._lock:
+            # 最近使用的放在 LRU 末尾
+            for key, vector in reversed(entries):
+                self._remember(key, vector)
+        logger.info(f"查询向量缓存已从磁盘预热 {len(entries)} 条")
+        return len(entries)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量获取查询向量：依次查内存层、磁盘层，剩余的未命中查询一次批量编码。
+
+        Args:
+            texts: 查询文本列表
+
+        Returns:
+            与输入顺序一致的向量列表
+        """
+        registry = get_metrics_registry()
+        normalized = [normalize_query(text) for text in texts]
+        keys = [self._key(text) for text in normalized]
+        vectors: Dict[str, List[float]] = {}
+
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    vectors[key] = self._memory[key]
+        memory_hits = len(vectors)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+        if missing and self.store is not None:
+            disk_vectors = self.store.get_many(missing)
+            vectors.update(disk_vectors)
+            with self._lock:
+                for key, vector in disk_vectors.items():
+                    self._remember(key, vector)
+            registry.increment("embedding_cache.disk_hits", len(disk_vectors))
+
+        to_embed = {key: text for key, text in zip(keys, normalized) if key not in vectors}
+        if to_embed:
+            # 所用句向量模型对查询和文档使用相同的编码方式，未命中的查询一次批量编码
+            embedded = self.base.embed_documents(list(to_embed.values()))
+            new_entries = []
+            with self._lock:
+                for (key, text), vector in zip(to_embed.items(), embedded):
+                    vectors[key] = vector
+                    self._remember(key, vector)
+                    new_entries.append((key, self.model_name, text, vector))
+            if self.store is not None:
+                try:
+                    self.store.put_many(new_entries)
+                except Exception as e:
+                    logger.warning(f"写入查询向量缓存磁盘层失败: {e}")
+            registry.increment("embedding_cache.misses", len(to_embed))
+
+        registry.increment("embedding_cache.memory_hits", memory_hits)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
@@ -0,0 +1,150 @@
+"""
+共享嵌入服务客户端模块
+配置了 EMBEDDING_SERVICE_URL 时，各进程（uvicorn worker、脚本）不再各自加载嵌入模型，
+而是把编码请求发送给同一个嵌入服务进程 (scripts/run_embedding_server.py)，由它持有唯一的模型实例，
+并把来自所有客户端的并发请求合并成批量前向计算。增加 API worker 时内存占用基本不变。
+
+地址支持 http://127.0.0.1:8765（本机 HTTP）和 unix:///path/to/embedding.sock（Unix 域套接字）。
+只使用标准库 http.client，每个线程保持一条长连接。
+"""
+import http.client
+import json
+import logging
+import socket
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# 单次请求最多发送的文本数，更多的文本分多次请求
+REQUEST_MAX_TEXTS = 256
+
+
+def parse_service_url(url: str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    """
+    解析嵌入服务地址。
+
+    Returns:
+        (host, port, unix_socket_path)，Unix 域套接字地址时 host 和 port 为 None
+
+    Raises:
+        ValueError: 不支持的地址格式
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        path = parsed.path or parsed.netloc
+        if not path:
+            raise ValueError(f"嵌入服务地址缺少套接字路径: {url}")
+        return None, None, path
+    if parsed.scheme == "http":
+        return parsed.hostname or "127.0.0.1", parsed.port or 80, None
+    raise ValueError(f"不支持的嵌入服务地址: {url}，应为 http://host:port 或 unix:///path/to/socket")
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过 Unix 域套接字通信的 HTTP 连接"""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class EmbeddingServiceError(RuntimeError):
+    """嵌入服务不可用或返回错误"""
+
+
+class RemoteEmbeddings(Embeddings):
+    """调用共享嵌入服务的嵌入函数"""
+
+    def __init__(self, url: str, timeout: float = 30.0, expected_model: Optional[str] = None):
+        """
+        Args:
+            url: 嵌入服务地址
+            timeout: 单次请求超时（秒）
+            expected_model: 期望的嵌入模型标识；与服务端不一致时 check() 抛出异常，避免混用不同模型的向量
+        """
+        self.url = url
+        self.timeout = timeout
+        self.expected_model = expected_model
+        self.host, self.port, self.socket_path = parse_service_url(url)
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.socket_path:
+                connection = _UnixHTTPConnection(self.socket_path, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _reset_connection(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+        self._local.connection = None
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """发送请求；长连接被服务端关闭（如服务重启）时重新连接重试一次"""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                self._reset_connection()
+                if attempt == 0 and not isinstance(e, socket.timeout):
+                    continue
+                raise EmbeddingServiceError(f"嵌入服务 {self.url} 请求失败: {e}") from e
+            if response.status != 200:
+                raise EmbeddingServiceError(
+                    f"嵌入服务 {self.url} 返回 {response.status}: {data[:200].decode('utf-8', 'replace')}"
+                )
+            return json.loads(data)
+        raise EmbeddingServiceError(f"嵌入服务 {self.url} 请求失败")
+
+    def info(self) -> Dict[str, Any]:
+        """服务端的模型标识、后端和向量维度"""
+        return self._request("GET", "/info")
+
+    def check(self) -> Dict[str, Any]:
+        """
+        检查服务是否可用以及模型标识是否与期望一致。
+
+        Raises:
+            EmbeddingServiceError: 服务不可用或模型标识不一致
+        """
+        info = self.info()
+        if self.expected_model and info.get("model") != self.expected_model:
+            raise EmbeddingServiceError(
+                f"嵌入服务使用的模型 '{info.get('model')}' 与本进程配置的 '{self.expected_model}' 不一致"
+            )
+        return info
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), REQUEST_MAX_TEXTS):
+            batch = texts[start:start + REQUEST_MAX_TEXTS]
+            response = self._request("POST", "/embed", {"texts": batch})
+            if self.expected_model and response.get("model") != self.expected_model:
+                raise EmbeddingServiceError(
+                    f"嵌入服务使用的模型 '{response.get('model')}' 与本进程配置的 '{self.expected_model}' 不一致"
+                )
+            vectors.extend(response["embeddings"])
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
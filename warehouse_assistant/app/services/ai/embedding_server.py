@@ -0,0 +1,72 @@
+"""
+共享嵌入服务模块
+持有唯一的嵌入模型实例，通过 HTTP（本机端口或 Unix 域套接字）为多个进程提供编码服务。
+同步接口在线程池中执行，并发到达的请求经 MicroBatchingEmbeddings 合并为一次批量前向计算。
+由 scripts/run_embedding_server.py 启动，客户端见 embedding_client.RemoteEmbeddings。
+"""
+import logging
+import time
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.embedding_backends import create_base_embeddings, embedding_model_id
+from warehouse_assistant.app.services.ai.embedding_batcher import BATCH_SIZE_BUCKETS, MicroBatchingEmbeddings
+from warehouse_assistant.app.services.ai.embedding_client import REQUEST_MAX_TEXTS
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str] = Field(description="待编码的文本")
+
+
+def create_embedding_app(backend: Optional[str] = None) -> FastAPI:
+    """
+    创建嵌入服务应用并加载模型。
+
+    Args:
+        backend: 本地嵌入模型后端（torch / onnx），默认 EMBEDDING_BACKEND；服务端总是在本进程加载模型
+    """
+    backend = backend or settings.EMBEDDING_BACKEND
+    model_id = embedding_model_id(backend)
+    logger.info(f"嵌入服务加载模型: {model_id}")
+    start = time.perf_counter()
+    embeddings = MicroBatchingEmbeddings(
+        create_base_embeddings(backend),
+        max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+        max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS
+    )
+    dimension = len(embeddings.embed_query("预热"))
+    logger.info(f"嵌入服务模型已加载（维度 {dimension}），耗时 {time.perf_counter() - start:.1f}s")
+
+    app = FastAPI(title="Embedding Service")
+    registry = get_metrics_registry()
+
+    @app.get("/info")
+    def info():
+        """模型标识、后端和向量维度，客户端据此确认与知识库使用的模型一致"""
+        return {"model": model_id, "backend": backend, "dimension": dimension}
+
+    @app.post("/embed")
+    def embed(request: EmbedRequest):
+        """编码一组文本（在线程池中执行，并发请求由微批处理器合并）"""
+        if len(request.texts) > REQUEST_MAX_TEXTS:
+            raise HTTPException(status_code=413, detail=f"单次请求最多 {REQUEST_MAX_TEXTS} 条文本")
+        if not request.texts:
+            return {"model": model_id, "embeddings": []}
+        request_start = time.perf_counter()
+        vectors = embeddings.embed_documents(request.texts)
+        registry.observe("embedding_service.request_ms", (time.perf_counter() - request_start) * 1000)
+        registry.observe("embedding_service.request_texts", len(request.texts), buckets=BATCH_SIZE_BUCKETS)
+        registry.increment("embedding_service.texts", len(request.texts))
+        return {"model": model_id, "embeddings": vectors}
+
+    @app.get("/metrics")
+    def metrics():
+        return registry.snapshot()
+
+    return app
@@ -0,0 +1,253 @@
+"""
+事件特征模块
+从追溯事件中提取用于知识检索的特征（操作类型、超出范围的工艺参数、质检结果），
+并据此确定性地构建检索查询，替代由 LLM 自行编写单条查询的方式
+"""
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from warehouse_assistant.app.services.ai.kb_metadata import operation_filter
+
+# 各操作类型的工艺参数正常范围（与 scripts/generate_test_data.py 的生成范围一致）
+PARAMETER_RANGES: Dict[str, Dict[str, Tuple[float, float]]] = {
+    "炼铁": {
+        "temperature_celsius": (1400, 1600),
+        "iron_content_percent": (94.5, 96.5),
+        "sulfur_content_percent": (0.02, 0.05),
+        "slag_basicity": (1.0, 1.3),
+    },
+    "炼钢": {
+        "temperature_celsius": (1600, 1700),
+        "carbon_content_percent": (0.05, 0.8),
+        "manganese_content_percent": (0.3, 1.5),
+        "oxygen_ppm": (200, 800),
+    },
+    "连铸": {
+        "casting_speed_m_min": (0.8, 1.5),
+        "cooling_water_flow_m3_h": (500, 1500),
+        "mold_oscillation_freq_hz": (1.0, 3.0),
+    },
+    "热轧": {
+        "entry_temperature_celsius": (1100, 1250),
+        "exit_temperature_celsius": (850, 950),
+        "rolling_speed_m_s": (5, 15),
+        "reduction_percent": (10, 30),
+        "target_thickness_mm": (1.5, 10.0),
+    },
+    "冷轧": {
+        "rolling_force_kn": (10000, 25000),
+        "tension_kn": (50, 200),
+        "exit_thickness_mm": (0.3, 2.0),
+    },
+    "退火": {
+        "soaking_temperature_celsius": (650, 800),
+        "soaking_time_minutes": (60, 180),
+    },
+    "包装": {
+        "weight_kg": (1000, 25000),
+    },
+}
+
+# 所有操作类型共有的参数范围
+COMMON_PARAMETER_RANGES: Dict[str, Tuple[float, float]] = {
+    "duration_minutes": (10, 240),
+}
+
+# 参数名对应的中文检索词
+PARAMETER_LABELS: Dict[str, str] = {
+    "duration_minutes": "操作持续时间",
+    "temperature_celsius": "温度",
+    "iron_content_percent": "铁含量",
+    "sulfur_content_percent": "硫含量",
+    "slag_basicity": "炉渣碱度",
+    "carbon_content_percent": "碳含量",
+    "manganese_content_percent": "锰含量",
+    "oxygen_ppm": "氧含量",
+    "casting_speed_m_min": "拉速",
+    "cooling_water_flow_m3_h": "冷却水流量",
+    "mold_oscillation_freq_hz": "结晶器振动频率",
+    "entry_temperature_celsius": "入口温度",
+    "exit_temperature_celsius": "出口温度",
+    "rolling_speed_m_s": "轧制速度",
+    "reduction_percent": "压下率",
+    "target_thickness_mm": "目标厚度",
+    "rolling_force_kn": "轧制力",
+    "tension_kn": "张力",
+    "exit_thickness_mm": "出口厚度",
+    "soaking_temperature_celsius": "均热温度",
+    "soaking_time_minutes": "保温时间",
+    "weight_kg": "重量",
+}
+
+# 事件操作类型的固定词表（与 scripts/generate_test_data.py 的 TEST_OPERATIONS 一致），
+# 预计算知识上下文表时为其中每个操作类型生成条目
+OPERATION_TYPES: Tuple[str, ...] = (
+    "原料入库", "炼铁", "炼钢", "连铸", "热轧", "冷轧", "退火", "酸洗", "镀锌",
+    "精整", "检验", "包装", "成品入库", "出库",
+)
+
+# 单个事件最多生成的检索查询数
+MAX_QUERIES = 6
+
+
+class OutOfRangeParam(NamedTuple):
+    """超出正常范围的工艺参数"""
+    name: str
+    value: float
+    low: float
+    high: float
+
+    @property
+    def label(self) -> str:
+        return PARAMETER_LABELS.get(self.name, self.name)
+
+    @property
+    def direction(self) -> str:
+        return "偏低" if self.value < self.low else "偏高"
+
+
+def event_parameters(event: Dict[str, Any]) -> Dict[str, Any]:
+    """获取事件的工艺参数（兼容 parameters 和 equipment_params 两种字段）"""
+    return event.get("parameters") or event.get("equipment_params") or {}
+
+
+def find_out_of_range_params(event: Dict[str, Any]) -> List[OutOfRangeParam]:
+    """
+    找出事件中超出该操作类型正常范围的数值参数。
+
+    Args:
+        event: 事件数据
+
+    Returns:
+        超出范围的参数列表（按参数在事件中的顺序）
+    """
+    ranges = {**COMMON_PARAMETER_RANGES, **PARAMETER_RANGES.get(event.get("operation_type", ""), {})}
+    out_of_range = []
+    for name, value in event_parameters(event).items():
+        if name not in ranges or isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        low, high = ranges[name]
+        if value < low or value > high:
+            out_of_range.append(OutOfRangeParam(name, value, low, high))
+    return out_of_range
+
+
+def operation_query(operation_type: str) -> str:
+    """操作类型的流程和异常判断规则查询"""
+    return f"{operation_type} 操作流程 时序 异常判断规则"
+
+
+# 质检结果查询的前缀（quality_query 生成的查询都以其中之一开头）
+_QUALITY_QUERY_PREFIXES = ("质检不合格 ", "质检结果 ")
+
+# 质检结果对应的规则类别；任何操作类型的事件都可能附带质检结果，质检查询总是包含这一类别
+INSPECTION_FAMILY = "质检"
+
+
+def quality_query(failed: bool, defect_terms: str = "") -> str:
+    """质检结果查询；不合格时可附带缺陷类型和严重程度"""
+    if failed:
+        return f"质检不合格 {defect_terms} 缺陷 质量风险".replace("  ", " ")
+    return "质检结果 合格判定 质量符合性"
+
+
+def is_quality_query(query: str) -> bool:
+    """是否为 quality_query 生成的质检结果查询"""
+    return query.startswith(_QUALITY_QUERY_PREFIXES)
+
+
+def parameter_query(operation_type: str, label: str, direction: str) -> str:
+    """超出范围的工艺参数查询"""
+    return f"{operation_type} {label}{direction} 工艺参数超出范围"
+
+
+def parameters_normal_query(operation_type: str) -> str:
+    """参数均在范围内时的工艺参数标准查询"""
+    return f"{operation_type} 工艺参数 标准范围"
+
+
+def build_retrieval_queries(event: Dict[str, Any], max_queries: int = MAX_QUERIES) -> List[str]:
+    """
+    根据事件确定性地构建检索查询：操作类型、质检结果、每个超出范围的参数各一条。
+
+    Args:
+        event: 事件数据
+        max_queries: 最多返回的查询数
+
+    Returns:
+        去重后的查询列表，没有可用特征时返回空列表
+    """
+    operation_type = event.get("operation_type")
+    if not operation_type:
+        return []
+
+    queries = [operation_query(operation_type)]
+
+    quality = event.get("quality_inspection") or {}
+    if quality:
+        defect = quality.get("defect_info") or event.get("defect_info") or {}
+        if quality.get("overall_result") == "不合格" or defect.get("has_defect"):
+            defect_terms = " ".join(
+                str(term) for term in (defect.get("defect_type"), defect.get("severity")) if term
+            )
+            queries.append(quality_query(True, defect_terms))
+        else:
+            queries.append(quality_query(False))
+
+    # 参数查询放在最后，超出范围的参数过多时优先截断这部分
+    out_of_range = find_out_of_range_params(event)
+    for param in out_of_range:
+        queries.append(parameter_query(operation_type, param.label, param.direction))
+    if not out_of_range and event_parameters(event):
+        queries.append(parameters_normal_query(operation_type))
+
+    # 去重并保持顺序
+    return list(dict.fromkeys(queries))[:max_queries]
+
+
+def enumerate_table_queries(operation_type: str) -> List[str]:
+    """
+    枚举某个操作类型可能生成的全部固定查询（不含缺陷类型等自由文本），用于预计算知识上下文表。
+
+    与 build_retrieval_queries 使用相同的查询模板，事件的查询只要落在这个集合中就可以直接查表。
+    """
+    queries = [
+        operation_query(operation_type),
+        quality_query(True),
+        quality_query(False),
+        parameters_normal_query(operation_type),
+    ]
+    ranges = {**COMMON_PARAMETER_RANGES, **PARAMETER_RANGES.get(operation_type, {})}
+    for name in ranges:
+        label = PARAMETER_LABELS.get(name, name)
+        for direction in ("偏低", "偏高"):
+            queries.append(parameter_query(operation_type, label, direction))
+    return list(dict.fromkeys(queries))
+
+
+def query_filter(operation_type: Optional[str], query: str) -> Optional[Dict[str, Any]]:
+    """
+    单条检索查询的元数据过滤条件：只检索适用于事件操作类别或全部操作类型的知识；
+    质检结果查询额外包含质检类规则（精整、成品入库等事件附带的质检结果同样要按质检规则判断）。
+
+    Returns:
+        ChromaDB where 条件；操作类型无法归类时返回 None（不过滤）
+    """
+    extra_families = (INSPECTION_FAMILY,) if is_quality_query(query) else ()
+    return operation_filter(operation_type, extra_families)
+
+
+def group_queries_by_filter(operation_type: Optional[str],
+                            queries: List[str]) -> List[Tuple[Optional[Dict[str, Any]], List[str]]]:
+    """
+    按过滤条件分组检索查询，每组可以一次批量检索。风险评估和预计算知识上下文表都使用这一分组，保证结果一致。
+
+    Returns:
+        [(过滤条件, 查询列表)]，按查询首次出现的顺序
+    """
+    groups: Dict[str, Tuple[Optional[Dict[str, Any]], List[str]]] = {}
+    for query in queries:
+        search_filter = query_filter(operation_type, query)
+        key = json.dumps(search_filter, sort_keys=True, ensure_ascii=False)
+        groups.setdefault(key, (search_filter, []))[1].append(query)
+    return list(groups.values())
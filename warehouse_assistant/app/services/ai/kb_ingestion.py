@@ -0,0 +1,422 @@
+"""
+知识库增量构建模块
+根据知识库清单 (kb_manifest.json) 中记录的文件修改时间、大小和内容哈希，只重新切割发生变化的文件，
+只为新增或内容变化的文本块计算向量，其余文本块的向量从当前集合复制。
+修改一行 SOP 后重建只需编码这一个文件的文本块。
+需要重新切割的文件在进程池中并行解析，文本块按批编码并批量写入，大型 PDF 语料的内存占用保持有界。
+
+每次构建写入一个新的版本化集合，正在服务的集合在构建期间保持不变；构建完成后替换清单切换到新集合，
+超出保留数量的旧集合随后删除。构建失败时删除未完成的新集合，清单仍指向原集合。
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import chromadb
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from warehouse_assistant.app.services.ai.kb_manifest import (
+    active_collection_name, chunk_id_for, compute_kb_version, load_manifest, save_manifest, versioned_collection_name
+)
+from warehouse_assistant.app.services.ai.kb_metadata import METADATA_VERSION, HeadingIndex, chunk_metadata, doc_type_for
+from warehouse_assistant.app.services.ai.rule_chunker import CHUNKER_VERSION, has_rule_structure, split_rules_document
+from warehouse_assistant.app.services.ai.rule_index import build_rule_index, save_rule_index
+
+logger = logging.getLogger(__name__)
+
+# 支持的知识库文件类型
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf")
+
+# 默认每批编码并写入 ChromaDB 的文本块数
+DEFAULT_BATCH_SIZE = 64
+
+# 默认保留的版本化集合数（当前集合和上一个集合）
+DEFAULT_COLLECTION_RETENTION = 2
+
+
+def scan_source_files(knowledge_base_dir: str) -> Dict[str, str]:
+    """
+    递归查找知识库目录下所有支持类型的文件。
+
+    Returns:
+        {相对路径（正斜杠）: 绝对路径}，按相对路径排序
+    """
+    files = {}
+    for root, _, names in os.walk(knowledge_base_dir):
+        for name in names:
+            if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, knowledge_base_dir).replace("\\", "/")] = path
+    return dict(sorted(files.items()))
+
+
+def file_sha1(path: str) -> str:
+    """计算文件内容的 SHA1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_file(path: str) -> List[Document]:
+    """按文件类型加载文档"""
+    from langchain_community.document_loaders import TextLoader, PyPDFLoader
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        # 确保已安装 pypdf: pip install pypdf
+        return PyPDFLoader(path).load()
+    return TextLoader(path, encoding="utf-8").load()
+
+
+def split_file(path: str, rel_path: str, chunk_size: int, chunk_overlap: int,
+               structured: bool = True) -> List[Document]:
+    """
+    加载并切割单个文件，为每个文本块生成稳定的ID（同一文件中完全重复的文本块只保留一份），
+    并标注文档类型、所属章节和适用的操作类型。
+
+    规则文档按标题结构切割（每条规则一个文本块，metadata 中包含 rule_id 和 rule_title），
+    其他文档以及 structured=False 时（用于检索基准对比）使用 RecursiveCharacterTextSplitter。
+
+    Returns:
+        文本块列表，metadata 中包含 chunk_id 和检索元数据
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        add_start_index=True,
+    )
+    chunks = []
+    seen_ids: Set[str] = set()
+    is_rules_document = structured and doc_type_for(rel_path) == "rules"
+    for page in load_file(path):
+        # 按页切割，文本块的 start_index 对应本页文本中的位置，用于查找所属章节
+        headings = HeadingIndex(page.page_content)
+        if is_rules_document and has_rule_structure(page.page_content):
+            page_chunks = [
+                Document(
+                    page_content=chunk["content"],
+                    metadata={
+                        **page.metadata,
+                        "start_index": chunk["start_index"],
+                        **{key: chunk[key] for key in ("rule_id", "rule_title") if key in chunk},
+                    }
+                )
+                for chunk in split_rules_document(page.page_content, max_chars=chunk_size)
+            ]
+        else:
+            page_chunks = splitter.split_documents([page])
+        for doc in page_chunks:
+            chunk_id = chunk_id_for(rel_path, doc.page_content)
+            if chunk_id in seen_ids:
+                continue
+            seen_ids.add(chunk_id)
+            doc.metadata["chunk_id"] = chunk_id
+            doc.metadata.update(chunk_metadata(doc.page_content, rel_path, doc.metadata.get("start_index"), headings))
+            chunks.append(doc)
+    return chunks
+
+
+def _file_unchanged(previous: Optional[Dict[str, Any]], stat: os.stat_result, existing_ids: Set[str]) -> bool:
+    """修改时间和大小都未变化，且上次的文本块都还在集合中"""
+    return (
+        previous is not None
+        and previous.get("mtime_ns") == stat.st_mtime_ns
+        and previous.get("size") == stat.st_size
+        and set(previous.get("chunk_ids", [])) <= existing_ids
+    )
+
+
+def _parse_files(to_parse: List[Tuple[str, str]], chunk_size: int, chunk_overlap: int,
+                 workers: int) -> Iterator[Tuple[str, Optional[List[Document]], Optional[Exception]]]:
+    """
+    切割文件，按完成顺序逐个产出 (相对路径, 文本块, 异常)。
+
+    workers > 1 且待处理文件多于一个时使用进程池并行解析（PDF 解析是 CPU 密集型）；
+    同时在途的文件数限制为 workers 的两倍，内存中只保留少量文件的解析结果。
+    """
+    if workers <= 1 or len(to_parse) <= 1:
+        for rel_path, path in to_parse:
+            try:
+                yield rel_path, split_file(path, rel_path, chunk_size, chunk_overlap), None
+            except Exception as e:
+                yield rel_path, None, e
+        return
+
+    # 使用 spawn 启动子进程：主进程可能已加载 torch 模型，fork 后可能死锁
+    context = multiprocessing.get_context("spawn")
+    max_in_flight = workers * 2
+    remaining = iter(to_parse)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        in_flight: Dict[Future, str] = {}
+
+        def submit_next() -> None:
+            for rel_path, path in remaining:
+                in_flight[executor.submit(split_file, path, rel_path, chunk_size, chunk_overlap)] = rel_path
+                return
+
+        for _ in range(max_in_flight):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_path = in_flight.pop(future)
+                submit_next()
+                try:
+                    yield rel_path, future.result(), None
+                except Exception as e:
+                    yield rel_path, None, e
+
+
+def _collection_names(client) -> Set[str]:
+    """列出持久化目录中的全部集合名称（兼容返回集合对象和返回名称的 chromadb 版本）"""
+    return {c if isinstance(c, str) else c.name for c in client.list_collections()}
+
+
+def _retire_collections(client, base_name: str, keep: List[str]) -> List[str]:
+    """
+    删除不在保留列表中的知识库集合（旧版原地构建的集合，以及更早或构建中断遗留的版本化集合），
+    返回已删除的集合名称。构建是互斥进行的，因此不会删除其他构建正在写入的集合。
+    """
+    retired = []
+    for name in sorted(_collection_names(client)):
+        if name in keep or not (name == base_name or name.startswith(f"{base_name}_v")):
+            continue
+        try:
+            client.delete_collection(name)
+            retired.append(name)
+        except Exception as e:
+            logger.warning(f"删除旧集合 {name} 失败: {e}")
+    return retired
+
+
+def ingest_knowledge_base(
+    knowledge_base_dir: str,
+    persist_directory: str,
+    collection_name: str,
+    embeddings_factory: Callable[[], Embeddings],
+    embedding_model_name: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    full: bool = False,
+    workers: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    retention: int = DEFAULT_COLLECTION_RETENTION,
+) -> Dict[str, Any]:
+    """
+    增量构建知识库。
+
+    切割参数、嵌入模型、元数据标注规则或切割规则与上次构建不同时自动退化为全量构建。
+    构建完成后从规则文档的文本块重新生成规则索引 (rule_index.json)。
+    嵌入模型只在确实有文本块需要编码时才加载。解析、编码和写入是流水线式的：
+    解析完成的文本块进入缓冲区，凑满 batch_size 即编码并批量写入，内存占用与语料总量无关。
+
+    文本块写入新的版本化集合，内容未变的文本块直接从当前集合复制向量；全部写入后替换清单切换集合，
+    再删除超出保留数量的旧集合。切换之前出错时删除新集合，当前集合和清单都不受影响。
+
+    Args:
+        knowledge_base_dir: 知识库源文件目录
+        persist_directory: ChromaDB 持久化目录
+        collection_name: 集合基础名称（版本化集合名称为 <collection_name>_v<时间戳>）
+        embeddings_factory: 创建嵌入模型的函数
+        embedding_model_name: 嵌入模型名称（记录到清单，用于判断是否需要全量重建）
+        chunk_size: 文本块大小
+        chunk_overlap: 文本块重叠长度
+        full: 强制全量重建
+        workers: 解析文件的进程数，1 表示在当前进程中解析
+        batch_size: 每批编码并写入的文本块数
+        progress: 进度回调，每处理完一个文件或写入一批后以当前统计调用
+        retention: 保留的版本化集合数（至少 2）
+
+    Returns:
+        构建统计：文件数、未变化/重新切割/删除的文件数、编码/复制/移除的文本块数、知识库版本、新集合名称
+    """
+    manifest = load_manifest(persist_directory) or {}
+    build_config = {
+        "embedding_model": embedding_model_name,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "collection_name": collection_name,
+        # 文本块ID只取决于内容，元数据标注规则变化时需要全量重建才能更新已有文本块
+        "metadata_version": METADATA_VERSION,
+        "chunker_version": CHUNKER_VERSION,
+    }
+    if not full and any(manifest.get(key) != value for key, value in build_config.items()):
+        if manifest:
+            logger.info("切割参数、嵌入模型、元数据或切割规则、集合与上次构建不同，执行全量构建")
+        full = True
+
+    client = chromadb.PersistentClient(path=persist_directory)
+    previous_name = active_collection_name(manifest)
+    previous_collection = None
+    if previous_name in _collection_names(client):
+        previous_collection = client.get_collection(previous_name, embedding_function=None)
+    existing_ids: Set[str] = set(previous_collection.get(include=[])["ids"]) if previous_collection else set()
+    if full:
+        # 全量构建时所有文本块都重新编码（旧向量可能来自不同的模型）
+        existing_ids_for_reuse: Set[str] = set()
+    else:
+        existing_ids_for_reuse = existing_ids
+
+    # 向量由调用方的嵌入模型计算，不使用 ChromaDB 自带的嵌入函数
+    new_name = versioned_collection_name(collection_name)
+    collection = client.create_collection(new_name, embedding_function=None)
+    logger.info(f"写入新集合 {new_name}（当前集合: {previous_name if previous_collection else '无'}）")
+
+    try:
+        previous_files: Dict[str, Dict[str, Any]] = {} if full else manifest.get("files", {})
+        source_files = scan_source_files(knowledge_base_dir)
+
+        stats = {
+            "files": len(source_files), "unchanged_files": 0, "resplit_files": 0,
+            "removed_files": len(set(previous_files) - set(source_files)),
+            "failed_files": 0, "files_to_parse": 0, "parsed_files": 0,
+            "upserted_chunks": 0, "copied_chunks": 0, "deleted_chunks": 0,
+        }
+        files_manifest: Dict[str, Dict[str, Any]] = {}
+        file_states: Dict[str, Dict[str, Any]] = {}
+        to_parse: List[Tuple[str, str]] = []
+        to_copy: List[str] = []
+
+        def flush_copy() -> None:
+            """把内容未变的文本块（向量、文本和元数据）从当前集合复制到新集合"""
+            while to_copy:
+                batch = to_copy[:batch_size]
+                del to_copy[:batch_size]
+                page = previous_collection.get(ids=batch, include=["embeddings", "documents", "metadatas"])
+                collection.upsert(
+                    ids=page["ids"],
+                    embeddings=page["embeddings"],
+                    documents=page["documents"],
+                    metadatas=page["metadatas"],
+                )
+                stats["copied_chunks"] += len(page["ids"])
+
+        def reuse(chunk_ids: List[str]) -> None:
+            to_copy.extend(chunk_ids)
+            if len(to_copy) >= batch_size:
+                flush_copy()
+
+        # 第一阶段：按修改时间和内容哈希找出需要重新切割的文件，未变化文件的文本块直接复制
+        for rel_path, path in source_files.items():
+            stat = os.stat(path)
+            previous = previous_files.get(rel_path)
+            if _file_unchanged(previous, stat, existing_ids_for_reuse):
+                files_manifest[rel_path] = previous
+                stats["unchanged_files"] += 1
+                reuse(previous.get("chunk_ids", []))
+                continue
+
+            sha1 = file_sha1(path)
+            if previous is not None and previous.get("sha1") == sha1 \
+                    and set(previous.get("chunk_ids", [])) <= existing_ids_for_reuse:
+                # 只是修改时间变化（如重新保存、检出），内容未变
+                files_manifest[rel_path] = {**previous, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+                stats["unchanged_files"] += 1
+                reuse(previous.get("chunk_ids", []))
+                continue
+
+            file_states[rel_path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": sha1}
+            to_parse.append((rel_path, path))
+        stats["files_to_parse"] = len(to_parse)
+
+        # 第二阶段：流水线式解析、编码、写入
+        embeddings: Optional[Embeddings] = None
+        pending: List[Document] = []
+
+        def flush() -> None:
+            nonlocal embeddings
+            if not pending:
+                return
+            if embeddings is None:
+                embeddings = embeddings_factory()
+            texts = [doc.page_content for doc in pending]
+            collection.upsert(
+                ids=[doc.metadata["chunk_id"] for doc in pending],
+                embeddings=embeddings.embed_documents(texts),
+                documents=texts,
+                metadatas=[doc.metadata for doc in pending],
+            )
+            stats["upserted_chunks"] += len(pending)
+            pending.clear()
+            if progress:
+                progress(stats)
+
+        for rel_path, chunks, error in _parse_files(to_parse, chunk_size, chunk_overlap, max(1, workers)):
+            stats["parsed_files"] += 1
+            if error is not None:
+                logger.error(f"加载或切割文件 {rel_path} 失败: {error}")
+                stats["failed_files"] += 1
+                # 保留上次成功构建的文本块，避免一次读取失败就删除该文件的全部知识
+                if rel_path in previous_files:
+                    previous_ids = [chunk_id for chunk_id in previous_files[rel_path].get("chunk_ids", [])
+                                    if chunk_id in existing_ids]
+                    files_manifest[rel_path] = {**previous_files[rel_path], "chunk_ids": previous_ids}
+                    reuse(previous_ids)
+            else:
+                stats["resplit_files"] += 1
+                files_manifest[rel_path] = {
+                    **file_states[rel_path],
+                    "chunk_ids": [doc.metadata["chunk_id"] for doc in chunks],
+                }
+                # 内容未变的文本块ID不变，从当前集合复制，无需重新编码
+                for doc in chunks:
+                    if doc.metadata["chunk_id"] in existing_ids_for_reuse:
+                        reuse([doc.metadata["chunk_id"]])
+                    else:
+                        pending.append(doc)
+                        if len(pending) >= batch_size:
+                            flush()
+            if progress:
+                progress(stats)
+        flush()
+        flush_copy()
+
+        # 第三阶段：校验新集合，生成规则索引
+        chunk_ids = sorted({chunk_id for entry in files_manifest.values() for chunk_id in entry["chunk_ids"]})
+        stats["deleted_chunks"] = len(existing_ids - set(chunk_ids))
+        if collection.count() != len(chunk_ids):
+            raise RuntimeError(f"新集合 {new_name} 中有 {collection.count()} 个文本块，清单中有 {len(chunk_ids)} 个")
+
+        kb_version = compute_kb_version(chunk_ids)
+        # 规则索引先于清单写入：服务看到新清单时规则索引已经是新版本
+        rule_index = build_rule_index(collection, kb_version)
+        save_rule_index(rule_index, persist_directory)
+        stats["rules"] = len(rule_index["rules"])
+    except BaseException:
+        logger.error(f"构建失败，删除未完成的集合 {new_name}，当前集合保持不变")
+        try:
+            client.delete_collection(new_name)
+        except Exception as e:
+            logger.warning(f"删除未完成的集合 {new_name} 失败: {e}")
+        raise
+
+    # 第四阶段：替换清单即切换到新集合（原子操作），随后删除超出保留数量的旧集合
+    history = [new_name] + [name for name in manifest.get("collection_history", []) if name != new_name]
+    if previous_collection is not None and previous_name not in history:
+        history.insert(1, previous_name)
+    history = history[:max(2, retention)]
+    save_manifest({
+        "kb_version": kb_version,
+        **build_config,
+        "built_at": datetime.utcnow().isoformat(),
+        "active_collection": new_name,
+        "collection_history": history,
+        "chunk_ids": chunk_ids,
+        "files": files_manifest,
+    }, persist_directory)
+    stats["retired_collections"] = _retire_collections(client, collection_name, history)
+    stats["collection"] = new_name
+    stats["kb_version"] = kb_version
+    stats["chunks"] = len(chunk_ids)
+    return stats
@@ -0,0 +1,102 @@
+"""
+知识库清单模块
+管理知识库构建清单 (kb_manifest.json)：稳定的文本块ID、知识库版本号以及当前全部文本块ID，
+用于判断知识库重建后哪些风险评估引用的知识发生了变化；构建标识（kb_build_id）用于判断派生数据是否过期。
+
+每次构建写入一个新的版本化集合，清单中的 active_collection 指向当前使用的集合；
+清单以原子替换的方式写入，因此替换清单就是切换集合的原子操作。
+"""
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from warehouse_assistant.app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = "kb_manifest.json"
+
+
+def chunk_id_for(source: str, content: str) -> str:
+    """
+    根据来源文件和文本内容生成稳定的文本块ID。
+
+    内容不变的文本块在重建后保持相同的ID，内容一旦修改ID随之改变。
+
+    Args:
+        source: 来源文件路径（统一使用正斜杠的相对路径）
+        content: 文本块内容
+
+    Returns:
+        20 位十六进制ID
+    """
+    digest = hashlib.sha1(f"{source}\n{content}".encode("utf-8")).hexdigest()
+    return digest[:20]
+
+
+def compute_kb_version(chunk_ids: Iterable[str]) -> str:
+    """根据全部文本块ID计算知识库版本号（文本块集合不变则版本不变）"""
+    digest = hashlib.sha1("\n".join(sorted(chunk_ids)).encode("utf-8")).hexdigest()
+    return digest[:12]
+
+
+def versioned_collection_name(base_name: str) -> str:
+    """为一次构建生成新的集合名称：<基础名称>_v<UTC时间戳>"""
+    return f"{base_name}_v{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+
+
+def active_collection_name(manifest: Optional[Dict[str, Any]] = None) -> str:
+    """
+    清单指向的当前集合名称。
+
+    旧版清单（原地构建、没有 active_collection）或清单不存在时返回配置中的集合名称。
+    """
+    return (manifest or {}).get("active_collection") or settings.KNOWLEDGE_BASE_COLLECTION_NAME
+
+
+def kb_build_id(manifest: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    一次构建的标识：清单指向的版本化集合名称，每次构建都不同。
+
+    kb_version 只由文本块内容决定，元数据重新标注、切换嵌入模型等不改变文本的重建不会改变它；
+    依赖向量或元数据的派生数据（检索结果缓存、向量快照、知识上下文表）按构建标识判断是否过期。
+    旧版清单没有 active_collection 时使用构建时间。
+    """
+    if not manifest:
+        return None
+    return manifest.get("active_collection") or manifest.get("built_at") or manifest.get("kb_version")
+
+
+def manifest_path(persist_directory: Optional[str] = None) -> str:
+    """清单文件路径，位于 ChromaDB 持久化目录下"""
+    return os.path.join(persist_directory or settings.CHROMA_PERSIST_DIRECTORY, MANIFEST_FILE_NAME)
+
+
+def load_manifest(persist_directory: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    读取知识库清单。
+
+    Returns:
+        清单字典；文件不存在或损坏时返回 None
+    """
+    path = manifest_path(persist_directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"读取知识库清单失败: {e}", exc_info=True)
+        return None
+
+
+def save_manifest(manifest: Dict[str, Any], persist_directory: Optional[str] = None) -> None:
+    """原子地写入知识库清单（先写临时文件再替换），读取方不会看到写了一半的文件"""
+    path = manifest_path(persist_directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
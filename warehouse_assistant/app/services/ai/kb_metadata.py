@@ -0,0 +1,175 @@
+"""
+知识库文本块元数据模块
+构建知识库时为每个文本块标注文档类型、所属章节和适用的操作类型，检索时按事件的操作类型
+生成元数据过滤条件，缩小候选集合（热轧事件不再与入库存储时长规则竞争 top-k）。
+
+适用的操作类型取自规则的“检查数据点”行：限定了 operation_type="X" 的规则只适用于对应的
+操作类别，未限定的规则（以及没有检查数据点的说明性内容）适用于全部操作类型。
+"""
+import os
+import re
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 元数据规则的版本；修改标注逻辑后递增，init_knowledge_base.py 据此全量重建
+METADATA_VERSION = 1
+
+# 操作类别（规则文档使用的通用操作名称）→ (元数据标记, 属于该类别的事件操作类型)
+OPERATION_FAMILIES: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "生产": ("op_production", ("生产", "炼铁", "炼钢", "连铸", "热轧", "冷轧", "退火", "精整")),
+    "质检": ("op_inspection", ("质检", "检验")),
+    "入库": ("op_inbound", ("入库", "原料入库", "成品入库")),
+    "出库": ("op_outbound", ("出库",)),
+    "发货": ("op_shipping", ("发货",)),
+    "包装": ("op_packaging", ("包装",)),
+    "转运": ("op_transfer", ("转运",)),
+}
+
+# 适用于全部操作类型的标记
+APPLIES_ALL_OPS = "applies_all_ops"
+
+# 文档类型：按文件名关键字判断
+DOC_TYPE_KEYWORDS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("rules", ("规则", "判断", "合标")),
+    ("sop", ("SOP", "sop", "作业指导", "操作规程")),
+]
+DEFAULT_DOC_TYPE = "reference"
+
+# 规则文档的“第X部分”和“类别X”标题
+PART_HEADING_PATTERN = re.compile(r"^第[一二三四五六七八九十\d]+部分[:：].*$", re.MULTILINE)
+SECTION_HEADING_PATTERN = re.compile(r"^类别[一二三四五六七八九十\d]+[:：].*$", re.MULTILINE)
+_CHECK_POINTS_PATTERN = re.compile(r"^检查数据点[:：](.*)$", re.MULTILINE)
+_OPERATION_CONSTRAINT_PATTERN = re.compile(r"operation_type\s*=\s*[\"“']([^\"”']+)[\"”']")
+
+
+def operation_family(operation_type: Optional[str]) -> Optional[str]:
+    """事件操作类型所属的操作类别，无法归类时返回 None"""
+    if not operation_type:
+        return None
+    for family, (_, members) in OPERATION_FAMILIES.items():
+        if operation_type in members:
+            return family
+    return None
+
+
+def doc_type_for(rel_path: str) -> str:
+    """根据文件名判断文档类型"""
+    name = os.path.basename(rel_path)
+    for doc_type, keywords in DOC_TYPE_KEYWORDS:
+        if any(keyword in name for keyword in keywords):
+            return doc_type
+    return DEFAULT_DOC_TYPE
+
+
+class HeadingIndex:
+    """文档中“第X部分”和“类别X”标题的位置索引，用于查找文本块所属的章节"""
+
+    def __init__(self, text: str):
+        self._parts = [(m.start(), m.group(0).strip()) for m in PART_HEADING_PATTERN.finditer(text)]
+        self._sections = [(m.start(), m.group(0).strip()) for m in SECTION_HEADING_PATTERN.finditer(text)]
+
+    @staticmethod
+    def _lookup(headings: List[Tuple[int, str]], position: int) -> Optional[Tuple[int, str]]:
+        index = bisect_right([start for start, _ in headings], position) - 1
+        return headings[index] if index >= 0 else None
+
+    def locate(self, position: int) -> Dict[str, str]:
+        """返回位置所在的部分和类别标题（位于类别之前的部分中时不返回类别）"""
+        part = self._lookup(self._parts, position)
+        section = self._lookup(self._sections, position)
+        located: Dict[str, str] = {}
+        if part:
+            located["part"] = part[1]
+        if section and (part is None or section[0] > part[0]):
+            located["section"] = section[1]
+        return located
+
+
+def operation_tags(text: str) -> Dict[str, bool]:
+    """
+    根据文本块中的“检查数据点”行标注适用的操作类别。
+
+    Returns:
+        {op_xxx: True, ...}，以及适用于全部操作类型时的 {applies_all_ops: True}
+    """
+    tags: Dict[str, bool] = {}
+    check_points = _CHECK_POINTS_PATTERN.findall(text)
+    unconstrained = not check_points
+    for line in check_points:
+        constraints = _OPERATION_CONSTRAINT_PATTERN.findall(line)
+        if not constraints:
+            unconstrained = True
+        for operation_type in constraints:
+            family = operation_family(operation_type) or operation_type
+            if family in OPERATION_FAMILIES:
+                tags[OPERATION_FAMILIES[family][0]] = True
+            else:
+                unconstrained = True
+    if unconstrained:
+        tags[APPLIES_ALL_OPS] = True
+    return tags
+
+
+def chunk_metadata(text: str, rel_path: str, start_index: Optional[int], headings: Optional[HeadingIndex]) -> Dict[str, Any]:
+    """
+    生成文本块的检索元数据（ChromaDB 元数据只支持标量值，操作类别以布尔标记表示）。
+
+    Args:
+        text: 文本块内容
+        rel_path: 来源文件相对路径
+        start_index: 文本块在所属页面文本中的起始位置
+        headings: 所属页面的标题索引
+    """
+    metadata: Dict[str, Any] = {"doc_type": doc_type_for(rel_path)}
+    if headings is not None and start_index is not None and start_index >= 0:
+        metadata.update(headings.locate(start_index))
+    metadata.update(operation_tags(text))
+    return metadata
+
+
+def operation_filter(operation_type: Optional[str], extra_families: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    按事件操作类型生成检索过滤条件：适用于该操作类别或适用于全部操作类型的文本块。
+
+    Args:
+        operation_type: 事件操作类型
+        extra_families: 额外包含的操作类别（如附带质检结果的生产、入库事件需要质检类规则）
+
+    Returns:
+        ChromaDB where 条件；操作类型无法归类时返回 None（不过滤）
+    """
+    family = operation_family(operation_type)
+    if family is None:
+        return None
+    families = list(dict.fromkeys([family, *extra_families]))
+    return {"$or": [{OPERATION_FAMILIES[f][0]: True} for f in families] + [{APPLIES_ALL_OPS: True}]}
+
+
+def matches_filter(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    在本地判断元数据是否满足 ChromaDB where 条件（支持 $and、$or、相等、$eq、$ne、$in、$nin），
+    供不经过 ChromaDB 的向量快照使用。
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and not (key in metadata and value == operand):
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif not (key in metadata and metadata[key] == condition):
+            return False
+    return True
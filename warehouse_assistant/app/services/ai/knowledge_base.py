@@ -1,10 +1,23 @@
+import asyncio
 import os
+import threading
+import time
+from contextlib import contextmanager
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
-from typing import List, Optional, Type, Dict, Any
+from typing import List, Optional, Type, Dict, Any, Iterator, Tuple
 import logging
 from warehouse_assistant.app.core.config import settings # 导入配置实例
+from warehouse_assistant.app.services.ai.run_timeline import timed, record_knowledge_refs
+from warehouse_assistant.app.services.ai.kb_manifest import (
+    active_collection_name, kb_build_id, load_manifest, manifest_path
+)
+from warehouse_assistant.app.services.ai.search_cache import SearchResultCache
+from warehouse_assistant.app.services.ai.embedding_cache import CachedEmbeddings
+from warehouse_assistant.app.services.ai.embedding_batcher import MicroBatchingEmbeddings
+from warehouse_assistant.app.services.ai.embedding_backends import create_base_embeddings, embedding_model_id
+from warehouse_assistant.app.services.ai.vector_snapshot import VectorSnapshot, pointer_path
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
 import glob  # 导入 glob 模块用于查找文件
 from dotenv import load_dotenv
 # 不再需要从 langchain_community.document_loaders 导入 DirectoryLoader
@@ -12,114 +25,538 @@ from langchain_community.document_loaders import TextLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import traceback
 import chromadb
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+
+def merge_query_results(queries: List[str], all_results: List[List[Dict[str, Any]]],
+                        max_results: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    按文本块合并多条查询的检索结果。
+
+    同一文本块被多个查询命中时保留最小的距离分数，并在 matched_queries 中记录命中它的查询。
+
+    Returns:
+        按分数（距离，越小越相关）升序排列的去重结果列表
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for query, query_results in zip(queries, all_results):
+        for result in query_results:
+            key = result["metadata"].get("chunk_id") or result["content"]
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = {**result, "matched_queries": [query]}
+            else:
+                existing["score"] = min(existing["score"], result["score"])
+                existing["matched_queries"].append(query)
+
+    results = sorted(merged.values(), key=lambda r: r["score"])
+    if max_results is not None:
+        results = results[:max_results]
+    return results
+
+
+class CollectionHandle:
+    """
+    一个版本化集合的向量库句柄（引用计数）。
+
+    每次检索期间持有一个引用；集合切换后旧句柄被标记为退役，最后一个进行中的检索结束时才释放向量库，
+    切换不会打断正在使用旧集合的检索。
+    """
+
+    def __init__(self, name: str, vectorstore: Chroma, kb_version: Optional[str], build_id: Optional[str]):
+        self.name = name
+        self.vectorstore: Optional[Chroma] = vectorstore
+        self.kb_version = kb_version
+        self.build_id = build_id
+        self._refs = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    @property
+    def refs(self) -> int:
+        return self._refs
+
+    def acquire(self) -> None:
+        with self._lock:
+            self._refs += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self._refs -= 1
+            close = self._retired and self._refs == 0
+        if close:
+            self._close()
+
+    def retire(self) -> None:
+        """标记为退役：没有进行中的检索时立即释放，否则由最后一个检索释放"""
+        with self._lock:
+            self._retired = True
+            close = self._refs == 0
+        if close:
+            self._close()
+
+    def _close(self) -> None:
+        logger.info(f"Released retired collection handle '{self.name}' (kb_version {self.kb_version})")
+        self.vectorstore = None
+
+
 class KnowledgeBaseService:
     _instance = None
-    vectorstore: Optional[Chroma] = None
-    embeddings: Optional[HuggingFaceEmbeddings] = None
+    _instance_lock = threading.Lock()
+    # 当前集合的句柄；重建后清单指向新集合时原子地替换
+    _handle: Optional[CollectionHandle] = None
+    _swap_lock: Optional[threading.Lock] = None
+    _refresh_lock: Optional[threading.Lock] = None
+    # 已退役但仍有检索在使用的句柄
+    _retired_handles: Optional[List[CollectionHandle]] = None
+    embeddings: Optional[CachedEmbeddings] = None
+    kb_version: Optional[str] = None
+    # 当前构建的标识（见 kb_manifest.kb_build_id），文本不变的重建也会变化
+    build_id: Optional[str] = None
+    result_cache: Optional[SearchResultCache] = None
+    _manifest_mtime: Optional[int] = None
+    snapshot: Optional[VectorSnapshot] = None
+    _snapshot_mtime: Optional[int] = None
+    # 加载状态：not_started / loading / ready / failed
+    status: str = "not_started"
+    last_error: Optional[str] = None
+    _load_lock: Optional[threading.Lock] = None
+    _consecutive_failures: int = 0
+    _next_retry_at: float = 0.0
 
     def __new__(cls):
-        # 单例模式，确保只初始化一次
+        # 单例模式；创建实例不加载模型，加载由 ensure_loaded()（后台预热或首次使用时）完成
         if cls._instance is None:
-            logger.info("Initializing KnowledgeBaseService instance...")
-            cls._instance = super(KnowledgeBaseService, cls).__new__(cls)
-            # 在初始化时加载向量数据库
-            cls._instance._load_vectorstore()
+            with cls._instance_lock:
+                if cls._instance is None:
+                    logger.info("Initializing KnowledgeBaseService instance...")
+                    instance = super(KnowledgeBaseService, cls).__new__(cls)
+                    instance.result_cache = SearchResultCache(settings.SEARCH_RESULT_CACHE_MAX_ENTRIES)
+                    instance._load_lock = threading.Lock()
+                    instance._swap_lock = threading.Lock()
+                    instance._refresh_lock = threading.Lock()
+                    instance._retired_handles = []
+                    registry = get_metrics_registry()
+                    registry.register_gauge("knowledge_base.ready", lambda: int(instance.is_ready))
+                    registry.register_gauge("knowledge_base.retired_handles_in_use", instance._retired_handles_in_use)
+                    cls._instance = instance
         return cls._instance
-    
+
+    @property
+    def vectorstore(self) -> Optional[Chroma]:
+        """当前集合的向量库"""
+        handle = self._handle
+        return handle.vectorstore if handle is not None else None
+
+    @property
+    def collection_name(self) -> Optional[str]:
+        handle = self._handle
+        return handle.name if handle is not None else None
+
+    @property
+    def is_ready(self) -> bool:
+        return self.vectorstore is not None and self.embeddings is not None
+
+    def _retired_handles_in_use(self) -> int:
+        """仍有检索在使用的退役句柄数"""
+        with self._swap_lock:
+            self._retired_handles[:] = [h for h in self._retired_handles if h.vectorstore is not None]
+            return len(self._retired_handles)
+
+    def ensure_loaded(self) -> bool:
+        """
+        确保嵌入模型和向量库已加载。
+
+        其他线程（如后台预热）正在加载时阻塞等待其完成；加载失败后在退避时间内直接返回 False
+        而不重新加载（负缓存），退避时间随连续失败次数指数增长。
+
+        Returns:
+            是否已就绪
+        """
+        if self.is_ready:
+            return True
+        with self._load_lock:
+            if self.is_ready:
+                return True
+            if time.monotonic() < self._next_retry_at:
+                return False
+            self.status = "loading"
+            self.last_error = None
+            start = time.perf_counter()
+            self._load_vectorstore()
+            if self.is_ready:
+                self.status = "ready"
+                self._consecutive_failures = 0
+                self._next_retry_at = 0.0
+                logger.info(f"Knowledge base ready in {time.perf_counter() - start:.1f}s")
+                return True
+            self._consecutive_failures += 1
+            backoff = min(
+                settings.KB_LOAD_RETRY_BACKOFF_SECONDS * 2 ** (self._consecutive_failures - 1),
+                settings.KB_LOAD_RETRY_MAX_BACKOFF_SECONDS
+            )
+            self._next_retry_at = time.monotonic() + backoff
+            self.status = "failed"
+            logger.warning(f"Knowledge base not available ({self.last_error}); next load attempt in {backoff:.0f}s")
+            return False
+
+    def status_info(self) -> Dict[str, Any]:
+        """加载状态摘要，供健康检查接口使用（不触发加载）"""
+        info: Dict[str, Any] = {"status": self.status, "kb_version": self.kb_version, "collection": self.collection_name}
+        if settings.EMBEDDING_SERVICE_URL:
+            info["embedding_service"] = settings.EMBEDDING_SERVICE_URL
+        if self.status == "failed":
+            info["last_error"] = self.last_error
+            info["retry_in_seconds"] = round(max(0.0, self._next_retry_at - time.monotonic()), 1)
+        return info
+
     def _load_vectorstore(self):
-        """初始化或加载向量数据库"""
+        """初始化或加载向量数据库，失败原因记录在 last_error 中"""
         try:
-            # 加载预训练的嵌入模型
-            logger.info(f"Loading embeddings model: {settings.EMBEDDING_MODEL_NAME}")
-            self.embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL_NAME)
+            # 加载预训练的嵌入模型（重新加载向量库时复用已创建的模型、批处理线程和缓存）
+            if self.embeddings is None:
+                if settings.EMBEDDING_SERVICE_URL:
+                    logger.info(f"Connecting to shared embedding service: {settings.EMBEDDING_SERVICE_URL}")
+                else:
+                    logger.info(f"Loading embeddings model: {settings.EMBEDDING_MODEL_NAME} (backend: {settings.EMBEDDING_BACKEND})")
+                # 配置了 EMBEDDING_SERVICE_URL 时为共享嵌入服务的客户端，本进程不加载模型
+                base_embeddings = create_base_embeddings()
+                if settings.EMBEDDING_MICRO_BATCHING:
+                    # 多个线程并发的编码请求合并为一次批量前向计算
+                    base_embeddings = MicroBatchingEmbeddings(
+                        base_embeddings,
+                        max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+                        max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS
+                    )
+                # 查询向量经过缓存，语义相同的查询不再重复编码（按后端区分，不同后端的向量不混用）
+                self.embeddings = CachedEmbeddings(
+                    base_embeddings,
+                    model_name=embedding_model_id(),
+                    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+                    disk_path=settings.EMBEDDING_CACHE_PATH or None
+                )
+                self.embeddings.warm_up(settings.EMBEDDING_CACHE_WARMUP_ENTRIES)
             
             # 确保持久化目录存在
             os.makedirs(settings.CHROMA_PERSIST_DIRECTORY, exist_ok=True)
             
-            # 尝试加载向量数据库
+            # 加载清单指向的当前集合
             logger.info(f"Loading vectorstore from: {settings.CHROMA_PERSIST_DIRECTORY}")
             
             try:
                 # 首先检查集合是否存在
+                collection_name = active_collection_name(load_manifest())
                 client = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIRECTORY)
                 collections = client.list_collections()
-                collection_exists = any(c.name == settings.KNOWLEDGE_BASE_COLLECTION_NAME for c in collections)
+                collection_exists = any(getattr(c, "name", c) == collection_name for c in collections)
                 
                 if collection_exists:
-                    self.vectorstore = Chroma(
-                        persist_directory=settings.CHROMA_PERSIST_DIRECTORY,
-                        embedding_function=self.embeddings,
-                        collection_name=settings.KNOWLEDGE_BASE_COLLECTION_NAME
-                    )
-                    logger.info(f"Successfully loaded existing vectorstore with {self.vectorstore._collection.count()} documents")
+                    # 加载清单中的知识库版本和集合，检索结果缓存按版本隔离（-1 强制重新读取清单，没有清单时也打开集合）
+                    self._manifest_mtime = -1
+                    self._snapshot_mtime = None
+                    self._refresh_kb_version()
+                    logger.info(f"Successfully loaded collection '{self.collection_name}' with {self.vectorstore._collection.count()} documents")
                 else:
-                    logger.warning(f"Collection '{settings.KNOWLEDGE_BASE_COLLECTION_NAME}' does not exist in ChromaDB. Please run init_knowledge_base.py script first.")
-                    self.vectorstore = None
+                    logger.warning(f"Collection '{collection_name}' does not exist in ChromaDB. Please run init_knowledge_base.py script first.")
+                    self.last_error = f"collection '{collection_name}' does not exist"
+                    self._handle = None
                     
             except Exception as e:
                 logger.error(f"Failed to load vectorstore: {e}", exc_info=True)
-                self.vectorstore = None
+                self.last_error = f"failed to load vectorstore: {e}"
+                self._handle = None
                 
         except Exception as e:
             logger.error(f"Error initializing embeddings: {e}", exc_info=True)
+            self.last_error = f"failed to load embeddings: {e}"
             self.embeddings = None
-            self.vectorstore = None
+            self._handle = None
+
+    def _refresh_kb_version(self) -> None:
+        """
+        检查知识库清单是否变化（重建后清单会被替换），变化时切换到清单指向的集合、更新版本号和构建标识，
+        并使检索结果缓存失效。
+
+        只比较清单文件的修改时间，清单未变化时开销仅为一次 stat。
+        """
+        path = manifest_path()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._manifest_mtime:
+            self._refresh_snapshot()
+            return
+        with self._refresh_lock:
+            if mtime == self._manifest_mtime:
+                return
+            manifest = load_manifest()
+            kb_version = manifest.get("kb_version") if manifest else None
+            build_id = kb_build_id(manifest)
+            index_model = manifest.get("embedding_model") if manifest else None
+            if index_model and index_model != embedding_model_id():
+                logger.error(
+                    f"Knowledge base was embedded with '{index_model}' but the current embedding backend is "
+                    f"'{embedding_model_id()}'; retrieval quality may degrade. Run init_knowledge_base.py to re-index."
+                )
+            self._swap_collection(active_collection_name(manifest), kb_version, build_id)
+            self._manifest_mtime = mtime
+            self.result_cache.set_build(build_id)
+            self._refresh_snapshot(force=True)
+
+    def _swap_collection(self, collection_name: str, kb_version: Optional[str], build_id: Optional[str]) -> None:
+        """
+        原子地切换到新集合：先打开新集合，再在锁内替换句柄，旧句柄在进行中的检索全部结束后释放。
+
+        打开新集合失败时保留当前句柄继续服务（首次加载时向上抛出）。
+        """
+        current = self._handle
+        if current is not None and current.name == collection_name:
+            if kb_version != current.kb_version:
+                logger.info(f"Knowledge base version: {current.kb_version} -> {kb_version or 'unknown (no manifest)'}")
+            current.kb_version = kb_version
+            current.build_id = build_id
+            self.kb_version = kb_version
+            self.build_id = build_id
+            return
+        try:
+            vectorstore = Chroma(
+                persist_directory=settings.CHROMA_PERSIST_DIRECTORY,
+                embedding_function=self.embeddings,
+                collection_name=collection_name
+            )
+        except Exception:
+            if current is None:
+                raise
+            logger.error(f"Failed to open collection '{collection_name}'; keep serving '{current.name}'", exc_info=True)
+            return
+        handle = CollectionHandle(collection_name, vectorstore, kb_version, build_id)
+        with self._swap_lock:
+            previous = self._handle
+            self._handle = handle
+            self.kb_version = kb_version
+            self.build_id = build_id
+            if previous is not None:
+                self._retired_handles.append(previous)
+        if previous is not None:
+            logger.info(
+                f"Switched knowledge base collection: '{previous.name}' ({previous.kb_version}) -> "
+                f"'{collection_name}' ({kb_version}); {previous.refs} in-flight searches on the previous collection"
+            )
+            previous.retire()
+        else:
+            logger.info(f"Knowledge base version: None -> {kb_version or 'unknown (no manifest)'} (collection '{collection_name}')")
+
+    @contextmanager
+    def _acquire_handle(self) -> Iterator[CollectionHandle]:
+        """获取当前集合句柄并在检索期间持有引用（取句柄和加引用在同一把锁内，不会与切换交错）"""
+        with self._swap_lock:
+            handle = self._handle
+            if handle is None or handle.vectorstore is None:
+                raise RuntimeError("knowledge base collection is not loaded")
+            handle.acquire()
+        try:
+            yield handle
+        finally:
+            handle.release()
+
+    def current_build(self) -> Tuple[Optional[str], Optional[str]]:
+        """
+        检查清单是否变化后返回当前的 (知识库版本, 构建标识)。
 
-    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        供不经过向量检索的查表路径使用：知识库版本记录在评估的知识引用中，构建标识用于判断查找表是否过期。
+        """
+        if self.is_ready:
+            self._refresh_kb_version()
+        return self.kb_version, self.build_id
+
+    def _refresh_snapshot(self, force: bool = False) -> None:
+        """
+        VECTOR_INDEX_BACKEND=snapshot 时加载 current.json 指向的向量快照。
+
+        快照与清单的构建标识（文本不变的重新标注、重新嵌入也会改变）或当前嵌入模型不一致时不使用
+        （回退到 ChromaDB），指针文件变化（重新导出）时重新加载。
+        """
+        if settings.VECTOR_INDEX_BACKEND != "snapshot":
+            return
+        try:
+            mtime = os.stat(pointer_path(settings.VECTOR_SNAPSHOT_DIRECTORY)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._snapshot_mtime and not force:
+            return
+        self._snapshot_mtime = mtime
+        snapshot = VectorSnapshot.load_current(settings.VECTOR_SNAPSHOT_DIRECTORY) if mtime is not None else None
+        if snapshot is not None and (snapshot.build_id != self.build_id
+                                     or snapshot.embedding_model != embedding_model_id()):
+            logger.warning(
+                f"Vector snapshot of build {snapshot.build_id} ({snapshot.embedding_model}) does not match knowledge base "
+                f"build {self.build_id} ({embedding_model_id()}); falling back to Chroma until it is re-exported."
+            )
+            snapshot = None
+        elif snapshot is None:
+            logger.warning("No vector snapshot available; falling back to Chroma.")
+        else:
+            logger.info(f"Loaded vector snapshot {snapshot.kb_version} ({snapshot.dtype}, {len(snapshot)} vectors)")
+        self.snapshot = snapshot
+
+    def _search_uncached(self, queries: List[str], k: int, handle: CollectionHandle,
+                         filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        对多条查询执行向量检索：一次批量向量化，并发检索。
+
+        Args:
+            handle: 本次检索持有的集合句柄
+            filter: 元数据过滤条件（ChromaDB where 语法）
+
+        Returns:
+            与查询顺序一致的结果列表
+        """
+        with timed("retrieval"):
+            # 一次批量向量化全部查询（已缓存的查询向量不再编码）
+            with timed("embedding"):
+                query_embeddings = self.embeddings.embed_queries(queries)
+            with timed("vector_search"):
+                snapshot = self.snapshot
+                if snapshot is not None and snapshot.build_id == handle.build_id:
+                    # 内存映射快照：一次矩阵乘法完成全部查询
+                    return snapshot.search_results(query_embeddings, k, filter)
+                vectorstore = handle.vectorstore
+                if len(queries) == 1:
+                    all_docs = [vectorstore.similarity_search_by_vector_with_relevance_scores(
+                        query_embeddings[0], k=k, filter=filter
+                    )]
+                else:
+                    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                        all_docs = list(executor.map(
+                            lambda embedding: vectorstore.similarity_search_by_vector_with_relevance_scores(
+                                embedding, k=k, filter=filter
+                            ),
+                            query_embeddings
+                        ))
+        return [
+            [
+                {
+                    "content": doc.page_content,
+                    "metadata": doc.metadata,
+                    "score": float(score)  # 确保分数是可序列化的
+                }
+                for doc, score in docs
+            ]
+            for docs in all_docs
+        ]
+
+    def _search_with_cache(self, queries: List[str], k: int,
+                           filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """先查检索结果缓存，只对未命中的查询执行向量检索，并把新结果写入缓存"""
+        self._refresh_kb_version()
+        results: List[Optional[List[Dict[str, Any]]]] = [self.result_cache.get(query, k, filter) for query in queries]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            # 检索期间持有集合句柄，期间发生的切换不会释放本次检索使用的集合；结果按句柄所属的构建写入缓存
+            with self._acquire_handle() as handle:
+                fresh = self._search_uncached([queries[i] for i in missing], k, handle, filter)
+            for i, query_results in zip(missing, fresh):
+                results[i] = query_results
+                self.result_cache.put(queries[i], k, query_results, filter=filter, build_id=handle.build_id)
+        return results
+
+    def search(self, query: str, k: int = 3, filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         搜索知识库
         
         Args:
             query: 搜索查询
             k: 返回的最相关结果数量
+            filter: 元数据过滤条件（ChromaDB where 语法，如 kb_metadata.operation_filter() 的结果）
             
         Returns:
             搜索结果列表
         """
+        if not self.is_ready:
+            logger.warning("知识库尚未加载，跳过搜索")
+            return []
         try:
-            logger.info(f"搜索知识库: {query}, k={k}")
-            
-            # 使用向量存储进行搜索
-            docs = self.vectorstore.similarity_search_with_score(query, k=k)
+            logger.info(f"搜索知识库: {query}, k={k}, filter={filter}")
             
-            # 格式化结果
-            results = []
-            for doc, score in docs:
-                results.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "score": float(score)  # 确保分数是可序列化的
-                })
+            # 同一次知识库构建内相同查询直接返回缓存结果；未命中时分别计时查询向量化和向量检索
+            results = self._search_with_cache([query], k, filter)[0]
+
+            # 记录本次检索引用的文本块，随风险评估结果保存
+            record_knowledge_refs((r["metadata"].get("chunk_id") for r in results), self.kb_version)
             
             logger.info(f"搜索完成，找到 {len(results)} 条结果")
             return results
         except Exception as e:
             logger.error(f"搜索知识库时出错: {e}", exc_info=True)
             return []  # 返回空列表而不是抛出异常，避免中断流程
-    
 
-# 创建单例实例，应用启动时或首次导入时会加载数据库
-knowledge_service = KnowledgeBaseService()
+    def search_per_query(self, queries: List[str], k: int = 3,
+                         filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        多查询检索，分别返回每条查询的结果（不合并、不记录引用），供预计算知识上下文表使用。
+
+        Returns:
+            与 queries 一一对应的结果列表；知识库未加载时抛出 RuntimeError
+        """
+        if not self.is_ready:
+            raise RuntimeError("知识库尚未加载")
+        if not queries:
+            return []
+        return self._search_with_cache(queries, k, filter)
+
+    def search_many(self, queries: List[str], k: int = 3, max_results: Optional[int] = None,
+                    filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        多查询检索：一次批量向量化全部查询，并发执行向量检索，按文本块去重合并。
+
+        同一文本块被多个查询命中时保留最小的距离分数，并在 matched_queries 中记录命中它的查询。
+
+        Args:
+            queries: 查询列表
+            k: 每个查询返回的最相关结果数量
+            max_results: 合并后最多返回的结果数，默认不限
+            filter: 元数据过滤条件，对全部查询生效
+
+        Returns:
+            按分数（距离，越小越相关）升序排列的去重结果列表
+        """
+        if not queries:
+            return []
+        if not self.is_ready:
+            logger.warning("知识库尚未加载，跳过多查询检索")
+            return []
+        try:
+            logger.info(f"多查询检索知识库: {len(queries)} 条查询, k={k}, filter={filter}")
+
+            all_results = self._search_with_cache(queries, k, filter)
+            results = merge_query_results(queries, all_results, max_results)
+
+            # 记录本次检索引用的文本块，随风险评估结果保存
+            record_knowledge_refs((r["metadata"].get("chunk_id") for r in results), self.kb_version)
+
+            logger.info(f"多查询检索完成，合并去重后 {len(results)} 条结果")
+            return results
+        except Exception as e:
+            logger.error(f"多查询检索知识库时出错: {e}", exc_info=True)
+            return []
+    
 
-# 提供一个获取服务实例的函数
 def get_knowledge_service() -> KnowledgeBaseService:
-     """获取知识库服务的单例实例。"""
-     # 直接返回在模块级别创建的实例
-     # 如果 KnowledgeBaseService 没有正确初始化，这里会返回 None 或引发错误，需要调用方处理
-     global knowledge_service
-     if knowledge_service is None:
-         # 尝试重新初始化，或者记录错误
-         logger.warning("Knowledge service instance was None, attempting re-initialization.")
-         knowledge_service = KnowledgeBaseService()
-     elif knowledge_service.vectorstore is None:
-         # 如果实例存在但 vectorstore 未加载，也尝试重新加载
-          logger.warning("Knowledge service vectorstore is None, attempting reload.")
-          knowledge_service._load_vectorstore()
-
-     return knowledge_service
-# --- 函数添加结束 ---
+    """
+    获取知识库服务的单例实例。
+
+    未加载时在当前线程加载（后台预热正在进行则等待其完成）；加载失败后在退避时间内直接返回
+    未就绪的实例，检索返回空结果，不会每次调用都重新加载模型。
+    """
+    service = KnowledgeBaseService()
+    service.ensure_loaded()
+    return service
 
 
+async def warm_up_knowledge_base() -> None:
+    """后台预热：在线程中加载嵌入模型和向量库，不阻塞应用启动和其他接口"""
+    ready = await asyncio.to_thread(KnowledgeBaseService().ensure_loaded)
+    logger.info(f"Knowledge base warm-up finished: {'ready' if ready else 'not available'}")
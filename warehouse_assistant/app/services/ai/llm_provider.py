@@ -0,0 +1,256 @@
+"""
+LLM 提供方模块
+根据 settings.LLM_PROVIDER 创建 Agent 使用的 LLM：
+- deepseek: DeepSeek 官方 API（需要 DEEPSEEK_API_KEY）
+- stub: 本地确定性桩模型，不访问网络，按配置的延迟和 token 分布返回预设或规则生成的结果，用于离线压测
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.run_control import check_cancelled, current_deadline
+from warehouse_assistant.app.services.ai.run_timeline import record_llm_usage
+from warehouse_assistant.app.utils.tokens import estimate_tokens
+
+try:
+    from crewai import BaseLLM
+except ImportError:  # 旧版本 CrewAI 未在顶层导出 BaseLLM
+    from crewai.llms.base_llm import BaseLLM
+
+logger = logging.getLogger(__name__)
+
+# DeepSeek 模型名称（带 LiteLLM 提供商前缀）
+DEEPSEEK_MODEL_WITH_PROVIDER = "deepseek/deepseek-chat"
+
+_OBJECT_ID_PATTERN = re.compile(r"\b[0-9a-f]{24}\b")
+_OPERATION_TYPE_PATTERN = re.compile(r'"operation_type"\s*:\s*"([^"]+)"')
+# 分析步骤提示词中事件数据段的起止标记（见 RiskAssessmentCrew._analyze_risk）
+_EVENT_SECTION_HEADER = "事件数据："
+_EVENT_SECTION_END = "知识库信息："
+
+
+def _messages_to_text(messages: Union[str, List[Dict[str, str]]]) -> str:
+    """将 CrewAI 传入的消息列表拼接为纯文本"""
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(str(message.get("content", "")) for message in messages)
+
+
+def _event_section(text: str) -> str:
+    """
+    取出提示词中的事件数据段。
+
+    输出格式说明、Agent 背景和检索到的规则原文中都含有"操作延迟""不合格"等词，规则只能作用于事件本身；
+    提示词中没有事件数据段时（如直接传入事件 JSON）返回原文。
+    """
+    start = text.find(_EVENT_SECTION_HEADER)
+    if start < 0:
+        return text
+    start += len(_EVENT_SECTION_HEADER)
+    end = text.find(_EVENT_SECTION_END, start)
+    return text[start:end if end >= 0 else len(text)]
+
+
+def derive_risk_assessment(text: str) -> Dict[str, Any]:
+    """
+    根据提示词中的事件内容按简单规则推导风险评估结果（桩模型使用）。
+
+    Args:
+        text: 提示词文本，规则只作用于其中的事件数据段
+
+    Returns:
+        符合 RiskAssessment 结构的字典
+    """
+    text = _event_section(text)
+    compact = text.replace(" ", "")
+    if '"has_defect":true' in compact and "严重" in text:
+        return {
+            "risk_level": "高",
+            "risk_type": "质量问题",
+            "reason": "质检发现严重缺陷",
+            "suggestion": "隔离该批次并复检"
+        }
+    if "不合格" in text:
+        return {
+            "risk_level": "中",
+            "risk_type": "质量问题",
+            "reason": "质检结果存在不合格项",
+            "suggestion": "安排复检并追查前序工序参数"
+        }
+    if "延迟" in text:
+        return {
+            "risk_level": "低",
+            "risk_type": "操作延迟",
+            "reason": "记录中存在操作延迟",
+            "suggestion": "关注后续工序节拍"
+        }
+    return {
+        "risk_level": "无",
+        "risk_type": "无",
+        "reason": "未发现明显异常",
+        "suggestion": None
+    }
+
+
+class StubLLM(BaseLLM):
+    """
+    本地确定性桩模型。
+
+    - 同一提示词在同一种子下总是得到相同的延迟、token 数和输出；
+    - 延迟服从对数正态分布（中位数 STUB_LLM_LATENCY_MS，形状 STUB_LLM_LATENCY_SIGMA）；
+    - 输出 token 数服从截断正态分布（STUB_LLM_COMPLETION_TOKENS_MEAN / _STD）；
+    - 优先使用 STUB_LLM_RESPONSES_FILE 中的预设回复，否则按 ReAct 格式调用工具或给出规则推导的结果。
+    """
+
+    def __init__(self):
+        super().__init__(model="stub/deterministic", temperature=0)
+        self.seed = settings.STUB_LLM_SEED
+        self.latency_ms = settings.STUB_LLM_LATENCY_MS
+        self.latency_sigma = settings.STUB_LLM_LATENCY_SIGMA
+        self.completion_tokens_mean = settings.STUB_LLM_COMPLETION_TOKENS_MEAN
+        self.completion_tokens_std = settings.STUB_LLM_COMPLETION_TOKENS_STD
+        self.canned_responses = self._load_canned_responses(settings.STUB_LLM_RESPONSES_FILE)
+        self._usage_lock = threading.Lock()
+        self._usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "successful_requests": 0}
+
+    @staticmethod
+    def _load_canned_responses(path: str) -> List[Dict[str, str]]:
+        """
+        加载预设回复文件。
+
+        文件为 JSON 列表，每项形如 {"match": "提示词中的子串", "response": "回复文本"}，按顺序匹配。
+        """
+        if not path:
+            return []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                responses = json.load(f)
+            logger.info(f"已加载 {len(responses)} 条桩模型预设回复: {path}")
+            return responses
+        except Exception as e:
+            logger.error(f"加载桩模型预设回复失败: {e}", exc_info=True)
+            return []
+
+    def _respond(self, prompt: str) -> str:
+        """根据提示词生成回复（ReAct 文本格式）"""
+        for canned in self.canned_responses:
+            if canned.get("match") and canned["match"] in prompt:
+                return canned.get("response", "")
+
+        has_tools = "get_event_tool" in prompt or "knowledge_search_tool" in prompt
+        if "risk_level" in prompt and not has_tools:
+            assessment = derive_risk_assessment(prompt)
+            return f"Thought: 已完成分析\nFinal Answer: {json.dumps(assessment, ensure_ascii=False)}"
+
+        if "Observation:" in prompt:
+            observation = prompt.rsplit("Observation:", 1)[1].strip()
+            return f"Thought: I now know the final answer\nFinal Answer: {observation}"
+
+        if "get_event_tool" in prompt:
+            match = _OBJECT_ID_PATTERN.search(prompt)
+            if match:
+                action_input = json.dumps({"event_id": match.group(0)})
+                return f"Thought: 需要获取事件数据\nAction: get_event_tool\nAction Input: {action_input}"
+
+        if "knowledge_search_tool" in prompt:
+            match = _OPERATION_TYPE_PATTERN.search(prompt)
+            operation_type = match.group(1) if match else "操作"
+            action_input = json.dumps({"query": f"{operation_type} 参数 标准", "k": 3}, ensure_ascii=False)
+            return f"Thought: 需要检索相关规范\nAction: knowledge_search_tool\nAction Input: {action_input}"
+
+        return "Thought: I now know the final answer\nFinal Answer: {}"
+
+    def call(
+        self,
+        messages: Union[str, List[Dict[str, str]]],
+        tools: Optional[List[dict]] = None,
+        callbacks: Optional[List[Any]] = None,
+        available_functions: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> str:
+        """按配置的分布模拟一次 LLM 调用"""
+        prompt = _messages_to_text(messages)
+        prompt_digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        rng = random.Random(f"{self.seed}:{prompt_digest}")
+
+        latency_seconds = rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000.0
+        completion_tokens = max(1, int(rng.gauss(self.completion_tokens_mean, self.completion_tokens_std)))
+        prompt_tokens = estimate_tokens(prompt)
+
+        check_cancelled()
+        deadline = current_deadline()
+        if deadline is not None:
+            # 运行被取消时立即结束等待
+            deadline.wait(latency_seconds)
+        else:
+            time.sleep(latency_seconds)
+        response = self._respond(prompt)
+
+        with self._usage_lock:
+            self._usage["prompt_tokens"] += prompt_tokens
+            self._usage["completion_tokens"] += completion_tokens
+            self._usage["total_tokens"] += prompt_tokens + completion_tokens
+            self._usage["successful_requests"] += 1
+        # 上报到当前风险评估的时间线
+        record_llm_usage(prompt_tokens, completion_tokens)
+        return response
+
+    def usage_summary(self) -> Dict[str, int]:
+        """返回累计的模拟 token 用量"""
+        with self._usage_lock:
+            return dict(self._usage)
+
+    def supports_function_calling(self) -> bool:
+        # 使用 ReAct 文本格式调用工具
+        return False
+
+    def supports_stop_words(self) -> bool:
+        return False
+
+    def get_context_window_size(self) -> int:
+        return 64000
+
+
+def create_llm():
+    """
+    根据 settings.LLM_PROVIDER 创建 LLM 实例。
+
+    Returns:
+        CrewAI Agent 可用的 LLM 实例
+
+    Raises:
+        ValueError: 提供方未知或所需的 API Key 未配置
+    """
+    provider = settings.LLM_PROVIDER.lower()
+
+    if provider == "stub":
+        logger.info(
+            f"使用本地桩模型 (延迟中位数 {settings.STUB_LLM_LATENCY_MS}ms, "
+            f"输出 token 均值 {settings.STUB_LLM_COMPLETION_TOKENS_MEAN})"
+        )
+        return StubLLM()
+
+    if provider == "deepseek":
+        # 检查 DeepSeek API Key
+        if not settings.DEEPSEEK_API_KEY or settings.DEEPSEEK_API_KEY == "YOUR_DEEPSEEK_API_KEY_PLACEHOLDER":
+            raise ValueError("DeepSeek API Key 未配置。请设置 DEEPSEEK_API_KEY 环境变量，或将 LLM_PROVIDER 设为 stub。")
+
+        from langchain_openai import ChatOpenAI  # 使用langchain_openai
+
+        logger.info(f"使用 DeepSeek 模型 (带提供商前缀): {DEEPSEEK_MODEL_WITH_PROVIDER}")
+        # 创建 ChatOpenAI 实例，明确传入模型名称和 API Key
+        return ChatOpenAI(
+            model=DEEPSEEK_MODEL_WITH_PROVIDER,
+            api_key=settings.DEEPSEEK_API_KEY,
+            temperature=0.7,
+            max_tokens=2000,
+            timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS
+        )
+
+    raise ValueError(f"未知的 LLM_PROVIDER: {settings.LLM_PROVIDER}（可选值: deepseek, stub）")
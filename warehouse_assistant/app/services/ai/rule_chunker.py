@@ -0,0 +1,97 @@
+"""
+规则文档结构化切割模块
+按“第X部分 / 类别X / 规则 X.Y”标题切割规则文档：每条规则一个文本块（不截断、不与相邻文本块重叠），
+规则编号作为稳定的 rule_id；标题之外的说明性内容按段落合并，超过长度上限时在段落边界处分开。
+规则文本块以所属类别标题开头，检索时保留类别语境。
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from warehouse_assistant.app.services.ai.kb_metadata import PART_HEADING_PATTERN, SECTION_HEADING_PATTERN
+
+# 切割规则的版本；修改切割逻辑后递增，init_knowledge_base.py 据此全量重建
+CHUNKER_VERSION = 1
+
+RULE_HEADING_PATTERN = re.compile(r"^规则\s*(\d+(?:\.\d+)*)\s*[:：]\s*(.*)$", re.MULTILINE)
+_PARAGRAPH_SEPARATOR = re.compile(r"\n\s*\n")
+
+
+def has_rule_structure(text: str) -> bool:
+    """文本中是否包含“规则 X.Y:”形式的规则标题"""
+    return RULE_HEADING_PATTERN.search(text) is not None
+
+
+def _split_paragraphs(text: str, offset: int, max_chars: int) -> List[Dict[str, Any]]:
+    """把说明性内容按段落合并为不超过 max_chars 的文本块（单个段落超长时单独成块）"""
+    chunks: List[Dict[str, Any]] = []
+    current: List[str] = []
+    current_start = offset
+    position = 0
+    for match in list(_PARAGRAPH_SEPARATOR.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        paragraph = text[position:end].strip()
+        paragraph_start = offset + position + (len(text[position:end]) - len(text[position:end].lstrip()))
+        if paragraph:
+            if current and sum(len(p) + 2 for p in current) + len(paragraph) > max_chars:
+                chunks.append({"start_index": current_start, "content": "\n\n".join(current)})
+                current = []
+            if not current:
+                current_start = paragraph_start
+            current.append(paragraph)
+        if match:
+            position = match.end()
+    if current:
+        chunks.append({"start_index": current_start, "content": "\n\n".join(current)})
+    return chunks
+
+
+def split_rules_document(text: str, max_chars: int = 800) -> List[Dict[str, Any]]:
+    """
+    按标题结构切割规则文档。
+
+    Args:
+        text: 文档全文（或 PDF 的单页文本）
+        max_chars: 说明性内容文本块的长度上限（规则文本块不受限制，每条规则一个文本块）
+
+    Returns:
+        文本块列表，每项为 {start_index, content, rule_id?, rule_title?}
+    """
+    boundaries = sorted(
+        [(m.start(), "part", m) for m in PART_HEADING_PATTERN.finditer(text)]
+        + [(m.start(), "section", m) for m in SECTION_HEADING_PATTERN.finditer(text)]
+        + [(m.start(), "rule", m) for m in RULE_HEADING_PATTERN.finditer(text)],
+        key=lambda boundary: boundary[0]
+    )
+
+    chunks: List[Dict[str, Any]] = []
+    # 第一个标题之前的内容（文档标题、版本信息等）
+    first_start = boundaries[0][0] if boundaries else len(text)
+    chunks.extend(_split_paragraphs(text[:first_start], 0, max_chars))
+
+    section: Optional[str] = None
+    for index, (start, kind, match) in enumerate(boundaries):
+        end = boundaries[index + 1][0] if index + 1 < len(boundaries) else len(text)
+        heading = match.group(0).strip()
+        body_start = match.end()
+        if kind == "part":
+            section = None
+        elif kind == "section":
+            section = heading
+
+        if kind == "rule":
+            body = text[start:end].strip()
+            content = f"{section}\n{body}" if section else body
+            chunks.append({
+                "start_index": start,
+                "content": content,
+                "rule_id": match.group(1),
+                "rule_title": match.group(2).strip(),
+            })
+            continue
+
+        # 部分或类别标题下、第一条规则之前的说明性内容；只有标题时不单独成块
+        body = text[body_start:end]
+        for chunk in _split_paragraphs(body, body_start, max_chars):
+            chunk["content"] = f"{heading}\n{chunk['content']}"
+            chunks.append(chunk)
+    return chunks
@@ -0,0 +1,144 @@
+"""
+规则索引模块
+构建知识库时从规则文档的文本块生成 rule_id → 文本块 的查找表 (rule_index.json，位于 ChromaDB 持久化目录)，
+风险分析时可以按规则编号直接取得规则原文，不需要向量检索，也不依赖嵌入模型是否已加载。
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from warehouse_assistant.app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RULE_INDEX_FILE_NAME = "rule_index.json"
+
+
+def rule_index_path(persist_directory: Optional[str] = None) -> str:
+    """规则索引文件路径，位于 ChromaDB 持久化目录下"""
+    return os.path.join(persist_directory or settings.CHROMA_PERSIST_DIRECTORY, RULE_INDEX_FILE_NAME)
+
+
+def build_rule_index(collection, kb_version: str) -> Dict[str, Any]:
+    """
+    从集合中规则文档的文本块生成规则索引。
+
+    多个规则文档中出现相同编号时保留来源路径排序靠前的一条并记录警告。
+
+    Args:
+        collection: chromadb 集合
+        kb_version: 知识库版本
+
+    Returns:
+        {"kb_version": ..., "built_at": ..., "rules": {rule_id: {...}}}
+    """
+    page = collection.get(where={"doc_type": "rules"}, include=["documents", "metadatas"])
+    entries = sorted(
+        (
+            (metadata or {}, document, chunk_id)
+            for chunk_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"])
+            if (metadata or {}).get("rule_id")
+        ),
+        key=lambda entry: (str(entry[0].get("source", "")), entry[0].get("start_index", 0))
+    )
+    rules: Dict[str, Dict[str, Any]] = {}
+    for metadata, document, chunk_id in entries:
+        rule_id = str(metadata["rule_id"])
+        if rule_id in rules:
+            logger.warning(f"规则编号 {rule_id} 在 {rules[rule_id]['source']} 和 {metadata.get('source')} 中重复，保留前者")
+            continue
+        rules[rule_id] = {
+            "rule_id": rule_id,
+            "title": metadata.get("rule_title", ""),
+            "section": metadata.get("section", ""),
+            "source": metadata.get("source", ""),
+            "chunk_id": chunk_id,
+            "content": document,
+        }
+    return {"kb_version": kb_version, "built_at": datetime.utcnow().isoformat(), "rules": rules}
+
+
+def save_rule_index(index: Dict[str, Any], persist_directory: Optional[str] = None) -> None:
+    """原子地写入规则索引"""
+    path = rule_index_path(persist_directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def normalize_rule_id(rule_id: str) -> str:
+    """规范化规则编号：去掉“规则”前缀和空白，如 “规则 2.1” → “2.1”"""
+    return str(rule_id).replace("规则", "").strip().rstrip(":：")
+
+
+class RuleIndex:
+    """规则索引的只读访问，索引文件被替换（知识库重建）后自动重新加载"""
+
+    def __init__(self, persist_directory: Optional[str] = None):
+        self.path = rule_index_path(persist_directory)
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._index: Dict[str, Any] = {"kb_version": None, "rules": {}}
+
+    def _refresh(self) -> Dict[str, Any]:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                self._mtime = mtime
+                if mtime is None:
+                    self._index = {"kb_version": None, "rules": {}}
+                else:
+                    try:
+                        with open(self.path, 'r', encoding='utf-8') as f:
+                            self._index = json.load(f)
+                    except Exception as e:
+                        logger.error(f"读取规则索引失败: {e}", exc_info=True)
+                        self._index = {"kb_version": None, "rules": {}}
+            return self._index
+
+    @property
+    def kb_version(self) -> Optional[str]:
+        return self._refresh().get("kb_version")
+
+    def get(self, rule_id: str) -> Optional[Dict[str, Any]]:
+        """按编号获取规则，不存在时返回 None"""
+        return self._refresh()["rules"].get(normalize_rule_id(rule_id))
+
+    def get_many(self, rule_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """按编号批量获取规则，忽略不存在的编号，结果按请求顺序去重"""
+        rules = self._refresh()["rules"]
+        seen = set()
+        found = []
+        for rule_id in rule_ids:
+            key = normalize_rule_id(rule_id)
+            if key in rules and key not in seen:
+                seen.add(key)
+                found.append(rules[key])
+        return found
+
+    def catalog(self) -> List[Dict[str, str]]:
+        """全部规则的编号和标题（按编号排序），供提示词列出可查询的规则"""
+        rules = self._refresh()["rules"]
+
+        def sort_key(rule_id: str):
+            return [int(part) if part.isdigit() else part for part in rule_id.split(".")]
+
+        return [{"rule_id": rule_id, "title": rules[rule_id].get("title", "")} for rule_id in sorted(rules, key=sort_key)]
+
+
+_rule_index: Optional[RuleIndex] = None
+
+
+def get_rule_index() -> RuleIndex:
+    """获取规则索引单例"""
+    global _rule_index
+    if _rule_index is None:
+        _rule_index = RuleIndex()
+    return _rule_index
@@ -0,0 +1,188 @@
+"""
+风险评估运行控制模块
+为每次风险评估提供整体截止时间和单阶段超时，并支持协作式取消：
+
+- 每个阶段在独立的守护线程中执行，调用方最多等待 min(阶段超时, 剩余时间)，
+  超时后立即返回并释放调用方占用的工作线程（如 asyncio.to_thread 的线程池槽位）；
+- 超时同时设置取消标记，仍在运行的阶段线程在下一个检查点（Agent 步骤回调、工具调用、
+  LLM 调用前后）抛出 RunCancelled 退出，LLM 请求本身由请求超时兜底。
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Iterator, Optional
+
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# 当前线程所属运行的截止时间
+_local = threading.local()
+
+# 超时后仍未退出的阶段线程数
+_abandoned_lock = threading.Lock()
+_abandoned_threads = 0
+
+
+class RunCancelled(BaseException):
+    """
+    运行已被取消。
+
+    与 asyncio.CancelledError 一样继承自 BaseException，避免被工具和 CrewAI 内部宽泛的
+    `except Exception` 吞掉，确保被放弃的阶段线程能尽快退出。
+    """
+
+
+class RunTimedOut(RunCancelled):
+    """运行或阶段超过截止时间"""
+
+    def __init__(self, message: str, stage: Optional[str] = None):
+        super().__init__(message)
+        self.stage = stage
+
+
+class RunDeadline:
+    """单次风险评估的截止时间和取消标记"""
+
+    def __init__(self, run_timeout: float, stage_timeout: float):
+        """
+        Args:
+            run_timeout: 整次运行的超时时间（秒），<=0 表示不限
+            stage_timeout: 单个阶段的超时时间（秒），<=0 表示不限
+        """
+        self.run_timeout = run_timeout
+        self.stage_timeout = stage_timeout
+        self._deadline = time.monotonic() + run_timeout if run_timeout > 0 else None
+        self._cancelled = threading.Event()
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """距整体截止时间的剩余秒数，不限时返回 None"""
+        if self._deadline is None:
+            return None
+        return self._deadline - time.monotonic()
+
+    def cancel(self, reason: str) -> None:
+        """设置取消标记，正在运行的阶段线程会在下一个检查点退出"""
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    def check(self) -> None:
+        """检查点：已取消或已超过整体截止时间时抛出异常"""
+        if self._cancelled.is_set():
+            raise RunCancelled(self.reason or "运行已取消")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self.cancel("超过整体截止时间")
+            raise RunTimedOut("超过整体截止时间")
+
+    def wait(self, seconds: float) -> None:
+        """可被取消打断的等待"""
+        if self._cancelled.wait(seconds):
+            raise RunCancelled(self.reason or "运行已取消")
+
+    @contextmanager
+    def activate(self) -> Iterator["RunDeadline"]:
+        """将该截止时间设为当前线程的活动截止时间"""
+        previous = getattr(_local, "deadline", None)
+        _local.deadline = self
+        try:
+            yield self
+        finally:
+            _local.deadline = previous
+
+    def stage_budget(self) -> Optional[float]:
+        """当前阶段可用的时间：阶段超时与剩余时间的较小值，不限时返回 None"""
+        budgets = [b for b in (self.stage_timeout if self.stage_timeout > 0 else None, self.remaining())
+                   if b is not None]
+        return min(budgets) if budgets else None
+
+    def call(self, stage: str, fn: Callable[..., Any], *args: Any, context=None, **kwargs: Any) -> Any:
+        """
+        在独立线程中执行一个阶段，超过阶段预算时取消运行并抛出 RunTimedOut。
+
+        Args:
+            stage: 阶段名称
+            fn: 阶段函数
+            context: 需要在阶段线程中激活的上下文（如 RunTimeline.activate），可选
+
+        Returns:
+            阶段函数的返回值
+        """
+        self.check()
+        budget = self.stage_budget()
+
+        outcome: dict = {}
+        done = threading.Event()
+
+        def target():
+            try:
+                with self.activate(), (context() if context else nullcontext()):
+                    outcome["result"] = fn(*args, **kwargs)
+            except BaseException as e:  # 包括 RunCancelled，交给调用方处理
+                outcome["error"] = e
+            finally:
+                # 与调用方的超时判断互斥，保证被放弃的线程计数准确
+                with _abandoned_lock:
+                    done.set()
+                    abandoned = outcome.get("abandoned", False)
+                if abandoned:
+                    _release_abandoned(stage)
+
+        thread = threading.Thread(target=target, name=f"risk-stage-{stage}", daemon=True)
+        thread.start()
+
+        if not done.wait(budget):
+            self.cancel(f"阶段 {stage} 超时")
+            with _abandoned_lock:
+                # done 可能恰好在超时后被设置，此时线程已结束，不计入被放弃线程
+                if not done.is_set():
+                    outcome["abandoned"] = True
+                    _track_abandoned(1)
+            if outcome.get("abandoned"):
+                logger.warning(f"阶段 {stage} 超过 {budget:.1f}s 未完成，已取消并放弃等待")
+                raise RunTimedOut(f"阶段 {stage} 超过 {budget:.1f}s 未完成", stage=stage)
+
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+
+def _track_abandoned(delta: int) -> None:
+    """调整被放弃线程计数（调用方需持有 _abandoned_lock）"""
+    global _abandoned_threads
+    _abandoned_threads += delta
+
+
+def _release_abandoned(stage: str) -> None:
+    """被放弃的阶段线程最终退出"""
+    with _abandoned_lock:
+        _track_abandoned(-1)
+    logger.info(f"已超时的阶段 {stage} 的线程已退出")
+
+
+def abandoned_thread_count() -> int:
+    """超时后仍在运行的阶段线程数"""
+    with _abandoned_lock:
+        return _abandoned_threads
+
+
+get_metrics_registry().register_gauge("risk_run.abandoned_stage_threads", abandoned_thread_count)
+
+
+def current_deadline() -> Optional[RunDeadline]:
+    """获取当前线程的活动截止时间，没有则返回 None"""
+    return getattr(_local, "deadline", None)
+
+
+def check_cancelled() -> None:
+    """协作式取消检查点，供工具和 LLM 在耗时操作前后调用；不在风险评估中时不做任何事"""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check()
@@ -0,0 +1,185 @@
+"""
+风险评估运行时间线模块
+记录每次风险评估各阶段的耗时、各 Agent 的 LLM token 用量，以及检索、嵌入、数据库读写等子操作的耗时，
+同时汇总到进程内直方图供 /api/metrics 输出
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from warehouse_assistant.app.services.ai.run_control import RunTimedOut
+from warehouse_assistant.app.utils.metrics import TOKEN_BUCKETS, get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# 当前线程正在记录的时间线（CrewAI 顺序流程中，工具和 LLM 调用与 kickoff 在同一线程执行）
+_local = threading.local()
+
+
+class RunTimeline:
+    """单次风险评估的时间线"""
+
+    def __init__(self, event_id: str):
+        self.event_id = event_id
+        self.started_at = datetime.utcnow()
+        self.status: Optional[str] = None
+        self.total_ms: Optional[float] = None
+        self.stages: List[Dict[str, Any]] = []
+        # 本次运行检索到的知识库文本块及知识库版本，用于知识库更新后的选择性重新评估
+        self.kb_version: Optional[str] = None
+        self.retrieved_chunk_ids: Set[str] = set()
+        # 知识上下文压缩节省的 token 数（合并重叠、低分过滤和预算裁剪的合计）
+        self.context_tokens_saved = 0
+        self._start = time.perf_counter()
+        self._current_stage: Optional[Dict[str, Any]] = None
+
+    @contextmanager
+    def activate(self) -> Iterator["RunTimeline"]:
+        """将该时间线设为当前线程的活动时间线"""
+        previous = getattr(_local, "timeline", None)
+        _local.timeline = self
+        try:
+            yield self
+        finally:
+            _local.timeline = previous
+
+    @contextmanager
+    def stage(self, name: str, agent: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        记录一个阶段的耗时；阶段内发生的 token 用量和子操作耗时都会归入该阶段。
+
+        Args:
+            name: 阶段名称，如 load_context、retrieve_knowledge、analyze_risk
+            agent: 执行该阶段的 Agent 角色（非 LLM 阶段为 None）
+        """
+        entry: Dict[str, Any] = {
+            "name": name,
+            "agent": agent,
+            "duration_ms": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "timings_ms": {},
+            "status": "success",
+        }
+        previous = self._current_stage
+        self._current_stage = entry
+        start = time.perf_counter()
+        try:
+            yield entry
+        except RunTimedOut:
+            entry["status"] = "timed_out"
+            raise
+        except BaseException:
+            entry["status"] = "error"
+            raise
+        finally:
+            entry["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self._current_stage = previous
+            self.stages.append(entry)
+            _observe_stage(entry)
+
+    def record_tokens(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """将 LLM token 用量累加到当前阶段"""
+        if self._current_stage is not None:
+            self._current_stage["prompt_tokens"] += int(prompt_tokens or 0)
+            self._current_stage["completion_tokens"] += int(completion_tokens or 0)
+
+    def record_timing(self, kind: str, duration_ms: float) -> None:
+        """将子操作耗时累加到当前阶段"""
+        if self._current_stage is not None:
+            timings = self._current_stage["timings_ms"]
+            timings[kind] = round(timings.get(kind, 0.0) + duration_ms, 2)
+
+    def record_knowledge_refs(self, chunk_ids: Iterable[str], kb_version: Optional[str]) -> None:
+        """记录检索到的文本块ID和知识库版本"""
+        self.retrieved_chunk_ids.update(chunk_id for chunk_id in chunk_ids if chunk_id)
+        if kb_version:
+            self.kb_version = kb_version
+
+    def record_context_compression(self, stats: Dict[str, int]) -> None:
+        """记录一次知识上下文压缩的统计（归入当前阶段，并累加节省的 token 数）"""
+        self.context_tokens_saved += int(stats.get("tokens_saved", 0))
+        if self._current_stage is not None:
+            compression = self._current_stage.setdefault("context_compression", {})
+            for key, value in stats.items():
+                compression[key] = compression.get(key, 0) + int(value)
+
+    def knowledge_refs(self) -> Dict[str, Any]:
+        """本次运行引用的知识（随风险评估结果一起保存）"""
+        return {"kb_version": self.kb_version, "chunk_ids": sorted(self.retrieved_chunk_ids)}
+
+    def finish(self, status: str) -> None:
+        """结束时间线，记录最终状态和总耗时"""
+        self.status = status
+        self.total_ms = round((time.perf_counter() - self._start) * 1000, 2)
+        registry = get_metrics_registry()
+        registry.observe("risk_run.total_ms", self.total_ms)
+        registry.increment(f"risk_run.status.{status}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可写入数据库的字典"""
+        return {
+            "started_at": self.started_at,
+            "status": self.status,
+            "total_ms": self.total_ms,
+            "prompt_tokens": sum(s["prompt_tokens"] for s in self.stages),
+            "completion_tokens": sum(s["completion_tokens"] for s in self.stages),
+            "context_tokens_saved": self.context_tokens_saved,
+            "stages": self.stages,
+        }
+
+
+def _observe_stage(entry: Dict[str, Any]) -> None:
+    """将阶段数据汇总到直方图"""
+    registry = get_metrics_registry()
+    registry.observe(f"risk_run.stage.{entry['name']}.duration_ms", entry["duration_ms"])
+    if entry["agent"]:
+        registry.observe(f"llm.prompt_tokens.{entry['agent']}", entry["prompt_tokens"], TOKEN_BUCKETS)
+        registry.observe(f"llm.completion_tokens.{entry['agent']}", entry["completion_tokens"], TOKEN_BUCKETS)
+
+
+def current_timeline() -> Optional[RunTimeline]:
+    """获取当前线程的活动时间线，没有则返回 None"""
+    return getattr(_local, "timeline", None)
+
+
+def record_llm_usage(prompt_tokens: int, completion_tokens: int) -> None:
+    """由 LLM 实现直接上报 token 用量（记录到当前时间线的当前阶段）"""
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.record_tokens(prompt_tokens, completion_tokens)
+
+
+def record_knowledge_refs(chunk_ids: Iterable[str], kb_version: Optional[str]) -> None:
+    """由知识库检索上报本次检索到的文本块（记录到当前时间线）"""
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.record_knowledge_refs(chunk_ids, kb_version)
+
+
+def record_context_compression(stats: Dict[str, int]) -> None:
+    """由知识上下文构建上报压缩统计（记录到当前时间线）"""
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.record_context_compression(stats)
+
+
+@contextmanager
+def timed(kind: str) -> Iterator[None]:
+    """
+    记录一次子操作的耗时（如 db_read、db_write、embedding、vector_search）。
+
+    不论是否处于风险评估中都会计入直方图 `<kind>.duration_ms`；处于评估中时还会归入当前阶段。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        get_metrics_registry().observe(f"{kind}.duration_ms", duration_ms)
+        timeline = current_timeline()
+        if timeline is not None:
+            timeline.record_timing(kind, duration_ms)
@@ -0,0 +1,76 @@
+"""
+检索结果缓存模块
+在同一次知识库构建内，相同 (查询, k, 过滤条件) 的 top-k 结果完全相同，
+直接返回缓存的结果，不再访问嵌入模型和 ChromaDB。知识库重建（构建标识变化，包括文本不变的
+重新标注和重新嵌入）时整体失效。
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from warehouse_assistant.app.services.ai.embedding_cache import normalize_query
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
+
+
+class SearchResultCache:
+    """按知识库构建隔离的检索结果 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max(0, max_entries)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, List[Dict[str, Any]]]" = OrderedDict()
+        self.build_id: Optional[str] = None
+        get_metrics_registry().register_gauge("search_cache.entries", lambda: len(self._entries))
+
+    @staticmethod
+    def _key(query: str, k: int, filter: Optional[Dict[str, Any]]) -> Tuple:
+        filter_key = json.dumps(filter, sort_keys=True, ensure_ascii=False) if filter else ""
+        return normalize_query(query), k, filter_key
+
+    def set_build(self, build_id: Optional[str]) -> None:
+        """切换知识库构建（见 kb_manifest.kb_build_id），构建变化时清空缓存"""
+        with self._lock:
+            if build_id != self.build_id:
+                self._entries.clear()
+                self.build_id = build_id
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, query: str, k: int, filter: Optional[Dict[str, Any]] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        读取缓存的结果。
+
+        Returns:
+            结果列表的副本（每条结果为新的字典，调用方可以修改）；未命中或构建未知时返回 None
+        """
+        if self.build_id is None or self.max_entries == 0:
+            return None
+        key = self._key(query, k, filter)
+        with self._lock:
+            results = self._entries.get(key)
+            if results is not None:
+                self._entries.move_to_end(key)
+        get_metrics_registry().increment("search_cache.hits" if results is not None else "search_cache.misses")
+        return [dict(result) for result in results] if results is not None else None
+
+    def put(self, query: str, k: int, results: List[Dict[str, Any]],
+            filter: Optional[Dict[str, Any]] = None, build_id: Optional[str] = None) -> None:
+        """
+        写入结果；知识库构建未知（没有清单）或写入期间已切换到新构建时不缓存。
+
+        Args:
+            build_id: 检索使用的集合所属的构建
+        """
+        if build_id is None or self.max_entries == 0:
+            return
+        key = self._key(query, k, filter)
+        with self._lock:
+            if build_id != self.build_id:
+                return
+            self._entries[key] = [dict(result) for result in results]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
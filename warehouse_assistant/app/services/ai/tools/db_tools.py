@@ -4,6 +4,8 @@ from warehouse_assistant.app.services.database.mongo_service import get_db_servi
 import logging
 import json
 from warehouse_assistant.app.services.database.mongo_service import JSONEncoder # 导入自定义编码器
+from warehouse_assistant.app.services.ai.run_timeline import timed
+from warehouse_assistant.app.services.ai.run_control import check_cancelled
 from crewai.tools import BaseTool  # 只导入BaseTool
 from bson import ObjectId
 
@@ -32,10 +34,12 @@ class GetEventTool(BaseTool):
         Returns:
             事件数据的JSON字符串
         """
+        check_cancelled()
         try:
             logger.info(f"获取事件数据: {event_id}")
             db_service = get_db_service()
-            event = db_service.get_event_by_id(event_id)
+            with timed("db_read"):
+                event = db_service.get_event_by_id(event_id)
             
             if not event:
                 return json.dumps({"error": f"未找到ID为 {event_id} 的事件"})
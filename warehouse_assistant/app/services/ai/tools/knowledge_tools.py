@@ -1,8 +1,14 @@
 from typing import Type, Optional, Dict, Any, List
 from pydantic import BaseModel, Field
+from warehouse_assistant.app.services.ai.context_builder import compress_knowledge
 from warehouse_assistant.app.services.ai.knowledge_base import get_knowledge_service
+from warehouse_assistant.app.services.ai.run_control import check_cancelled
+from warehouse_assistant.app.services.ai.kb_metadata import operation_filter
+from warehouse_assistant.app.services.ai.rule_index import get_rule_index
+from warehouse_assistant.app.services.ai.run_timeline import record_knowledge_refs, timed
 import logging
 import json
+import re
 
 from crewai.tools import BaseTool  # 只导入BaseTool
 
@@ -11,32 +17,81 @@ logger = logging.getLogger(__name__)
 class KnowledgeSearchInput(BaseModel):
     query: str = Field(description="The search query for the knowledge base.")
     k: int = Field(default=3, description="Number of most relevant results to return.")
+    operation_type: Optional[str] = Field(
+        default=None,
+        description="Operation type of the event being assessed (e.g. 热轧, 质检, 入库); "
+                    "restricts the search to rules that apply to it."
+    )
 
 class KnowledgeSearchTool(BaseTool):
     """用于搜索知识库的工具"""
     
     name: str = "knowledge_search_tool"
-    description: str = "搜索知识库中与查询相关的内容"
+    description: str = "搜索知识库中与查询相关的内容，可提供事件的操作类型以只检索适用于该操作的规则"
     
-    def _run(self, query: str, k: int = 3) -> str:
+    def _run(self, query: str, k: int = 3, operation_type: Optional[str] = None) -> str:
         """运行知识库搜索工具"""
+        check_cancelled()
         try:
-            logger.info(f"开始搜索知识库，查询: {query}, 返回结果数: {k}")
+            logger.info(f"开始搜索知识库，查询: {query}, 返回结果数: {k}, 操作类型: {operation_type}")
             knowledge_service = get_knowledge_service()
-            results = knowledge_service.search(query, k=k)
+            search_filter = operation_filter(operation_type)
+            results = knowledge_service.search(query, k=k, filter=search_filter)
+            if not results and search_filter is not None:
+                # 知识库尚未按操作类型标注时不过滤重试
+                results = knowledge_service.search(query, k=k)
             logger.info(f"知识库搜索完成，找到 {len(results)} 条结果")
             
             # 记录搜索结果的摘要
             for i, result in enumerate(results):
                 content_preview = result.get('content', '')[:100] + '...' if len(result.get('content', '')) > 100 else result.get('content', '')
                 logger.info(f"知识库结果 {i+1}: {content_preview}")
-            
-            return json.dumps(results, ensure_ascii=False)
+
+            # 合并重叠、过滤低相关结果并裁剪到 token 预算；只输出来源和正文，不输出完整元数据和分数
+            results, _ = compress_knowledge(results)
+            return json.dumps([
+                {
+                    "source": result["metadata"].get("source", "未知来源"),
+                    **({"rule_id": result["metadata"]["rule_id"]} if result["metadata"].get("rule_id") else {}),
+                    "content": result["content"],
+                }
+                for result in results
+            ], ensure_ascii=False)
         except Exception as e:
             logger.error(f"知识库搜索失败: {e}", exc_info=True)
             return f"知识库搜索失败: {str(e)}"
 
+class GetRuleTool(BaseTool):
+    """按规则编号获取规则原文的工具（查规则索引，不做向量检索）"""
+
+    name: str = "get_rule_tool"
+    description: str = "按规则编号获取规则原文，可一次查询多条，编号之间用逗号或空格分隔，例如 \"2.1, 3.2\""
+
+    def _run(self, rule_ids: str) -> str:
+        """运行规则查询工具"""
+        check_cancelled()
+        try:
+            requested = [rule_id for rule_id in re.split(r"[,，、;；\s]+", rule_ids) if rule_id]
+            rule_index = get_rule_index()
+            with timed("rule_lookup"):
+                rules = rule_index.get_many(requested)
+            found = {rule["rule_id"] for rule in rules}
+            not_found = [rule_id for rule_id in requested if rule_index.get(rule_id) is None]
+            logger.info(f"按编号查询规则: {requested}，找到 {sorted(found)}")
+            record_knowledge_refs((rule["chunk_id"] for rule in rules), rule_index.kb_version)
+            return json.dumps({
+                "rules": [
+                    {key: rule[key] for key in ("rule_id", "title", "section", "source", "content")}
+                    for rule in rules
+                ],
+                "not_found": not_found,
+            }, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"规则查询失败: {e}", exc_info=True)
+            return f"规则查询失败: {str(e)}"
+
 # 创建工具实例
 knowledge_search_tool = KnowledgeSearchTool()
+get_rule_tool = GetRuleTool()
 
 
@@ -0,0 +1,283 @@
+"""
+向量索引快照模块
+知识库规模很小（几千个文本块以内），每次检索经过 ChromaDB 的客户端层和 SQLite 开销远大于计算本身。
+快照把集合中的全部向量导出为 float16 或 int8 的 .npy 矩阵，文本块ID、内容和元数据写入 JSON 附属文件；
+服务以只读内存映射方式加载，多个 uvicorn worker 通过操作系统页缓存共享同一份向量数据，
+检索时以矩阵乘法批量计算距离、argpartition 取 top-k。
+
+距离与 ChromaDB 默认的 l2 度量一致（平方欧氏距离），检索结果的 score 可以直接替换。
+
+目录结构::
+
+    VECTOR_SNAPSHOT_DIRECTORY/
+        current.json                 指向当前快照（原子替换）
+        <kb_version>-<dtype>/
+            vectors.npy              (N, D) float16 或 int8
+            scales.npy               int8 时每行的反量化系数
+            norms.npy                (N,) 原始 float32 向量的平方范数
+            meta.json                ids / documents / metadatas / kb_version / build_id / embedding_model
+"""
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from warehouse_assistant.app.services.ai.kb_metadata import matches_filter
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DTYPES = ("float16", "int8")
+POINTER_FILE_NAME = "current.json"
+
+# 导出时每次从 ChromaDB 读取的条数
+EXPORT_PAGE_SIZE = 1000
+# 检索时每次反量化参与计算的行数，限制临时内存
+SEARCH_BLOCK_ROWS = 8192
+
+
+def pointer_path(root: str) -> str:
+    return os.path.join(root, POINTER_FILE_NAME)
+
+
+def export_snapshot(
+    collection,
+    root: str,
+    kb_version: str,
+    embedding_model: Optional[str],
+    dtype: str = "float16",
+    keep: int = 2,
+    build_id: Optional[str] = None,
+) -> str:
+    """
+    导出集合的向量快照并原子地切换 current.json 指针。
+
+    旧快照保留最近 keep 个（正在使用旧快照的进程持有内存映射，删除文件也不影响其读取）。
+
+    Args:
+        collection: chromadb 集合
+        root: 快照根目录
+        kb_version: 知识库版本
+        embedding_model: 嵌入模型标识
+        dtype: float16 或 int8
+        keep: 保留的快照个数（含本次）
+        build_id: 导出的集合所属的构建（见 kb_manifest.kb_build_id，与清单一致时快照才会被服务使用）
+
+    Returns:
+        新快照目录路径
+
+    Raises:
+        ValueError: 不支持的 dtype
+    """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"不支持的快照精度: {dtype}，可选值: {', '.join(SNAPSHOT_DTYPES)}")
+
+    total = collection.count()
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    vectors: Optional[np.ndarray] = None
+    for offset in range(0, total, EXPORT_PAGE_SIZE):
+        page = collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=EXPORT_PAGE_SIZE, offset=offset
+        )
+        page_vectors = np.asarray(page["embeddings"], dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((total, page_vectors.shape[1]), dtype=np.float32)
+        vectors[len(ids):len(ids) + len(page_vectors)] = page_vectors
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+    if vectors is None:
+        vectors = np.empty((0, 0), dtype=np.float32)
+    vectors = vectors[:len(ids)]
+
+    os.makedirs(root, exist_ok=True)
+    name = f"{kb_version}-{dtype}"
+    directory = os.path.join(root, name)
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    np.save(os.path.join(tmp_directory, "norms.npy"), (vectors ** 2).sum(axis=1).astype(np.float32))
+    if dtype == "int8":
+        # 按行对称量化：scale = max|x| / 127
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.empty(0, dtype=np.float32)
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        np.save(os.path.join(tmp_directory, "vectors.npy"), quantized)
+        np.save(os.path.join(tmp_directory, "scales.npy"), scales)
+    else:
+        np.save(os.path.join(tmp_directory, "vectors.npy"), vectors.astype(np.float16))
+
+    with open(os.path.join(tmp_directory, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({
+            "kb_version": kb_version,
+            "build_id": build_id,
+            "embedding_model": embedding_model,
+            "dtype": dtype,
+            "exported_at": datetime.utcnow().isoformat(),
+            "ids": ids,
+            "documents": documents,
+            "metadatas": metadatas,
+        }, f, ensure_ascii=False)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+
+    tmp_pointer = f"{pointer_path(root)}.tmp"
+    with open(tmp_pointer, 'w', encoding='utf-8') as f:
+        json.dump({"directory": name, "kb_version": kb_version, "build_id": build_id, "dtype": dtype}, f)
+    os.replace(tmp_pointer, pointer_path(root))
+
+    # 清理旧快照，按修改时间保留最近 keep 个
+    snapshots = sorted(
+        (entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.endswith(".tmp")),
+        key=lambda entry: entry.stat().st_mtime, reverse=True
+    )
+    for entry in snapshots[max(1, keep):]:
+        if entry.name != name:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    logger.info(f"Exported vector snapshot {name}: {len(ids)} vectors")
+    return directory
+
+
+def export_knowledge_base_snapshot(
+    persist_directory: Optional[str] = None,
+    collection_name: Optional[str] = None,
+    root: Optional[str] = None,
+    dtype: Optional[str] = None,
+) -> str:
+    """
+    按知识库清单导出当前知识库集合（清单指向的集合）的快照，其余参数默认取自配置。
+
+    Raises:
+        RuntimeError: 知识库清单不存在（尚未构建）
+    """
+    import chromadb
+    from warehouse_assistant.app.core.config import settings
+    from warehouse_assistant.app.services.ai.kb_manifest import active_collection_name, kb_build_id, load_manifest
+
+    persist_directory = persist_directory or settings.CHROMA_PERSIST_DIRECTORY
+    manifest = load_manifest(persist_directory)
+    if not manifest:
+        raise RuntimeError(f"知识库清单不存在: {persist_directory}，请先运行 init_knowledge_base.py")
+    client = chromadb.PersistentClient(path=persist_directory)
+    collection = client.get_collection(
+        collection_name or active_collection_name(manifest), embedding_function=None
+    )
+    return export_snapshot(
+        collection,
+        root or settings.VECTOR_SNAPSHOT_DIRECTORY,
+        kb_version=manifest["kb_version"],
+        embedding_model=manifest.get("embedding_model"),
+        dtype=dtype or settings.VECTOR_SNAPSHOT_DTYPE,
+        build_id=kb_build_id(manifest),
+    )
+
+
+class VectorSnapshot:
+    """只读的内存映射向量快照"""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.directory = directory
+        self.kb_version: str = meta["kb_version"]
+        # 旧版快照没有构建标识，服务不会使用，需要重新导出
+        self.build_id: Optional[str] = meta.get("build_id")
+        self.embedding_model: Optional[str] = meta.get("embedding_model")
+        self.dtype: str = meta["dtype"]
+        self.ids: List[str] = meta["ids"]
+        self.documents: List[str] = meta["documents"]
+        self.metadatas: List[Dict[str, Any]] = meta["metadatas"]
+        # 只读内存映射：多个进程共享页缓存中的同一份数据
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(directory, "norms.npy"))
+        self.scales = np.load(os.path.join(directory, "scales.npy")) if self.dtype == "int8" else None
+        # 过滤条件 → 满足条件的行掩码（快照只读，掩码可以一直复用）
+        self._filter_masks: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def load_current(cls, root: str) -> Optional["VectorSnapshot"]:
+        """
+        加载 current.json 指向的快照。
+
+        Returns:
+            快照；指针不存在或快照损坏时返回 None
+        """
+        try:
+            with open(pointer_path(root), 'r', encoding='utf-8') as f:
+                pointer = json.load(f)
+            return cls(os.path.join(root, pointer["directory"]))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"加载向量快照失败: {e}", exc_info=True)
+            return None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _dot(self, queries: np.ndarray) -> np.ndarray:
+        """分块计算查询与全部向量的内积，返回 (查询数, N) 的 float32 矩阵"""
+        products = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            block_products = queries @ block.T
+            if self.scales is not None:
+                block_products *= self.scales[start:start + SEARCH_BLOCK_ROWS]
+            products[:, start:start + len(block)] = block_products
+        return products
+
+    def _filter_mask(self, filter: Dict[str, Any]) -> np.ndarray:
+        key = json.dumps(filter, sort_keys=True, ensure_ascii=False)
+        mask = self._filter_masks.get(key)
+        if mask is None:
+            mask = np.fromiter((matches_filter(m or {}, filter) for m in self.metadatas), dtype=bool, count=len(self))
+            self._filter_masks[key] = mask
+        return mask
+
+    def search(self, query_vectors: List[List[float]], k: int,
+               filter: Optional[Dict[str, Any]] = None) -> List[List[Tuple[int, float]]]:
+        """
+        批量检索。
+
+        Args:
+            filter: 元数据过滤条件（ChromaDB where 语法的子集），只在满足条件的行中检索
+
+        Returns:
+            每条查询的 [(行号, 平方L2距离)]，按距离升序
+        """
+        if not query_vectors or len(self) == 0:
+            return [[] for _ in query_vectors]
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        distances = (queries ** 2).sum(axis=1)[:, None] - 2 * self._dot(queries) + self.norms[None, :]
+        if filter:
+            mask = self._filter_mask(filter)
+            distances[:, ~mask] = np.inf
+            k = min(k, int(mask.sum()))
+        k = min(k, len(self))
+        if k <= 0:
+            return [[] for _ in query_vectors]
+        results = []
+        for row in distances:
+            candidates = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+            ordered = candidates[np.argsort(row[candidates])]
+            results.append([(int(i), max(0.0, float(row[i]))) for i in ordered])
+        return results
+
+    def search_results(self, query_vectors: List[List[float]], k: int,
+                       filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """批量检索，返回与 KnowledgeBaseService 相同格式的结果"""
+        return [
+            [
+                {"content": self.documents[i], "metadata": dict(self.metadatas[i] or {}), "score": score}
+                for i, score in hits
+            ]
+            for hits in self.search(query_vectors, k, filter)
+        ]
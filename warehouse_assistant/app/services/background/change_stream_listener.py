@@ -1,114 +1,346 @@
+"""
+MongoDB Change Stream 事件接入模块
+通过 Motor 监听 trace_events 的插入，新事件插入后立即触发风险评估（轮询方式最多延迟一个轮询间隔）。
+
+恢复令牌持久化在 ingestion_state 集合中：只有某个事件及其之前到达的全部事件都处理完成后
+（包括由其他监听器正在处理的事件），才把该事件的恢复令牌和事件ID写入数据库，服务重启或连接中断后
+从该位置继续，不会漏掉处理到一半的事件（重复收到的事件由 EventTracker 跳过）。恢复位置已超出
+oplog 保留范围时，先记录当前的集群操作时间，从已提交事件的插入时间起补查尚未评估的事件，
+再从记录的操作时间开始监听，补查结束前插入的事件不会遗漏。
+
+Change Stream 只支持副本集和分片集群，由 event_ingestion 根据部署类型选择本模块或轮询监听器。
+"""
 import asyncio
-from motor.motor_asyncio import AsyncIOMotorClient # 导入 motor
-from pymongo.errors import PyMongoError, OperationFailure # 使用 pymongo 的错误类型
-from warehouse_assistant.app.core.config import settings
-from warehouse_assistant.app.services.ai.crews.risk_crew import run_risk_assessment_for_event
 import logging
-import time 
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional
+
+from bson import ObjectId, Timestamp
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.batch_context import get_batch_context_cache
+from warehouse_assistant.app.services.background.event_tracker import get_event_tracker
+from warehouse_assistant.app.services.background.polling_listener import (
+    dispatch_requeued_events,
+    find_requeued_events,
+    process_event
+)
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+from warehouse_assistant.app.utils.metrics import get_metrics_registry
 
 logger = logging.getLogger(__name__)
 
-# 使用 asyncio.Event 来控制停止
+# 保存恢复令牌的集合和文档ID
+RESUME_STATE_COLLECTION = "ingestion_state"
+RESUME_STATE_ID = "trace_events_change_stream"
+# 恢复令牌对应的变更已不在 oplog 中（ChangeStreamHistoryLost 等）
+_HISTORY_LOST_CODES = {136, 280, 286}
+# 补查时在已提交事件的插入时间之前多查的余量（ObjectId 时间精度为秒，且由各客户端生成）
+_CATCH_UP_MARGIN = timedelta(seconds=5)
+# 等待新变更的最长时间（毫秒），超时后检查停止信号
+_MAX_AWAIT_TIME_MS = 1000
+# 事件正由其他监听器处理时，检查其是否处理完成的间隔（秒）
+_OTHER_PROCESSING_POLL_SECONDS = 0.5
+
 _stop_event = asyncio.Event()
-_listener_task = None # 用于存储运行中的监听任务
+_listener_task: Optional[asyncio.Task] = None
+_requeue_task: Optional[asyncio.Task] = None
+
+
+async def is_change_stream_supported(client: AsyncIOMotorClient) -> bool:
+    """部署是否支持 Change Stream（副本集或分片集群；单机版不支持）"""
+    try:
+        hello = await client.admin.command("hello")
+    except OperationFailure:
+        # MongoDB 4.4.2 之前没有 hello 命令
+        hello = await client.admin.command("isMaster")
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+
+class ResumeTokenTracker:
+    """
+    按事件到达顺序跟踪处理进度。
+
+    每个变更在到达时登记，处理完成后标记；只有队首连续完成的变更会推进可提交的恢复令牌，
+    因此提交的令牌之前的事件都已处理完成。committed_event_id 是提交令牌对应的事件ID，
+    恢复令牌失效时据此确定补查的起点。
+    """
+
+    def __init__(self, committed: Optional[Dict[str, Any]] = None, committed_event_id: Optional[ObjectId] = None):
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self.committed = committed
+        self.committed_event_id = committed_event_id
+
+    def add(self, token: Dict[str, Any], event_id: ObjectId) -> Dict[str, Any]:
+        """登记一个到达的变更，返回用于 complete() 的条目"""
+        entry = {"token": token, "event_id": event_id, "done": False}
+        self._pending.append(entry)
+        return entry
+
+    def complete(self, entry: Dict[str, Any]) -> bool:
+        """
+        标记变更已处理。
+
+        Returns:
+            可提交的恢复令牌是否前进
+        """
+        entry["done"] = True
+        advanced = False
+        while self._pending and self._pending[0]["done"]:
+            entry = self._pending.popleft()
+            self.committed = entry["token"]
+            self.committed_event_id = entry["event_id"]
+            advanced = True
+        return advanced
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+
+class ChangeStreamListener:
+    """监听 trace_events 插入并持久化恢复令牌的 Change Stream 监听器"""
+
+    def __init__(self, client: AsyncIOMotorClient):
+        self.client = client
+        db = client[settings.MONGODB_DB_NAME]
+        self.collection = db["trace_events"]
+        self.state_collection = db[RESUME_STATE_COLLECTION]
+        self.tracker = ResumeTokenTracker()
+        self._save_lock = asyncio.Lock()
+        self._tasks: set = set()
+        # 恢复令牌失效后：没有可用令牌时开始监听的操作时间，以及待补查的起始时间
+        self._start_at: Optional[Timestamp] = None
+        self._catch_up_since: Optional[datetime] = None
+
+    async def _load_state(self) -> Dict[str, Any]:
+        return await self.state_collection.find_one({"_id": RESUME_STATE_ID}) or {}
+
+    async def _save_token(self) -> None:
+        """保存当前可提交的恢复令牌（加锁并在锁内读取，避免较早的令牌覆盖较新的令牌）"""
+        async with self._save_lock:
+            try:
+                await self.state_collection.update_one(
+                    {"_id": RESUME_STATE_ID},
+                    {"$set": {
+                        "resume_token": self.tracker.committed,
+                        "resume_event_id": self.tracker.committed_event_id,
+                        "updated_at": datetime.utcnow()
+                    }},
+                    upsert=True
+                )
+            except PyMongoError as e:
+                logger.warning(f"[Change Stream] 保存恢复令牌失败: {e}")
+
+    async def _discard_token(self, start_at: Optional[Timestamp]) -> None:
+        """丢弃失效的恢复令牌，保存没有令牌时开始监听的操作时间（重启后也从该时间开始）"""
+        async with self._save_lock:
+            await self.state_collection.update_one(
+                {"_id": RESUME_STATE_ID},
+                {"$unset": {"resume_token": "", "resume_event_id": ""},
+                 "$set": {"start_at_operation_time": start_at, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        self.tracker = ResumeTokenTracker()
+        self._start_at = start_at
+
+    async def _operation_time(self) -> Optional[Timestamp]:
+        """当前的集群操作时间（副本集和分片集群的命令响应中带有 operationTime）"""
+        response = await self.client.admin.command("ping")
+        return response.get("operationTime")
+
+    def _dispatch(self, event_id: str, event: Optional[Dict[str, Any]],
+                  entry: Optional[Dict[str, Any]] = None) -> None:
+        """
+        触发一个事件的风险评估。
+
+        已处理过的事件直接视为完成；正由其他监听器（如重新排队事件拾取）处理的事件，
+        等其处理完成后才视为完成，避免恢复令牌越过尚未评估完的事件。
+        """
+        event_tracker = get_event_tracker()
+        if event is not None:
+            get_batch_context_cache().observe_event(event)
+        if event_tracker.is_processing(event_id):
+            logger.info(f"[Change Stream] 事件 {event_id} 正由其他监听器处理，等待其完成")
+            self._spawn(self._wait_for_other(event_id, entry))
+            return
+        if event_tracker.has_processed(event_id) or not event_tracker.mark_as_processing(event_id):
+            logger.info(f"[Change Stream] 事件 {event_id} 已处理过，跳过")
+            self._spawn(self._complete(entry))
+            return
+        logger.info(f"[Change Stream] 检测到新事件 {event_id}，触发风险评估")
+        self._spawn(self._process(event_id, entry))
 
-async def watch_trace_events_async(stop_event: asyncio.Event):
-    """异步函数，使用 Motor 监听 MongoDB Change Stream。"""
-    client = None
+    async def _process(self, event_id: str, entry: Optional[Dict[str, Any]]) -> None:
+        try:
+            await process_event(event_id)
+        finally:
+            await self._complete(entry)
+
+    async def _wait_for_other(self, event_id: str, entry: Optional[Dict[str, Any]]) -> None:
+        event_tracker = get_event_tracker()
+        try:
+            while event_tracker.is_processing(event_id):
+                await asyncio.sleep(_OTHER_PROCESSING_POLL_SECONDS)
+        finally:
+            await self._complete(entry)
+
+    async def _complete(self, entry: Optional[Dict[str, Any]]) -> None:
+        """标记变更已处理，可提交的恢复令牌前进时保存"""
+        if entry is not None and self.tracker.complete(entry):
+            await self._save_token()
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _catch_up(self, since: datetime) -> None:
+        """补查 since 之后插入且尚未评估的事件（恢复令牌失效时使用，since 为已提交事件的插入时间）"""
+        query = {
+            "_id": {"$gte": ObjectId.from_datetime(since - _CATCH_UP_MARGIN)},
+            "$or": [{"risk_assessment": {"$exists": False}}, {"risk_assessment": None}]
+        }
+        count = 0
+        async for event in self.collection.find(query).sort("_id", 1):
+            self._dispatch(str(event["_id"]), event)
+            count += 1
+        logger.info(f"[Change Stream] 补查到 {count} 个 {since} 之后尚未评估的事件")
+
+    async def _watch_once(self, stop_event: asyncio.Event) -> None:
+        """打开一次 Change Stream 并处理变更，直到连接中断或收到停止信号"""
+        registry = get_metrics_registry()
+        resume_token = self.tracker.committed
+        if resume_token is None:
+            state = await self._load_state()
+            resume_token = state.get("resume_token")
+            self.tracker.committed = resume_token
+            self.tracker.committed_event_id = state.get("resume_event_id")
+            if self._start_at is None:
+                self._start_at = state.get("start_at_operation_time")
+        start_at = None if resume_token else self._start_at
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        async with self.collection.watch(
+            pipeline=pipeline, resume_after=resume_token, start_at_operation_time=start_at,
+            max_await_time_ms=_MAX_AWAIT_TIME_MS
+        ) as stream:
+            if resume_token:
+                position = "从保存的恢复令牌继续"
+            elif start_at:
+                position = f"从操作时间 {start_at} 开始"
+            else:
+                position = "从当前位置开始"
+            logger.info(f"[Change Stream] 监听已激活，{position}")
+            while not stop_event.is_set() and stream.alive:
+                change = await stream.try_next()
+                if change is None:
+                    continue
+                entry = self.tracker.add(change["_id"], change["documentKey"]["_id"])
+                wall_time = change.get("wallTime")
+                if isinstance(wall_time, datetime):
+                    registry.observe(
+                        "ingestion.change_stream.lag_ms",
+                        max(0.0, (datetime.utcnow() - wall_time.replace(tzinfo=None)).total_seconds() * 1000)
+                    )
+                registry.increment("ingestion.change_stream.events")
+                self._dispatch(str(change["documentKey"]["_id"]), change.get("fullDocument"), entry)
+
+    async def run(self, stop_event: asyncio.Event) -> None:
+        """持续监听；连接中断后按 CHANGE_STREAM_RETRY_SECONDS 重连，从已提交的恢复令牌继续"""
+        while not stop_event.is_set():
+            try:
+                if self._catch_up_since is not None:
+                    await self._catch_up(self._catch_up_since)
+                    self._catch_up_since = None
+                await self._watch_once(stop_event)
+            except OperationFailure as e:
+                if e.code in _HISTORY_LOST_CODES:
+                    committed_event_id = self.tracker.committed_event_id
+                    logger.warning(f"[Change Stream] 恢复令牌已失效（{e}），补查遗漏的事件后从当前操作时间重新开始")
+                    # 先记录操作时间再补查：补查期间插入的事件由从该时间开始的监听收到（重复的由 EventTracker 跳过）
+                    start_at = await self._operation_time()
+                    if start_at is None:
+                        logger.warning("[Change Stream] 无法获取当前操作时间，补查后从当前位置开始监听")
+                    await self._discard_token(start_at)
+                    if isinstance(committed_event_id, ObjectId):
+                        self._catch_up_since = committed_event_id.generation_time.replace(tzinfo=None)
+                    else:
+                        logger.warning("[Change Stream] 恢复令牌没有对应的事件ID，无法确定补查起点，跳过补查")
+                    continue
+                logger.error(f"[Change Stream] MongoDB 操作错误: {e}")
+            except PyMongoError as e:
+                logger.error(f"[Change Stream] MongoDB 连接错误: {e}")
+            except Exception as e:
+                logger.error(f"[Change Stream] 监听器发生意外错误: {e}", exc_info=True)
+            if not stop_event.is_set():
+                logger.info(f"[Change Stream] {settings.CHANGE_STREAM_RETRY_SECONDS} 秒后重新连接")
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=settings.CHANGE_STREAM_RETRY_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        logger.info(f"[Change Stream] 监听已停止，{self.tracker.pending_count} 个事件仍在处理中")
+
+
+async def sweep_requeued_events_once() -> List[str]:
+    """
+    拾取一次重新排队的事件。
+
+    数据库查询在工作线程中运行，标记处理中和启动评估任务在事件循环中进行。
+
+    Returns:
+        启动重新评估的事件ID列表
+    """
+    db_service = get_db_service()
+    if db_service.trace_events is None:
+        return []
+    requeued_events = await asyncio.to_thread(find_requeued_events, db_service)
+    return dispatch_requeued_events(requeued_events, get_event_tracker())
+
+
+async def sweep_requeued_events_async(stop_event: asyncio.Event) -> None:
+    """定期拾取重新排队的事件（重新排队是更新而非插入，Change Stream 不监听）"""
     while not stop_event.is_set():
         try:
-            logger.info("[后台任务]正在尝试连接 MongoDB 以启动 Change Stream...")
-            # 使用 Motor 建立异步连接
-            client = AsyncIOMotorClient(settings.MONGODB_CONNECTION_STRING, serverSelectionTimeoutMS=10000)
-            # 检查是否连接成功 (motor 连接比较惰性)
-            await client.admin.command('ping') # 发送 ping 命令验证连接
-            
-            db = client[settings.MONGODB_DB_NAME]
-            collection = db.trace_events
-            logger.info("[后台任务]成功连接到 MongoDB。正在启动 Change Stream 监听器...")
-
-            pipeline = [{'$match': {'operationType':'insert'}}]
-            # 使用 async with 异步迭代 Change Stream
-            async with collection.watch(pipeline=pipeline, full_document='updateLookup') as stream:
-                logger.info("[后台任务] Change Stream 监听器已激活。")
-                async for change in stream:
-                    if stop_event.is_set():
-                        logger.info("[后台任务]收到停止信号，退出监听循环。")
-                        break
-
-                    logger.debug(f"[后台任务]检测到变更：{change.get('operationType')}")
-                    if change.get('operationType') == 'insert':
-                        try:
-                            event_id = str(change['documentKey']['_id'])
-                            logger.info(f"[后台任务] 检测到新事件插入，ID: {event_id}。正在触发风险评估...")
-                            # 异步触发 CrewAI 任务
-                            # 由于 run_risk_assessment_for_event 可能是同步/CPU密集型任务
-                            # 使用 asyncio.to_thread() 在单独线程中运行它，防止阻塞
-                            try:
-                                # 将同步函数包装在异步任务中
-                                await asyncio.to_thread(run_risk_assessment_for_event, event_id) 
-                                logger.info(f"[后台任务] 已为事件 {event_id} 异步启动风险评估。")
-                            except Exception as run_err:
-                                logger.error(f"[后台任务] 启动事件 {event_id} 的风险评估时出错: {run_err}", exc_info=True)
-                        except KeyError as e:
-                            logger.error(f"[后台任务] 访问变更文档时发生 KeyError: {e}。变更内容: {change}")
-                        except Exception as e:
-                            logger.error(f"[后台任务] 处理变更事件 {change.get('documentKey')} 时出错: {e}", exc_info=True)
-                    # 在每次迭代后短暂让出控制权，防止事件循环过于繁忙
-                    await asyncio.sleep(0.1)
-
-                logger.info("[后台任务] Change Stream 监听结束或被中断。")
-
-        except (ConnectionError, OperationFailure) as e:
-            logger.error(f"[后台任务] MongoDB 连接或操作错误: {e}。将在 30 秒后重试...")
+            await sweep_requeued_events_once()
         except Exception as e:
-            logger.error(f"[后台任务] 监听器发生意外错误: {e}。将在 30 秒后重试...", exc_info=True)
-        finally:
-            if client:
-                client.close() # 关闭 motor 客户端连接
-                logger.info("[后台任务] MongoDB 异步连接已关闭。")
-
-        if not stop_event.is_set():
-            await asyncio.sleep(30) # 异步等待 30 秒再重试
-
-    logger.info("[后台任务] 监听器任务已完全停止。")
-
-    
-def start_change_stream_listener_task():
-    """启动 Change Stream 监听器作为 asyncio 任务。"""
-    global _listener_task
-    if _listener_task is None or _listener_task.done():
-        _stop_event.clear() # 重置停止事件
-        logger.info("正在启动 MongoDB Change Stream 监听器后台任务...")
-        # 使用 asyncio.create_task 启动异步函数
-        _listener_task = asyncio.create_task(watch_trace_events_async(_stop_event))
-        logger.info("Change Stream 监听器后台任务已启动。")
-    else:
+            logger.error(f"[Change Stream] 拾取重新排队事件时出错: {e}", exc_info=True)
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=settings.REQUEUE_SWEEP_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_change_stream_listener_task(client: AsyncIOMotorClient) -> None:
+    """启动 Change Stream 监听器和重新排队事件拾取任务"""
+    global _listener_task, _requeue_task
+    if _listener_task is not None and not _listener_task.done():
         logger.warning("Change Stream 监听器后台任务已在运行中。")
+        return
+    _stop_event.clear()
+    _listener_task = asyncio.create_task(ChangeStreamListener(client).run(_stop_event))
+    _requeue_task = asyncio.create_task(sweep_requeued_events_async(_stop_event))
+    logger.info("Change Stream 监听器后台任务已启动。")
+
 
-async def stop_change_stream_listener_task():
-    """停止 Change Stream 监听器任务。"""
-    global _listener_task
-    if _listener_task and not _listener_task.done():
-        logger.info("正在尝试停止 Change Stream 监听器任务...")
-        _stop_event.set() # 发送停止信号
+async def stop_change_stream_listener_task() -> None:
+    """停止 Change Stream 监听器任务"""
+    global _listener_task, _requeue_task
+    _stop_event.set()
+    for task in (_listener_task, _requeue_task):
+        if task is None or task.done():
+            continue
         try:
-            # 等待任务结束，设置超时时间
-            await asyncio.wait_for(_listener_task, timeout=10.0)
-            logger.info("Change Stream 监听器任务已成功停止。")
+            await asyncio.wait_for(task, timeout=10.0)
         except asyncio.TimeoutError:
-            logger.warning("监听器任务在 10 秒内未能优雅停止，可能被强制取消。")
-            _listener_task.cancel() # 尝试取消任务
+            logger.warning("Change Stream 任务在 10 秒内未能停止，已取消。")
+            task.cancel()
             try:
-                await _listener_task # 等待取消完成
+                await task
             except asyncio.CancelledError:
-                 logger.info("监听器任务已被取消。")
-        except Exception as e:
-            logger.error(f"停止监听器任务时发生错误: {e}", exc_info=True)
-        finally:
-             _listener_task = None # 清理任务引用
-    else:
-        logger.info("Change Stream 监听器任务未在运行或已停止。")
-        _listener_task = None # 确保清理
-
-
+                pass
+    _listener_task = None
+    _requeue_task = None
+    logger.info("Change Stream 监听器任务已停止。")
@@ -11,6 +11,7 @@ from bson import ObjectId
 from warehouse_assistant.app.core.config import settings
 from warehouse_assistant.app.services.ai.crews.risk_crew import run_risk_assessment_for_event
 from warehouse_assistant.app.services.background.event_tracker import get_event_tracker
+from warehouse_assistant.app.services.ai.batch_context import get_batch_context_cache
 
 logger = logging.getLogger(__name__)
 
@@ -82,6 +83,7 @@ class DatabaseMonitor:
     async def _process_new_events(self, events: List[Dict[str, Any]]):
         """处理新事件，触发风险评估"""
         event_tracker = get_event_tracker()
+        batch_cache = get_batch_context_cache()
         
         for event in events:
             try:
@@ -91,6 +93,7 @@ class DatabaseMonitor:
                     continue
                 
                 event_id = str(event["_id"])
+                batch_cache.observe_event(event)
                 
                 # 检查事件是否已在处理中或已处理过
                 if event_tracker.is_processing(event_id) or event_tracker.has_processed(event_id):
@@ -116,9 +119,12 @@ class DatabaseMonitor:
                     result = run_risk_assessment_for_event(event_id)
                     logger.info(f"事件 {event_id} 的风险评估完成: {result}")
                     
-                    # 标记事件为已处理
-                    success = result.get('status') == 'success'
-                    event_tracker.mark_as_processed(event_id, success)
+                    # 标记事件为已处理（超时的事件允许重新排队）
+                    if result.get('status') == 'timed_out':
+                        event_tracker.mark_as_timed_out(event_id)
+                    else:
+                        success = result.get('status') == 'success'
+                        event_tracker.mark_as_processed(event_id, success)
                     
                 except Exception as e:
                     logger.error(f"运行风险评估时出错: {e}", exc_info=True)
@@ -0,0 +1,85 @@
+"""
+新事件接入模块
+根据 EVENT_INGESTION_MODE 和 MongoDB 部署类型选择事件来源：副本集和分片集群使用 Change Stream
+（插入后立即评估，恢复令牌持久化），单机版或无法连接时自动回退到轮询监听器。
+"""
+import logging
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.background.change_stream_listener import (
+    is_change_stream_supported,
+    start_change_stream_listener_task,
+    stop_change_stream_listener_task
+)
+from warehouse_assistant.app.services.background.polling_listener import start_polling_task, stop_polling_task
+
+logger = logging.getLogger(__name__)
+
+EVENT_INGESTION_MODES = ("auto", "change_stream", "polling")
+
+# 当前使用的接入方式（change_stream / polling），未启动时为 None
+_active_mode: Optional[str] = None
+_client: Optional[AsyncIOMotorClient] = None
+
+
+async def _select_mode() -> str:
+    """确定接入方式；auto 模式下检查部署是否支持 Change Stream"""
+    global _client
+    mode = settings.EVENT_INGESTION_MODE
+    if mode not in EVENT_INGESTION_MODES:
+        logger.warning(f"未知的 EVENT_INGESTION_MODE: {mode}，按 auto 处理")
+        mode = "auto"
+    if mode == "polling":
+        return "polling"
+
+    _client = AsyncIOMotorClient(settings.MONGODB_CONNECTION_STRING, serverSelectionTimeoutMS=10000)
+    if mode == "change_stream":
+        return "change_stream"
+    try:
+        if await is_change_stream_supported(_client):
+            return "change_stream"
+        logger.info("MongoDB 为单机部署，不支持 Change Stream，使用轮询接入新事件")
+    except PyMongoError as e:
+        logger.warning(f"无法确定 MongoDB 部署类型（{e}），使用轮询接入新事件")
+    _client.close()
+    _client = None
+    return "polling"
+
+
+async def start_event_ingestion() -> str:
+    """
+    启动新事件接入。
+
+    Returns:
+        实际使用的接入方式（change_stream 或 polling）
+    """
+    global _active_mode
+    _active_mode = await _select_mode()
+    if _active_mode == "change_stream":
+        logger.info("使用 MongoDB Change Stream 接入新事件")
+        start_change_stream_listener_task(_client)
+    else:
+        await start_polling_task()
+    return _active_mode
+
+
+async def stop_event_ingestion() -> None:
+    """停止新事件接入"""
+    global _active_mode, _client
+    if _active_mode == "change_stream":
+        await stop_change_stream_listener_task()
+    elif _active_mode == "polling":
+        await stop_polling_task()
+    if _client is not None:
+        _client.close()
+        _client = None
+    _active_mode = None
+
+
+def get_ingestion_mode() -> Optional[str]:
+    """当前使用的接入方式，未启动时返回 None"""
+    return _active_mode
@@ -38,9 +38,16 @@ class EventTracker:
             return event_id in self.processing_events
     
     def has_processed(self, event_id: str) -> bool:
-        """检查事件是否已处理过"""
+        """检查事件是否已处理过（超时结束的事件不算，可以重新评估）"""
         with self._lock:
-            return event_id in self.processed_events
+            record = self.processed_events.get(event_id)
+            return record is not None and record.get('status') != 'timed_out'
+
+    def is_timed_out(self, event_id: str) -> bool:
+        """检查事件最近一次评估是否超时"""
+        with self._lock:
+            record = self.processed_events.get(event_id)
+            return record is not None and record.get('status') == 'timed_out'
     
     def mark_as_processing(self, event_id: str) -> bool:
         """标记事件为处理中状态"""
@@ -61,14 +68,33 @@ class EventTracker:
             
             self.processed_events[event_id] = {
                 'timestamp': datetime.utcnow(),
-                'success': success
+                'success': success,
+                'status': 'success' if success else 'failed'
             }
             
             logger.info(f"事件 {event_id} 已标记为已处理，状态: {'成功' if success else '失败'}")
             
             # 清理过期记录
             self._cleanup_old_records()
+
+    def mark_as_timed_out(self, event_id: str) -> None:
+        """标记事件评估超时（终止状态，但允许重新排队后再次评估）"""
+        with self._lock:
+            self.processing_events.discard(event_id)
+            self.processed_events[event_id] = {
+                'timestamp': datetime.utcnow(),
+                'success': False,
+                'status': 'timed_out'
+            }
+            logger.info(f"事件 {event_id} 已标记为评估超时")
+            self._cleanup_old_records()
     
+    def reset(self, event_id: str) -> None:
+        """清除事件的已处理记录，使其可以被重新评估（如知识库更新后重新排队的事件）"""
+        with self._lock:
+            if self.processed_events.pop(event_id, None) is not None:
+                logger.info(f"事件 {event_id} 的已处理记录已清除，可重新评估")
+
     def _cleanup_old_records(self) -> None:
         """清理过期的处理记录"""
         now = datetime.utcnow()
@@ -0,0 +1,113 @@
+"""
+知识库变更后的选择性重新评估模块
+知识库重建后，只把引用了已变更（被修改或删除）文本块的风险评估重新排队，
+其余评估只需把引用的知识库版本更新为当前版本
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from warehouse_assistant.app.services.ai.kb_manifest import load_manifest
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+
+logger = logging.getLogger(__name__)
+
+# 每批写回数据库的事件数
+BULK_WRITE_SIZE = 500
+
+
+def _flush(collection, operations: List[UpdateOne]) -> None:
+    """批量写回并清空操作列表"""
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        operations.clear()
+
+
+def requeue_update(assessment: Dict[str, Any], kb_version: str, changed_chunk_ids: List[str],
+                   requeued_at: datetime) -> Dict[str, Any]:
+    """
+    将一条评估重新排队的更新操作。
+
+    旧结果保存在 previous_risk_assessment 中，重新评估写回前仍计入批次风险分，
+    写回时由 update_event_risk 用新结果替换并清除，批次风险分不会重复计数。
+    """
+    return {"$set": {
+        "risk_assessment": None,
+        "previous_risk_assessment": assessment,
+        "requeue_reason": {
+            "reason": "kb_changed",
+            "kb_version": kb_version,
+            "changed_chunk_ids": changed_chunk_ids,
+            "requeued_at": requeued_at,
+        },
+    }}
+
+
+def requeue_stale_assessments(dry_run: bool = False, manifest: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    对比风险评估引用的文本块与当前知识库清单，将引用了已变更文本块的评估重新排队。
+
+    重新排队的事件 risk_assessment 置空（原结果保存在 previous_risk_assessment），
+    并写入 requeue_reason，轮询监听器据此重新评估。
+
+    Args:
+        dry_run: 只统计不写库
+        manifest: 知识库清单，默认读取当前清单
+
+    Returns:
+        统计结果 {kb_version, checked, requeued, unchanged}
+    """
+    manifest = manifest or load_manifest()
+    if not manifest or not manifest.get("kb_version"):
+        raise ValueError("未找到知识库清单，请先运行 init_knowledge_base.py 构建知识库")
+
+    kb_version = manifest["kb_version"]
+    current_chunk_ids = set(manifest.get("chunk_ids", []))
+
+    db_service = get_db_service()
+    if db_service.use_local_file or db_service.trace_events is None:
+        raise RuntimeError("选择性重新评估需要连接 MongoDB")
+    collection = db_service.trace_events
+
+    query = {"risk_assessment.knowledge_refs.kb_version": {"$exists": True, "$ne": kb_version}}
+    cursor = collection.find(query, {"risk_assessment": 1})
+
+    stats = {"kb_version": kb_version, "checked": 0, "requeued": 0, "unchanged": 0}
+    operations: List[UpdateOne] = []
+    requeued_at = datetime.utcnow()
+
+    for doc in cursor:
+        stats["checked"] += 1
+        assessment = doc["risk_assessment"]
+        referenced = assessment.get("knowledge_refs", {}).get("chunk_ids", [])
+        changed = sorted(set(referenced) - current_chunk_ids)
+
+        if changed:
+            stats["requeued"] += 1
+            operations.append(UpdateOne(
+                {"_id": doc["_id"]}, requeue_update(assessment, kb_version, changed, requeued_at)
+            ))
+        else:
+            # 引用的文本块都未变化，评估结果仍然有效，只更新版本号避免下次重复检查
+            stats["unchanged"] += 1
+            operations.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"risk_assessment.knowledge_refs.kb_version": kb_version}}
+            ))
+
+        if not dry_run and len(operations) >= BULK_WRITE_SIZE:
+            _flush(collection, operations)
+        elif dry_run:
+            operations.clear()
+
+    if not dry_run:
+        _flush(collection, operations)
+
+    logger.info(
+        f"知识库版本 {kb_version}: 检查 {stats['checked']} 条评估，"
+        f"重新排队 {stats['requeued']} 条，无需重新评估 {stats['unchanged']} 条"
+        + ("（dry-run，未写库）" if dry_run else "")
+    )
+    return stats
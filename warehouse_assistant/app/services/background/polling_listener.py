@@ -5,6 +5,7 @@ from bson import ObjectId
 from warehouse_assistant.app.services.database.mongo_service import get_db_service
 from warehouse_assistant.app.services.ai.crews.risk_crew import run_risk_assessment_for_event
 from warehouse_assistant.app.services.background.event_tracker import get_event_tracker
+from warehouse_assistant.app.services.ai.batch_context import get_batch_context_cache
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +14,17 @@ last_check_time = datetime.utcnow()
 polling_task = None
 stop_event = asyncio.Event()
 polling_interval = 30  # 轮询间隔，单位为秒
+# 已拾取的重新排队事件水位 (requeued_at, _id)；同一次重新排队的事件 requeued_at 相同，需用 _id 区分
+# 启动时从最小值开始，拾取全部待重新评估事件：评估成功、最终校验失败或超时达到上限时 requeue_reason
+# 都会被清除，仍带有该标记的事件确实尚未完成重新评估
+last_requeue_mark = (datetime.min, ObjectId("0" * 24))
+requeue_batch_size = 100  # 每次轮询最多拾取的重新排队事件数
 
 async def poll_new_events_async():
     """轮询检查新的事件记录"""
     global last_check_time
     event_tracker = get_event_tracker()  # 获取事件跟踪器实例
+    batch_cache = get_batch_context_cache()  # 批次上下文缓存，新事件增量追加
     
     logger.info("[轮询任务] 开始监听新事件...")
     
@@ -44,6 +51,7 @@ async def poll_new_events_async():
                 # 处理每个新事件
                 for event in new_events:
                     event_id = str(event["_id"])
+                    batch_cache.observe_event(event)
                     
                     # 检查事件是否已在处理中或已处理过
                     if event_tracker.is_processing(event_id) or event_tracker.has_processed(event_id):
@@ -57,6 +65,9 @@ async def poll_new_events_async():
                 
                 last_check_time = current_time
             
+            # 拾取知识库更新后被重新排队的事件
+            pick_up_requeued_events(db_service, event_tracker)
+            
             # 等待一段时间再检查
             await asyncio.sleep(polling_interval)
             
@@ -64,6 +75,51 @@ async def poll_new_events_async():
             logger.error(f"[轮询任务] 检查新事件时出错: {e}", exc_info=True)
             await asyncio.sleep(10)  # 出错后等待10秒再重试
 
+def find_requeued_events(db_service):
+    """查询水位之后重新排队的事件（只读数据库，可在工作线程中运行）"""
+    mark_time, mark_id = last_requeue_mark
+    query = {
+        "risk_assessment": None,
+        "$or": [
+            {"requeue_reason.requeued_at": {"$gt": mark_time}},
+            {"requeue_reason.requeued_at": mark_time, "_id": {"$gt": mark_id}}
+        ]
+    }
+    cursor = db_service.trace_events.find(query, {"_id": 1, "requeue_reason": 1}) \
+        .sort([("requeue_reason.requeued_at", 1), ("_id", 1)]).limit(requeue_batch_size)
+    return list(cursor)
+
+def dispatch_requeued_events(requeued_events, event_tracker):
+    """
+    清除已处理记录后重新评估重新排队的事件，并推进水位。
+
+    需要在事件循环中调用（asyncio.create_task 需要正在运行的事件循环）。
+
+    Returns:
+        启动重新评估的事件ID列表
+    """
+    global last_requeue_mark
+    if not requeued_events:
+        return []
+
+    logger.info(f"[轮询任务] 发现 {len(requeued_events)} 个重新排队需重新评估的事件")
+    dispatched = []
+    for event in requeued_events:
+        event_id = str(event["_id"])
+        if event_tracker.is_processing(event_id):
+            # 超时的评估在运行结束前就已写入重新排队标记，等本次运行结束后再拾取
+            break
+        event_tracker.reset(event_id)
+        if event_tracker.mark_as_processing(event_id):
+            asyncio.create_task(process_event(event_id))
+            dispatched.append(event_id)
+        last_requeue_mark = (event["requeue_reason"]["requeued_at"], event["_id"])
+    return dispatched
+
+def pick_up_requeued_events(db_service, event_tracker):
+    """拾取重新排队的事件（知识库更新见 kb_reassessment，评估超时见 RiskAssessmentCrew），清除已处理记录后重新评估"""
+    return dispatch_requeued_events(find_requeued_events(db_service), event_tracker)
+
 # 添加事件处理函数
 async def process_event(event_id: str):
     """处理单个事件"""
@@ -77,9 +133,12 @@ async def process_event(event_id: str):
         
         logger.info(f"[轮询任务] 事件 {event_id} 的风险评估完成: {result}")
         
-        # 标记事件为已处理
-        success = result.get('status') == 'success'
-        event_tracker.mark_as_processed(event_id, success)
+        # 标记事件为已处理（超时的事件允许重新排队）
+        if result.get('status') == 'timed_out':
+            event_tracker.mark_as_timed_out(event_id)
+        else:
+            success = result.get('status') == 'success'
+            event_tracker.mark_as_processed(event_id, success)
         
     except Exception as e:
         logger.error(f"[轮询任务] 处理事件 {event_id} 时出错: {e}", exc_info=True)
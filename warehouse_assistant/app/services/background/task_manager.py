@@ -5,6 +5,7 @@ import asyncio
 import logging
 from typing import Dict, Any, List, Callable, Coroutine
 from warehouse_assistant.app.services.background.db_monitor import db_monitor
+from warehouse_assistant.app.services.background.event_ingestion import get_ingestion_mode
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +20,11 @@ class BackgroundTaskManager:
         """启动所有后台任务"""
         logger.info("启动所有后台任务...")
         
-        # 启动数据库监听器
-        await self.start_task("db_monitor", db_monitor.start_monitoring)
+        # 启动数据库监听器；Change Stream 模式下新事件已实时接入，不再重复轮询
+        if get_ingestion_mode() == "change_stream":
+            logger.info("新事件由 Change Stream 接入，不启动数据库监听器")
+        else:
+            await self.start_task("db_monitor", db_monitor.start_monitoring)
         
         logger.info("所有后台任务已启动")
     
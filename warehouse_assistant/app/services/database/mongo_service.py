@@ -4,7 +4,7 @@ MongoDB数据库服务模块
 """
 import logging
 from typing import Optional, Dict, Any, List
-from pymongo import MongoClient, DESCENDING
+from pymongo import MongoClient, DESCENDING, ReturnDocument
 from pymongo.collection import Collection
 from pymongo.database import Database
 from bson import ObjectId
@@ -17,6 +17,76 @@ from warehouse_assistant.app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 风险等级排序，用于推导批次的最高风险等级
+RISK_LEVEL_RANK = {"无": 0, "低": 1, "中": 2, "高": 3}
+# 批次风险分中各风险等级事件的权重
+RISK_LEVEL_WEIGHT = {"无": 0, "低": 1, "中": 3, "高": 10}
+# 视为批次已关闭（不再是"在途"批次）的操作类型
+BATCH_CLOSING_OPERATIONS = {"出库"}
+
+
+def _field_key(value: str) -> str:
+    """将风险类型等自由文本转换为可用作 MongoDB 字段名的键"""
+    return value.replace(".", "·").lstrip("$") or "未知"
+
+
+def _max_risk_level(counts_by_level: Dict[str, int]) -> Optional[str]:
+    """由各等级的事件计数推导最高风险等级"""
+    levels = [level for level, count in counts_by_level.items() if count > 0 and level in RISK_LEVEL_RANK]
+    return max(levels, key=RISK_LEVEL_RANK.get) if levels else None
+
+
+def counted_assessment(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    事件计入批次风险分的评估结果。
+
+    知识库更新后重新排队的事件 risk_assessment 为空，但旧结果（previous_risk_assessment）
+    在重新评估写回之前仍计入批次风险分，写回时再用新结果替换。
+    """
+    return event.get("risk_assessment") or event.get("previous_risk_assessment") or {}
+
+
+def compute_batch_risk_scores(events: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    由事件列表完整计算各批次的风险分（本地文件模式和重建风险分时使用）。
+
+    Returns:
+        {batch_id: 批次风险分文档}
+    """
+    scores: Dict[str, Dict[str, Any]] = {}
+    for event in sorted(events, key=lambda e: str(e.get("timestamp", ""))):
+        batch_id = event.get("batch_id")
+        if not batch_id:
+            continue
+        score = scores.setdefault(batch_id, {
+            "_id": batch_id, "risk_score": 0, "counts_by_level": {}, "counts_by_type": {},
+            "assessed_events": 0, "last_high_risk_event": None, "is_open": True
+        })
+        if event.get("operation_type") in BATCH_CLOSING_OPERATIONS:
+            score["is_open"] = False
+        assessment = counted_assessment(event)
+        level = assessment.get("risk_level")
+        if level not in RISK_LEVEL_RANK:
+            continue
+        risk_type = _field_key(assessment.get("risk_type") or "未知")
+        score["counts_by_level"][level] = score["counts_by_level"].get(level, 0) + 1
+        score["counts_by_type"][risk_type] = score["counts_by_type"].get(risk_type, 0) + 1
+        score["risk_score"] += RISK_LEVEL_WEIGHT[level]
+        score["assessed_events"] += 1
+        if level == "高":
+            score["last_high_risk_event"] = {
+                "event_id": str(event["_id"]),
+                "risk_type": assessment.get("risk_type"),
+                "reason": assessment.get("reason"),
+                "timestamp": event.get("timestamp")
+            }
+    for score in scores.values():
+        score["max_level"] = _max_risk_level(score["counts_by_level"])
+        score["max_level_rank"] = RISK_LEVEL_RANK.get(score["max_level"], -1)
+        score["updated_at"] = datetime.utcnow()
+    return scores
+
+
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
@@ -40,6 +110,7 @@ class DatabaseService:
             cls._instance.db = None
             cls._instance.trace_events = None
             cls._instance.knowledge_items = None
+            cls._instance.batch_risk_scores = None
             cls._instance.use_local_file = False
             logger.info("Return DatabaseService __init__...")
         return cls._instance
@@ -64,7 +135,16 @@ class DatabaseService:
             # 创建索引
             self.trace_events.create_index([("timestamp", DESCENDING)])
             self.trace_events.create_index("batch_id")
+            # 批次历史按时间顺序读取时使用的复合索引
+            self.trace_events.create_index([("batch_id", 1), ("timestamp", 1)])
             self.trace_events.create_index("material_code")
+            # 知识库重建后查找引用旧版本知识的风险评估
+            self.trace_events.create_index("risk_assessment.knowledge_refs.kb_version", sparse=True)
+            self.trace_events.create_index("requeue_reason.requeued_at", sparse=True)
+            # 批次风险分（每次写入风险评估时增量更新），用于查询风险最高的在途批次
+            self.batch_risk_scores = self.db["batch_risk_scores"]
+            self.batch_risk_scores.create_index([("is_open", 1), ("risk_score", DESCENDING)])
+            self.batch_risk_scores.create_index([("risk_score", DESCENDING)])
             
             logger.info("MongoDB collection and indexes setup complete.")
             
@@ -140,6 +220,7 @@ class DatabaseService:
             try:
                 result = self.db.trace_events.insert_one(event_data)
                 logger.info(f"Inserted event {result.inserted_id} into MongoDB.")
+                self.close_batch_if_outbound(event_data)
                 return str(result.inserted_id)
             except Exception as e:
                 logger.error(f"Error inserting event into MongoDB: {e}", exc_info=True)
@@ -208,10 +289,13 @@ class DatabaseService:
         if self.use_local_file:
             logger.warning("update_event_risk is inefficient in local file mode")
             events = self._load_trace_events()
-            update = False
+            updated = False
             for i, event in enumerate(events):
                 if event.get('_id') == event_id:
                     events[i]['risk_assessment'] = risk_assessment
+                    events[i].pop('risk_assessment_error', None)
+                    events[i].pop('requeue_reason', None)
+                    events[i].pop('previous_risk_assessment', None)
                     updated = True
                     break
             if updated:
@@ -224,19 +308,28 @@ class DatabaseService:
         elif self.db is not None:
             try:
                 old = ObjectId(event_id)
-                result = self.db.trace_events.update_one(
+                # 返回更新前的文档，用于增量更新批次风险分（需要扣除旧的评估结果）
+                previous = self.db.trace_events.find_one_and_update(
                     {"_id": old},
-                    {"$set": {"risk_assessment": risk_assessment}}
+                    {
+                        "$set": {"risk_assessment": risk_assessment},
+                        # 评估成功后清除之前记录的失败原因、重新评估标记和重新排队前的旧结果
+                        "$unset": {
+                            "risk_assessment_error": "", "requeue_reason": "", "previous_risk_assessment": ""
+                        }
+                    },
+                    projection={
+                        "batch_id": 1, "operation_type": 1, "timestamp": 1,
+                        "risk_assessment": 1, "previous_risk_assessment": 1
+                    },
+                    return_document=ReturnDocument.BEFORE
                 )
-                if result.modified_count > 0:
-                    logger.info(f"Successfully updated risk assessment for event {event_id}")
-                    return True
-                elif result.matched_count > 0:
-                    logger.info(f"Risk assessment data was the same for event {event_id}, no MongoDB update needed.")
-                    return True #认为逻辑上是成功的
-                else:
+                if previous is None:
                     logger.warning(f"Event {event_id} not found for risk update in MongoDB.")
                     return False
+                logger.info(f"Successfully updated risk assessment for event {event_id}")
+                self._update_batch_risk_score(previous, risk_assessment)
+                return True
             except Exception as e:
                 logger.error(f"Error updating risk for event {event_id} in MongoDB: {e}", exc_info=True)
                 return False
@@ -244,6 +337,266 @@ class DatabaseService:
             logger.error("Database not available for update_event_risk.")
             return False
     
+    def _update_batch_risk_score(self, previous_event: Dict[str, Any], risk_assessment: Dict[str, Any]) -> None:
+        """
+        增量更新事件所属批次的风险分：扣除该事件旧的评估结果、计入新的评估结果，O(1) 次数据库操作。
+
+        Args:
+            previous_event: 更新前的事件（包含 batch_id、operation_type、timestamp 和旧的 risk_assessment；
+                重新排队的事件旧结果在 previous_risk_assessment 中）
+            risk_assessment: 新的风险评估结果
+        """
+        batch_id = previous_event.get("batch_id")
+        if not batch_id or self.batch_risk_scores is None:
+            return
+        event_id = str(previous_event["_id"])
+        old_assessment = counted_assessment(previous_event)
+
+        inc: Dict[str, int] = {}
+
+        def count(assessment: Dict[str, Any], sign: int) -> None:
+            level = assessment.get("risk_level")
+            if level not in RISK_LEVEL_RANK:
+                return
+            risk_type = _field_key(assessment.get("risk_type") or "未知")
+            for key, value in (
+                (f"counts_by_level.{level}", 1),
+                (f"counts_by_type.{risk_type}", 1),
+                ("risk_score", RISK_LEVEL_WEIGHT[level]),
+                ("assessed_events", 1),
+            ):
+                inc[key] = inc.get(key, 0) + sign * value
+
+        count(old_assessment, -1)
+        count(risk_assessment, 1)
+        inc = {key: value for key, value in inc.items() if value}
+
+        set_fields: Dict[str, Any] = {"updated_at": datetime.utcnow()}
+        update: Dict[str, Any] = {"$set": set_fields}
+        if inc:
+            update["$inc"] = inc
+        if risk_assessment.get("risk_level") == "高":
+            set_fields["last_high_risk_event"] = {
+                "event_id": event_id,
+                "risk_type": risk_assessment.get("risk_type"),
+                "reason": risk_assessment.get("reason"),
+                "timestamp": previous_event.get("timestamp")
+            }
+        if previous_event.get("operation_type") in BATCH_CLOSING_OPERATIONS:
+            set_fields["is_open"] = False
+        else:
+            update["$setOnInsert"] = {"is_open": True}
+
+        try:
+            score = self.batch_risk_scores.find_one_and_update(
+                {"_id": batch_id}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+            # 重新评估可能降低风险，最高等级由计数推导而不是只增不减
+            max_level = _max_risk_level(score.get("counts_by_level", {}))
+            if max_level != score.get("max_level") or "max_level_rank" not in score:
+                self.batch_risk_scores.update_one(
+                    {"_id": batch_id},
+                    {"$set": {"max_level": max_level, "max_level_rank": RISK_LEVEL_RANK.get(max_level, -1)}}
+                )
+            # 最近的高风险事件被重新评估为非高风险时清除
+            if old_assessment.get("risk_level") == "高" and risk_assessment.get("risk_level") != "高":
+                self.batch_risk_scores.update_one(
+                    {"_id": batch_id, "last_high_risk_event.event_id": event_id},
+                    {"$set": {"last_high_risk_event": None}}
+                )
+        except Exception as e:
+            logger.error(f"Error updating batch risk score for batch {batch_id}: {e}", exc_info=True)
+
+    def close_batch_if_outbound(self, event: Optional[Dict[str, Any]]) -> None:
+        """
+        出库事件所属的批次不再在途（is_open=False）。
+
+        与评估结果无关：事件写入时和风险评估读取事件时调用，评估失败或超时的出库事件同样关闭批次。
+        批次风险分尚不存在时创建一个空的风险分文档。
+        """
+        if not event or self.batch_risk_scores is None:
+            return
+        batch_id = event.get("batch_id")
+        if not batch_id or event.get("operation_type") not in BATCH_CLOSING_OPERATIONS:
+            return
+        try:
+            self.batch_risk_scores.update_one(
+                {"_id": batch_id},
+                {
+                    "$set": {"is_open": False, "updated_at": datetime.utcnow()},
+                    "$setOnInsert": {
+                        "risk_score": 0, "counts_by_level": {}, "counts_by_type": {}, "assessed_events": 0,
+                        "last_high_risk_event": None, "max_level": None, "max_level_rank": -1
+                    }
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error closing batch {batch_id}: {e}", exc_info=True)
+
+    def get_risky_batches(self, limit: int = 10, open_only: bool = True) -> List[Dict[str, Any]]:
+        """
+        获取风险分最高的批次。
+
+        Args:
+            limit: 返回的批次数
+            open_only: 是否只返回在途（尚未出库）的批次
+
+        Returns:
+            按风险分降序排列的批次风险分列表
+        """
+        query = {"is_open": True} if open_only else {}
+        if self.use_local_file:
+            scores = compute_batch_risk_scores(self._load_trace_events()).values()
+            scores = [s for s in scores if s["is_open"] or not open_only]
+            return sorted(scores, key=lambda s: s["risk_score"], reverse=True)[:limit]
+        elif self.batch_risk_scores is not None:
+            try:
+                cursor = self.batch_risk_scores.find(query).sort("risk_score", DESCENDING).limit(limit)
+                return list(cursor)
+            except Exception as e:
+                logger.error(f"获取高风险批次失败: {e}", exc_info=True)
+                return []
+        else:
+            logger.error("Database not available for get_risky_batches.")
+            return []
+
+    def rebuild_batch_risk_scores(self) -> int:
+        """
+        由全部事件重建批次风险分集合（首次启用或数据修复时使用）。
+
+        Returns:
+            重建的批次数
+        """
+        if self.batch_risk_scores is None:
+            raise RuntimeError("重建批次风险分需要连接 MongoDB")
+        cursor = self.trace_events.find(
+            {}, {"batch_id": 1, "operation_type": 1, "timestamp": 1,
+                 "risk_assessment": 1, "previous_risk_assessment": 1}
+        )
+        scores = compute_batch_risk_scores(list(cursor))
+        self.batch_risk_scores.delete_many({})
+        if scores:
+            self.batch_risk_scores.insert_many(list(scores.values()))
+        return len(scores)
+
+    def record_risk_failure(self, event_id: str, failure: Dict[str, Any]) -> bool:
+        """
+        记录指定事件风险评估失败的原因（写入 risk_assessment_error 字段）。
+        校验失败是最终结果，同时清除重新排队标记，重启后不再拾取该事件。
+
+        Args:
+            event_id: 事件ID (MongoDB ObjectId的字符串表示)
+            failure: 失败信息，如尝试次数、校验错误列表、失败时间等
+
+        Returns:
+            是否记录成功
+        """
+        if self.use_local_file:
+            events = self._load_trace_events()
+            for event in events:
+                if str(event.get('_id', '')) == event_id:
+                    event['risk_assessment_error'] = failure
+                    event.pop('requeue_reason', None)
+                    self._save_trace_events(events)
+                    return True
+            logger.warning(f"Event {event_id} not found for recording risk failure in local file.")
+            return False
+        elif self.db is not None:
+            try:
+                result = self.db.trace_events.update_one(
+                    {"_id": ObjectId(event_id)},
+                    {"$set": {"risk_assessment_error": failure}, "$unset": {"requeue_reason": ""}}
+                )
+                return result.matched_count > 0
+            except Exception as e:
+                logger.error(f"Error recording risk failure for event {event_id}: {e}", exc_info=True)
+                return False
+        else:
+            logger.error("Database not available for record_risk_failure.")
+            return False
+
+    def record_risk_timeout(self, event_id: str, failure: Dict[str, Any], requeue: bool = True) -> bool:
+        """
+        记录指定事件风险评估超时：写入 risk_assessment_error、累加 risk_timeout_count，
+        需要时写入 requeue_reason 使轮询监听器重新评估；达到重新排队上限时清除之前的 requeue_reason，
+        重启后不再拾取该事件。
+
+        Args:
+            event_id: 事件ID (MongoDB ObjectId的字符串表示)
+            failure: 超时信息，如超时阶段、时间等
+            requeue: 是否重新排队
+
+        Returns:
+            是否记录成功
+        """
+        requeue_reason = {"reason": "timed_out", "requeued_at": datetime.utcnow()}
+        if self.use_local_file:
+            events = self._load_trace_events()
+            for event in events:
+                if str(event.get('_id', '')) == event_id:
+                    event['risk_assessment_error'] = failure
+                    event['risk_timeout_count'] = event.get('risk_timeout_count', 0) + 1
+                    if requeue:
+                        event['requeue_reason'] = requeue_reason
+                    else:
+                        event.pop('requeue_reason', None)
+                    self._save_trace_events(events)
+                    return True
+            logger.warning(f"Event {event_id} not found for recording risk timeout in local file.")
+            return False
+        elif self.db is not None:
+            try:
+                update: Dict[str, Any] = {
+                    "$set": {"risk_assessment_error": failure},
+                    "$inc": {"risk_timeout_count": 1}
+                }
+                if requeue:
+                    update["$set"]["requeue_reason"] = requeue_reason
+                else:
+                    update["$unset"] = {"requeue_reason": ""}
+                result = self.db.trace_events.update_one({"_id": ObjectId(event_id)}, update)
+                return result.matched_count > 0
+            except Exception as e:
+                logger.error(f"Error recording risk timeout for event {event_id}: {e}", exc_info=True)
+                return False
+        else:
+            logger.error("Database not available for record_risk_timeout.")
+            return False
+
+    def save_risk_run_timeline(self, event_id: str, timeline: Dict[str, Any]) -> bool:
+        """
+        保存指定事件最近一次风险评估的运行时间线（写入 risk_run_timeline 字段）。
+
+        Args:
+            event_id: 事件ID (MongoDB ObjectId的字符串表示)
+            timeline: 时间线数据，包含各阶段耗时和 token 用量
+
+        Returns:
+            是否保存成功
+        """
+        if self.use_local_file:
+            events = self._load_trace_events()
+            for event in events:
+                if str(event.get('_id', '')) == event_id:
+                    event['risk_run_timeline'] = timeline
+                    self._save_trace_events(events)
+                    return True
+            return False
+        elif self.db is not None:
+            try:
+                result = self.db.trace_events.update_one(
+                    {"_id": ObjectId(event_id)},
+                    {"$set": {"risk_run_timeline": timeline}}
+                )
+                return result.matched_count > 0
+            except Exception as e:
+                logger.error(f"Error saving run timeline for event {event_id}: {e}", exc_info=True)
+                return False
+        else:
+            logger.error("Database not available for save_risk_run_timeline.")
+            return False
+
     def close(self):
         """关闭数据库连接"""
         if not self.use_local_file and self.client:
@@ -0,0 +1,121 @@
+"""
+进程内指标模块。
+提供直方图、计数器和回调型指标，供 /api/metrics 接口输出。
+"""
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+# 默认的耗时分桶上界（毫秒）
+LATENCY_BUCKETS_MS: List[float] = [
+    1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000,
+    10000, 30000, 60000, 120000, 300000
+]
+
+# 默认的 token 数分桶上界
+TOKEN_BUCKETS: List[float] = [50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000]
+
+
+class Histogram:
+    """固定分桶直方图，记录观测次数、总和以及各桶计数"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """根据分桶估算分位数（返回所在桶的上界，落在 +Inf 桶时返回最大观测值）"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, object]:
+        cumulative = 0
+        buckets = {}
+        for upper, bucket_count in zip(self.buckets + [float("inf")], self.counts):
+            cumulative += bucket_count
+            buckets["+Inf" if upper == float("inf") else str(upper)] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "max": round(self.max, 3),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class MetricsRegistry:
+    """指标注册表（线程安全）"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(MetricsRegistry, cls).__new__(cls)
+                    cls._instance._init_registry()
+        return cls._instance
+
+    def _init_registry(self):
+        self._lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, Callable[[], object]] = {}
+
+    def observe(self, name: str, value: float, buckets: Optional[Sequence[float]] = None) -> None:
+        """向直方图记录一次观测值，直方图不存在时按给定分桶创建"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram(buckets or LATENCY_BUCKETS_MS)
+                self.histograms[name] = histogram
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """计数器累加"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def register_gauge(self, name: str, callback: Callable[[], object]) -> None:
+        """注册回调型指标，导出时调用回调获取当前值"""
+        with self._lock:
+            self.gauges[name] = callback
+
+    def snapshot(self) -> Dict[str, object]:
+        """导出全部指标"""
+        with self._lock:
+            histograms = {name: h.snapshot() for name, h in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+            gauges = dict(self.gauges)
+        gauge_values = {}
+        for name, callback in sorted(gauges.items()):
+            try:
+                gauge_values[name] = callback()
+            except Exception as e:
+                gauge_values[name] = f"error: {e}"
+        return {"histograms": histograms, "counters": counters, "gauges": gauge_values}
+
+
+# 获取指标注册表实例
+def get_metrics_registry() -> MetricsRegistry:
+    return MetricsRegistry()
@@ -0,0 +1,27 @@
+"""
+Token 估算工具模块。
+在不依赖具体分词器的情况下粗略估算文本的 token 数，用于提示词预算控制。
+"""
+import re
+
+# 中日韩字符（大多数分词器中约 1 个字符 1 个 token）
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数。
+
+    中文等宽字符按每字 1 个 token 计算，其余字符按每 4 个字符 1 个 token 计算。
+
+    Args:
+        text: 待估算的文本
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
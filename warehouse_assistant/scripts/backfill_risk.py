@@ -0,0 +1,242 @@
+"""
+历史事件风险评估补跑脚本
+按 _id 顺序遍历 risk_assessment 为空的历史事件（轮询监听器和数据库监控只处理启动之后的新事件），
+以有限并发和速率预算逐个评估，并把进度写入检查点文件，中断后重新运行即可从断点继续。
+
+检查点记录"连续完成"的最大 _id：只有它之前的事件全部处理完（成功或失败）才会前移，
+因此崩溃时正在处理的事件会在恢复后重新评估，不会遗漏。评估失败的事件仍保持
+risk_assessment 为空，使用 --reset 从头运行即可重试。
+
+用法示例:
+    python warehouse_assistant/scripts/backfill_risk.py --dry-run
+    python warehouse_assistant/scripts/backfill_risk.py --concurrency 4 --rate 30
+    python warehouse_assistant/scripts/backfill_risk.py --reset --limit 1000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, Optional
+
+from bson import ObjectId
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_CHECKPOINT = script_dir.parent / "data" / "backfill_risk_checkpoint.json"
+
+# 待评估事件的查询条件
+PENDING_QUERY = {"$or": [{"risk_assessment": {"$exists": False}}, {"risk_assessment": None}]}
+
+# 每次从数据库读取的事件ID数
+PAGE_SIZE = 500
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="历史事件风险评估补跑（可断点续跑）")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发评估数，默认4")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="速率预算：每分钟最多启动的评估数（对应 LLM 配额），0 表示不限")
+    parser.add_argument("--limit", type=int, default=0, help="本次最多评估的事件数，0 表示不限")
+    parser.add_argument("--checkpoint", default=str(DEFAULT_CHECKPOINT), help="检查点文件路径")
+    parser.add_argument("--reset", action="store_true", help="忽略已有检查点，从头开始")
+    parser.add_argument("--dry-run", action="store_true", help="只统计待评估事件数和预计耗时，不执行评估")
+    parser.add_argument("--progress-every", type=int, default=10, help="每完成多少个事件输出一次进度，默认10")
+    return parser.parse_args()
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """读取检查点，不存在时返回空检查点"""
+    if not os.path.exists(path):
+        return {"last_id": None, "succeeded": 0, "failed": 0}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """原子地写入检查点（先写临时文件再替换），崩溃时不会留下损坏的检查点"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    checkpoint["updated_at"] = datetime.utcnow().isoformat()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def pending_query_after(last_id: Optional[str]) -> Dict[str, Any]:
+    """检查点之后的待评估事件查询条件"""
+    if not last_id:
+        return PENDING_QUERY
+    return {"$and": [PENDING_QUERY, {"_id": {"$gt": ObjectId(last_id)}}]}
+
+
+def iter_pending_ids(collection, last_id: Optional[str]) -> Iterator[ObjectId]:
+    """按 _id 顺序分页读取待评估事件ID（每页重新查询，避免长时间占用游标）"""
+    while True:
+        page = [doc["_id"] for doc in collection.find(pending_query_after(last_id), {"_id": 1})
+                .sort("_id", 1).limit(PAGE_SIZE)]
+        if not page:
+            return
+        yield from page
+        last_id = str(page[-1])
+
+
+class RateLimiter:
+    """令牌桶速率限制：每分钟最多放行 rate 个请求，允许 burst 个突发"""
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.interval == 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.interval)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class BackfillRunner:
+    """补跑执行器：有限并发 + 速率预算 + 连续完成水位检查点"""
+
+    def __init__(self, args, collection, checkpoint: Dict[str, Any], total: int):
+        self.args = args
+        self.collection = collection
+        self.checkpoint = checkpoint
+        self.total = total
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.rate_limiter = RateLimiter(args.rate, burst=args.concurrency)
+        # 已启动但尚未推进到检查点的事件（按 _id 顺序）及已完成事件的成功与否
+        self.in_flight: Deque[ObjectId] = deque()
+        self.finished: Dict[ObjectId, bool] = {}
+        self.done = 0
+        self.started_at = time.monotonic()
+
+    def _advance_checkpoint(self) -> None:
+        """将检查点推进到连续完成的最大 _id"""
+        advanced = False
+        while self.in_flight and self.in_flight[0] in self.finished:
+            event_id = self.in_flight.popleft()
+            success = self.finished.pop(event_id)
+            self.checkpoint["last_id"] = str(event_id)
+            self.checkpoint["succeeded" if success else "failed"] += 1
+            advanced = True
+        if advanced:
+            save_checkpoint(self.args.checkpoint, self.checkpoint)
+
+    def _report_progress(self) -> None:
+        elapsed = time.monotonic() - self.started_at
+        rate = self.done / elapsed if elapsed > 0 else 0
+        remaining = self.total - self.done
+        eta = format_duration(remaining / rate) if rate > 0 else "未知"
+        print(
+            f"[{self.done}/{self.total}] {self.done / self.total * 100 if self.total else 100:.1f}% | "
+            f"成功 {self.checkpoint['succeeded']} 失败 {self.checkpoint['failed']} | "
+            f"{rate * 60:.1f} 事件/分钟 | 已用 {format_duration(elapsed)} | 预计剩余 {eta}",
+            flush=True
+        )
+
+    async def _run_one(self, event_id: ObjectId) -> None:
+        from warehouse_assistant.app.services.ai.crews.risk_crew import run_risk_assessment_for_event
+
+        success = False
+        try:
+            result = await asyncio.to_thread(run_risk_assessment_for_event, str(event_id))
+            success = result.get("status") == "success"
+            if not success:
+                print(f"事件 {event_id} 评估失败: {result.get('message')}", flush=True)
+        except asyncio.CancelledError:
+            # 中断（Ctrl-C）时被取消：不记录结果，事件留在 in_flight 中，检查点不会越过它，恢复后重新评估
+            self.semaphore.release()
+            raise
+        except Exception as e:
+            print(f"事件 {event_id} 评估出错: {e}", flush=True)
+        self.finished[event_id] = success
+        self.done += 1
+        self._advance_checkpoint()
+        self.semaphore.release()
+        if self.done % self.args.progress_every == 0 or self.done == self.total:
+            self._report_progress()
+
+    async def run(self) -> None:
+        tasks = set()
+        for index, event_id in enumerate(iter_pending_ids(self.collection, self.checkpoint["last_id"])):
+            if self.args.limit and index >= self.args.limit:
+                break
+            await self.semaphore.acquire()
+            await self.rate_limiter.acquire()
+            self.in_flight.append(event_id)
+            task = asyncio.create_task(self._run_one(event_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+def main():
+    args = parse_args()
+
+    db_service = get_db_service()
+    if db_service.use_local_file or db_service.trace_events is None:
+        print("补跑需要连接 MongoDB，请检查 MONGODB_CONNECTION_STRING")
+        sys.exit(1)
+    collection = db_service.trace_events
+
+    checkpoint = {"last_id": None, "succeeded": 0, "failed": 0} if args.reset else load_checkpoint(args.checkpoint)
+    if checkpoint["last_id"]:
+        print(f"从检查点继续: last_id={checkpoint['last_id']} "
+              f"(已成功 {checkpoint['succeeded']}, 失败 {checkpoint['failed']})")
+
+    total = collection.count_documents(pending_query_after(checkpoint["last_id"]))
+    if args.limit:
+        total = min(total, args.limit)
+    print(f"待评估事件数: {total}")
+
+    if args.dry_run:
+        if args.rate > 0:
+            print(f"按速率预算 {args.rate:g} 事件/分钟，预计至少需要 {format_duration(total / args.rate * 60)}")
+        return
+    if total == 0:
+        return
+
+    runner = BackfillRunner(args, collection, checkpoint, total)
+    try:
+        asyncio.run(runner.run())
+    except KeyboardInterrupt:
+        print(f"\n已中断，检查点保存在 {args.checkpoint}，重新运行即可继续")
+        return
+
+    elapsed = time.monotonic() - runner.started_at
+    print(f"补跑完成: 成功 {checkpoint['succeeded']}, 失败 {checkpoint['failed']}, 耗时 {format_duration(elapsed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+嵌入模型后端对比脚本
+分别在独立子进程中加载 torch 和 onnx 后端（保证常驻内存互不干扰），对知识库中的全部文本块和
+一组检索查询编码，比较：
+
+- 单条查询编码延迟 (p50/p95/p99) 和文本块批量编码吞吐量；
+- 加载模型后的常驻内存 (RSS) 增量；
+- recall@k：以 torch 后端的精确 top-k 为基准，
+  onnx 查询向量 + 现有 torch 文档向量（不重建索引）和 onnx 全量重建后的召回率；
+- 同一文本在两个后端下向量的余弦相似度。
+
+用法示例:
+    python warehouse_assistant/scripts/benchmark_embedding_backends.py --k 3 --queries 200
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+import numpy as np
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.event_features import PARAMETER_LABELS, PARAMETER_RANGES
+from warehouse_assistant.app.services.ai.kb_manifest import active_collection_name, load_manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="嵌入模型后端对比")
+    parser.add_argument("--backends", default="torch,onnx", help="要对比的后端，逗号分隔，第一个作为基准")
+    parser.add_argument("--queries", type=int, default=200, help="检索查询数，默认200")
+    parser.add_argument("--k", type=int, default=3, help="recall@k 的 k，默认3")
+    return parser.parse_args()
+
+
+def build_queries(count: int) -> List[str]:
+    """按检索查询的模板生成查询文本"""
+    templates = [
+        f"{operation} {PARAMETER_LABELS.get(param, param)}偏高 工艺参数超出范围"
+        for operation, params in PARAMETER_RANGES.items() for param in params
+    ]
+    n = len(templates)
+    return [templates[i % n] + (f" 批次{i // n}" if i >= n else "") for i in range(count)]
+
+
+def load_corpus() -> List[str]:
+    """读取知识库集合中的全部文本块"""
+    import chromadb
+    client = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIRECTORY)
+    collection = client.get_collection(active_collection_name(load_manifest()), embedding_function=None)
+    return collection.get(include=["documents"])["documents"]
+
+
+def current_rss_mb() -> float:
+    """读取当前进程的常驻内存（Linux /proc）"""
+    with open("/proc/self/status", 'r') as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def run_backend(backend: str, corpus: List[str], queries: List[str]) -> Dict[str, Any]:
+    """在子进程中运行：加载后端，编码文本块和查询，返回计时、内存和向量"""
+    from warehouse_assistant.app.services.ai.embedding_backends import create_base_embeddings
+
+    rss_before = current_rss_mb()
+    load_start = time.perf_counter()
+    embeddings = create_base_embeddings(backend)
+    embeddings.embed_query("预热")
+    load_time = time.perf_counter() - load_start
+
+    start = time.perf_counter()
+    doc_vectors = np.array(embeddings.embed_documents(corpus), dtype=np.float32)
+    corpus_time = time.perf_counter() - start
+
+    latencies = []
+    query_vectors = []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "backend": backend,
+        "load_time": load_time,
+        "rss_mb": current_rss_mb() - rss_before,
+        "corpus_time": corpus_time,
+        "latencies": latencies,
+        "doc_vectors": doc_vectors,
+        "query_vectors": np.array(query_vectors, dtype=np.float32),
+    }
+
+
+def top_k(query_vectors: np.ndarray, doc_vectors: np.ndarray, k: int) -> np.ndarray:
+    """与 ChromaDB 默认度量一致，按 L2 距离取 top-k"""
+    distances = (
+        (query_vectors ** 2).sum(axis=1)[:, None]
+        - 2 * query_vectors @ doc_vectors.T
+        + (doc_vectors ** 2).sum(axis=1)[None, :]
+    )
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def recall(reference: np.ndarray, candidate: np.ndarray) -> float:
+    k = reference.shape[1]
+    return float(np.mean([len(set(r) & set(c)) / k for r, c in zip(reference, candidate)]))
+
+
+def main():
+    args = parse_args()
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    corpus = load_corpus()
+    if not corpus:
+        print("知识库为空，请先运行 init_knowledge_base.py")
+        return
+    queries = build_queries(args.queries)
+    k = min(args.k, len(corpus))
+    print(f"文本块数: {len(corpus)}, 查询数: {len(queries)}, k={k}")
+
+    # 每个后端在独立的 spawn 子进程中运行，RSS 不受另一个后端已加载的库影响
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in backends:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_backend, (backend, corpus, queries)))
+
+    for result in results:
+        print(f"\n===== {result['backend']} =====")
+        print(f"加载耗时: {result['load_time']:.2f}s, RSS 增量: {result['rss_mb']:.0f}MB")
+        print(f"文本块编码: {result['corpus_time']:.2f}s ({len(corpus) / result['corpus_time']:.1f} 块/秒)")
+        for pct in (50, 95, 99):
+            print(f"单条查询 p{pct} 延迟: {percentile(result['latencies'], pct) * 1000:.2f}ms")
+
+    reference = results[0]
+    reference_top_k = top_k(reference["query_vectors"], reference["doc_vectors"], k)
+    for result in results[1:]:
+        a, b = reference["doc_vectors"], result["doc_vectors"]
+        similarity = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+        mixed = recall(reference_top_k, top_k(result["query_vectors"], reference["doc_vectors"], k))
+        rebuilt = recall(reference_top_k, top_k(result["query_vectors"], result["doc_vectors"], k))
+        print(f"\n===== {result['backend']} 相对 {reference['backend']} =====")
+        print(f"文本块向量余弦相似度: 最小 {similarity.min():.4f}, 平均 {similarity.mean():.4f}")
+        print(f"recall@{k}（{result['backend']} 查询 + 现有 {reference['backend']} 索引）: {mixed:.3f}")
+        print(f"recall@{k}（{result['backend']} 重建索引后）: {rebuilt:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+嵌入微批处理压测脚本
+模拟多个风险评估线程同时编码检索查询，对比逐条直接调用模型与经过微批处理器合并后
+的吞吐量和延迟（不经过查询向量缓存，每条查询都会真正编码）。
+
+用法示例:
+    python warehouse_assistant/scripts/benchmark_embedding_batching.py --threads 8 --requests 50
+    python warehouse_assistant/scripts/benchmark_embedding_batching.py --max-wait-ms 2 --max-batch 16
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.embedding_batcher import MicroBatchingEmbeddings
+from warehouse_assistant.app.services.ai.event_features import PARAMETER_LABELS, PARAMETER_RANGES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="嵌入微批处理压测")
+    parser.add_argument("--threads", type=int, default=8, help="并发线程数，默认8")
+    parser.add_argument("--requests", type=int, default=50, help="每个线程的编码请求数，默认50")
+    parser.add_argument("--max-batch", type=int, default=settings.EMBEDDING_BATCH_MAX_SIZE, help="单批最多文本数")
+    parser.add_argument("--max-wait-ms", type=float, default=settings.EMBEDDING_BATCH_MAX_WAIT_MS,
+                        help="收集一批请求的最长等待时间（毫秒）")
+    return parser.parse_args()
+
+
+def build_queries(count: int) -> List[str]:
+    """按检索查询的模板生成互不相同的查询文本"""
+    templates = [
+        f"{operation} {PARAMETER_LABELS.get(param, param)}偏高 工艺参数超出范围"
+        for operation, params in PARAMETER_RANGES.items() for param in params
+    ]
+    return [f"{templates[i % len(templates)]} #{i}" for i in range(count)]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def run(embeddings, queries_per_thread: List[List[str]]):
+    """每个线程逐条编码自己的查询，返回 (每次调用延迟列表, 总耗时)"""
+    latencies: List[float] = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(queries_per_thread) + 1)
+
+    def worker(queries: List[str]):
+        barrier.wait()
+        local = []
+        for query in queries:
+            start = time.perf_counter()
+            embeddings.embed_query(query)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(queries,)) for queries in queries_per_thread]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - wall_start
+
+
+def report(name: str, latencies: List[float], wall_time: float) -> None:
+    print(f"\n===== {name} =====")
+    print(f"请求数: {len(latencies)}, 总耗时: {wall_time:.2f}s, 吞吐量: {len(latencies) / wall_time:.1f} 条/秒")
+    for pct in (50, 95, 99):
+        print(f"p{pct} 延迟: {percentile(latencies, pct) * 1000:.2f}ms")
+
+
+def main():
+    args = parse_args()
+    print(f"加载嵌入模型: {settings.EMBEDDING_MODEL_NAME}")
+    model = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL_NAME)
+    model.embed_query("预热")
+
+    total = args.threads * args.requests
+    queries = build_queries(total * 2)
+    # 两轮使用不同的查询，避免模型内部的任何复用影响对比
+    direct_queries = [queries[i * args.requests:(i + 1) * args.requests] for i in range(args.threads)]
+    batched_queries = [queries[total + i * args.requests:total + (i + 1) * args.requests] for i in range(args.threads)]
+
+    print(f"线程数: {args.threads}, 每线程请求数: {args.requests}")
+    latencies, wall_time = run(model, direct_queries)
+    report("逐条直接编码", latencies, wall_time)
+
+    batcher = MicroBatchingEmbeddings(model, max_batch_size=args.max_batch, max_wait_ms=args.max_wait_ms)
+    latencies, wall_time = run(batcher, batched_queries)
+    report(f"微批处理 (max_batch={args.max_batch}, max_wait={args.max_wait_ms}ms)", latencies, wall_time)
+
+    from warehouse_assistant.app.utils.metrics import get_metrics_registry
+    histogram = get_metrics_registry().histograms.get("embedding_batcher.batch_size")
+    if histogram and histogram.count:
+        print(f"平均批大小: {histogram.total / histogram.count:.1f}, 批次数: {histogram.count}")
+
+
+if __name__ == "__main__":
+    main()
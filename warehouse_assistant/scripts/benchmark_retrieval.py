@@ -0,0 +1,295 @@
+"""
+检索基准脚本
+用带标注的查询集 (data/retrieval_queries.json，每条查询标注了应检索到的规则编号) 对比不同嵌入模型后端、
+切割方式和向量索引的检索效果和延迟：查询向量化和向量检索的 p50/p95/p99 延迟、recall@k、MRR。
+每种组合在临时目录中独立建索引，不影响正在使用的知识库。结果写入 JSON 文件，便于跨版本对比。
+
+文本块对应的规则编号：按规则切割的文本块直接取 metadata 中的 rule_id；按长度切割的文本块取与其原文区间
+重叠的全部规则（一个文本块可能跨越多条规则）。
+
+用法示例:
+    python warehouse_assistant/scripts/benchmark_retrieval.py
+    python warehouse_assistant/scripts/benchmark_retrieval.py --backends torch onnx --chunkers rules recursive \
+        --indexes chroma snapshot-float16 snapshot-int8 --k 3 --compare data/benchmarks/retrieval-20261001.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+import chromadb
+
+from warehouse_assistant.app.services.ai.embedding_backends import create_base_embeddings, embedding_model_id
+from warehouse_assistant.app.services.ai.kb_ingestion import scan_source_files, split_file
+from warehouse_assistant.app.services.ai.event_features import query_filter
+from warehouse_assistant.app.services.ai.kb_metadata import PART_HEADING_PATTERN, SECTION_HEADING_PATTERN
+from warehouse_assistant.app.services.ai.rule_chunker import RULE_HEADING_PATTERN
+from warehouse_assistant.app.services.ai.vector_snapshot import SNAPSHOT_DTYPES, VectorSnapshot, export_snapshot
+
+DEFAULT_QUERIES_FILE = script_dir.parent / "data" / "retrieval_queries.json"
+DEFAULT_OUTPUT_DIR = script_dir.parent / "data" / "benchmarks"
+DEFAULT_SOURCE_DIR = os.getenv("KNOWLEDGE_BASE_DIR") or str(script_dir.parent / "knowledge_warehouse")
+INDEX_TYPES = ["chroma"] + [f"snapshot-{dtype}" for dtype in SNAPSHOT_DTYPES]
+CHUNKERS = ["rules", "recursive"]
+# 与 init_knowledge_base.py 的切割参数一致
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="检索延迟和召回基准")
+    parser.add_argument("--queries-file", default=str(DEFAULT_QUERIES_FILE), help="带标注的查询集")
+    parser.add_argument("--source-dir", default=DEFAULT_SOURCE_DIR, help="知识库源文件目录")
+    parser.add_argument("--backends", nargs="+", choices=["torch", "onnx"], default=["torch"], help="嵌入模型后端")
+    parser.add_argument("--chunkers", nargs="+", choices=CHUNKERS, default=CHUNKERS,
+                        help="切割方式：rules（按规则结构）或 recursive（按长度）")
+    parser.add_argument("--indexes", nargs="+", choices=INDEX_TYPES, default=INDEX_TYPES, help="向量索引类型")
+    parser.add_argument("--k", type=int, default=3, help="每条查询返回的结果数，默认3")
+    parser.add_argument("--repeat", type=int, default=5, help="每条查询重复检索的次数（延迟取全部样本），默认5")
+    parser.add_argument("--no-filter", action="store_true", help="不按查询的操作类型过滤")
+    parser.add_argument("--output", help="结果文件路径，默认 data/benchmarks/retrieval-<时间>.json")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    return parser.parse_args()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """延迟样本（秒）转换为毫秒百分位数"""
+    return {f"p{pct}": round(percentile(samples, pct) * 1000, 3) for pct in (50, 95, 99)}
+
+
+def rule_spans(text: str) -> List[Tuple[int, int, str]]:
+    """规则在原文中的区间：从规则标题到下一个任意标题"""
+    headings = sorted(
+        [(m.start(), None) for m in PART_HEADING_PATTERN.finditer(text)]
+        + [(m.start(), None) for m in SECTION_HEADING_PATTERN.finditer(text)]
+        + [(m.start(), m.group(1)) for m in RULE_HEADING_PATTERN.finditer(text)]
+    )
+    spans = []
+    for index, (start, rule_id) in enumerate(headings):
+        if rule_id is not None:
+            end = headings[index + 1][0] if index + 1 < len(headings) else len(text)
+            spans.append((start, end, rule_id))
+    return spans
+
+
+def chunk_rule_ids(metadata: Dict[str, Any], content: str, spans: List[Tuple[int, int, str]]) -> List[str]:
+    """文本块对应的规则编号"""
+    if metadata.get("rule_id"):
+        return [metadata["rule_id"]]
+    start = metadata.get("start_index")
+    if start is None or start < 0:
+        return []
+    end = start + len(content)
+    return [rule_id for span_start, span_end, rule_id in spans if span_start < end and start < span_end]
+
+
+def build_corpus(source_dir: str, chunker: str) -> List[Dict[str, Any]]:
+    """切割源文件，为每个文本块标注对应的规则编号"""
+    corpus = []
+    for rel_path, path in scan_source_files(source_dir).items():
+        spans = []
+        if path.lower().endswith((".txt", ".md")):
+            with open(path, 'r', encoding='utf-8') as f:
+                spans = rule_spans(f.read())
+        for doc in split_file(path, rel_path, CHUNK_SIZE, CHUNK_OVERLAP, structured=(chunker == "rules")):
+            rule_ids = chunk_rule_ids(doc.metadata, doc.page_content, spans)
+            corpus.append({
+                "id": doc.metadata["chunk_id"],
+                "content": doc.page_content,
+                "metadata": {key: value for key, value in doc.metadata.items() if value is not None},
+                "rule_ids": rule_ids,
+            })
+    return corpus
+
+
+def score_query(retrieved: List[List[str]], expected: Set[str], k: int) -> Dict[str, float]:
+    """
+    单条查询的指标。
+
+    Args:
+        retrieved: 按排名排列的结果，每项为该文本块对应的规则编号
+        expected: 应检索到的规则编号
+
+    Returns:
+        recall@k（检索到的期望规则占比）、reciprocal_rank（第一个相关结果排名的倒数）、hit（是否命中任一期望规则）
+    """
+    top = retrieved[:k]
+    found = expected & {rule_id for rule_ids in top for rule_id in rule_ids}
+    reciprocal_rank = 0.0
+    for rank, rule_ids in enumerate(top, 1):
+        if expected & set(rule_ids):
+            reciprocal_rank = 1.0 / rank
+            break
+    return {
+        "recall": len(found) / len(expected) if expected else 0.0,
+        "reciprocal_rank": reciprocal_rank,
+        "hit": 1.0 if found else 0.0,
+    }
+
+
+def build_collection(workdir: str, corpus: List[Dict[str, Any]], vectors: List[List[float]]):
+    """在临时目录中建立 ChromaDB 集合，快照也由它导出"""
+    client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+    collection = client.create_collection("benchmark", embedding_function=None)
+    collection.upsert(
+        ids=[item["id"] for item in corpus],
+        embeddings=vectors,
+        documents=[item["content"] for item in corpus],
+        metadatas=[item["metadata"] for item in corpus],
+    )
+    return collection
+
+
+def run_index(index_type: str, collection, corpus: List[Dict[str, Any]], query_vectors: List[List[float]],
+              queries: List[Dict[str, Any]], args, workdir: str) -> Dict[str, Any]:
+    """在一种索引上运行全部查询，返回延迟和召回指标"""
+    rule_ids_by_id = {item["id"]: item["rule_ids"] for item in corpus}
+
+    if index_type == "chroma":
+        def search(vector, where):
+            return collection.query(query_embeddings=[vector], n_results=args.k, where=where, include=[])["ids"][0]
+    else:
+        dtype = index_type.split("-", 1)[1]
+        snapshot = VectorSnapshot(export_snapshot(
+            collection, os.path.join(workdir, "snapshots"), kb_version="benchmark", embedding_model=None, dtype=dtype
+        ))
+
+        def search(vector, where):
+            return [snapshot.ids[i] for i, _ in snapshot.search([vector], args.k, where)[0]]
+
+    search(query_vectors[0], None)  # 预热
+    samples: List[float] = []
+    per_query = []
+    for query, vector in zip(queries, query_vectors):
+        where = None if args.no_filter else query_filter(query.get("operation_type"), query["query"])
+        for _ in range(max(1, args.repeat)):
+            start = time.perf_counter()
+            ids = search(vector, where)
+            samples.append(time.perf_counter() - start)
+        scores = score_query([rule_ids_by_id.get(i, []) for i in ids], set(query["expected_rule_ids"]), args.k)
+        per_query.append({"id": query["id"], **scores, "retrieved": [rule_ids_by_id.get(i, []) for i in ids]})
+
+    count = len(per_query)
+    return {
+        "index": index_type,
+        "search_ms": latency_summary(samples),
+        f"recall_at_{args.k}": round(sum(q["recall"] for q in per_query) / count, 4),
+        "mrr": round(sum(q["reciprocal_rank"] for q in per_query) / count, 4),
+        f"hit_rate_at_{args.k}": round(sum(q["hit"] for q in per_query) / count, 4),
+        "per_query": per_query,
+    }
+
+
+def git_revision() -> Optional[str]:
+    """当前代码版本，写入结果文件便于追溯"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=project_root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_comparison(results: List[Dict[str, Any]], previous_path: str, k: int) -> None:
+    """按 (后端, 切割方式, 索引) 与之前的结果对比"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    previous_by_key = {(r["backend"], r["chunker"], r["index"]): r for r in previous.get("results", [])}
+    print(f"\n===== 与 {previous_path} ({previous.get('git_revision')}) 对比 =====")
+    for result in results:
+        old = previous_by_key.get((result["backend"], result["chunker"], result["index"]))
+        if old is None:
+            continue
+        deltas = [
+            f"{metric} {old.get(metric, 0):.3f} -> {result[metric]:.3f}"
+            for metric in (f"recall_at_{k}", "mrr") if metric in old
+        ]
+        deltas.append(f"search p95 {old['search_ms']['p95']:.3f}ms -> {result['search_ms']['p95']:.3f}ms")
+        print(f"{result['backend']}/{result['chunker']}/{result['index']}: " + "，".join(deltas))
+
+
+def main():
+    args = parse_args()
+    with open(args.queries_file, 'r', encoding='utf-8') as f:
+        query_set = json.load(f)
+    queries = query_set["queries"]
+    texts = [query["query"] for query in queries]
+    print(f"查询集: {args.queries_file} ({len(queries)} 条), k={args.k}, 过滤: {'否' if args.no_filter else '按操作类型'}")
+
+    corpora = {chunker: build_corpus(args.source_dir, chunker) for chunker in args.chunkers}
+    for chunker, corpus in corpora.items():
+        print(f"切割方式 {chunker}: {len(corpus)} 个文本块")
+
+    results = []
+    for backend in args.backends:
+        embeddings = create_base_embeddings(backend)
+        embeddings.embed_query("预热")
+        embed_samples = []
+        query_vectors = []
+        for text in texts:
+            start = time.perf_counter()
+            query_vectors.append(embeddings.embed_query(text))
+            embed_samples.append(time.perf_counter() - start)
+        embed_ms = latency_summary(embed_samples)
+
+        for chunker, corpus in corpora.items():
+            vectors = embeddings.embed_documents([item["content"] for item in corpus])
+            with tempfile.TemporaryDirectory() as workdir:
+                collection = build_collection(workdir, corpus, vectors)
+                for index_type in args.indexes:
+                    result = run_index(index_type, collection, corpus, query_vectors, queries, args, workdir)
+                    result = {
+                        "backend": backend, "embedding_model": embedding_model_id(backend), "chunker": chunker,
+                        "chunks": len(corpus), "embed_ms": embed_ms, **result,
+                    }
+                    results.append(result)
+                    print(f"\n===== {backend} / {chunker} / {index_type} =====")
+                    print(f"查询向量化 p50/p95/p99: {embed_ms['p50']}/{embed_ms['p95']}/{embed_ms['p99']}ms")
+                    search_ms = result["search_ms"]
+                    print(f"向量检索 p50/p95/p99: {search_ms['p50']}/{search_ms['p95']}/{search_ms['p99']}ms")
+                    print(f"recall@{args.k}: {result[f'recall_at_{args.k}']:.3f}, MRR: {result['mrr']:.3f}, "
+                          f"命中率: {result[f'hit_rate_at_{args.k}']:.3f}")
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "query_set": os.path.basename(args.queries_file),
+        "query_set_version": query_set.get("version"),
+        "query_count": len(queries),
+        "k": args.k,
+        "filtered": not args.no_filter,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    output = args.output or str(DEFAULT_OUTPUT_DIR / f"retrieval-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {output}")
+
+    if args.compare:
+        print_comparison(results, args.compare, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+风险评估流水线离线压测脚本
+默认使用本地桩模型 (LLM_PROVIDER=stub)，不访问 DeepSeek，测量 RiskAssessmentCrew
+或轮询处理路径 (polling_listener.process_event) 的吞吐量和尾延迟。
+
+用法示例:
+    python warehouse_assistant/scripts/benchmark_risk_pipeline.py --events 50 --concurrency 4
+    python warehouse_assistant/scripts/benchmark_risk_pipeline.py --mode polling --latency-ms 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="风险评估流水线离线压测")
+    parser.add_argument("--mode", choices=["crew", "polling"], default="crew",
+                        help="crew: 直接调用 run_risk_assessment_for_event；polling: 走轮询监听器的处理函数")
+    parser.add_argument("--events", type=int, default=20, help="参与压测的待评估事件数量，默认20")
+    parser.add_argument("--event-ids", nargs="*", help="指定要评估的事件ID，指定后忽略 --events")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发评估数，默认4")
+    parser.add_argument("--provider", default="stub", help="LLM 提供方，默认 stub")
+    parser.add_argument("--latency-ms", type=float, help="桩模型延迟中位数（毫秒）")
+    parser.add_argument("--latency-sigma", type=float, help="桩模型延迟对数正态分布形状参数")
+    parser.add_argument("--tokens-mean", type=int, help="桩模型输出 token 数均值")
+    parser.add_argument("--tokens-std", type=int, help="桩模型输出 token 数标准差")
+    return parser.parse_args()
+
+
+def apply_llm_overrides(args) -> None:
+    """在导入应用模块之前通过环境变量覆盖 LLM 配置"""
+    os.environ["LLM_PROVIDER"] = args.provider
+    overrides = {
+        "STUB_LLM_LATENCY_MS": args.latency_ms,
+        "STUB_LLM_LATENCY_SIGMA": args.latency_sigma,
+        "STUB_LLM_COMPLETION_TOKENS_MEAN": args.tokens_mean,
+        "STUB_LLM_COMPLETION_TOKENS_STD": args.tokens_std,
+    }
+    for name, value in overrides.items():
+        if value is not None:
+            os.environ[name] = str(value)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def select_pending_event_ids(limit: int) -> List[str]:
+    """从数据库选取尚未评估的事件"""
+    from warehouse_assistant.app.services.database.mongo_service import get_db_service
+
+    db_service = get_db_service()
+    if db_service.trace_events is None:
+        raise RuntimeError("数据库不可用，请通过 --event-ids 指定事件")
+    cursor = db_service.trace_events.find(
+        {"$or": [{"risk_assessment": {"$exists": False}}, {"risk_assessment": None}]},
+        {"_id": 1}
+    ).limit(limit)
+    return [str(doc["_id"]) for doc in cursor]
+
+
+async def run_benchmark(event_ids: List[str], concurrency: int, mode: str):
+    """按指定并发执行评估并统计每个事件的耗时"""
+    from warehouse_assistant.app.services.ai.crews.risk_crew import run_risk_assessment_for_event
+    from warehouse_assistant.app.services.background.polling_listener import process_event
+    from warehouse_assistant.app.services.background.event_tracker import get_event_tracker
+
+    event_tracker = get_event_tracker()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    async def run_one(event_id: str):
+        async with semaphore:
+            start = time.perf_counter()
+            if mode == "crew":
+                result = await asyncio.to_thread(run_risk_assessment_for_event, event_id)
+                status = result.get("status", "unknown")
+            else:
+                if not event_tracker.mark_as_processing(event_id):
+                    statuses["skipped"] += 1
+                    return
+                await process_event(event_id)
+                record = event_tracker.processed_events.get(event_id, {})
+                status = "success" if record.get("success") else "error"
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(run_one(event_id) for event_id in event_ids))
+    wall_time = time.perf_counter() - wall_start
+    return latencies, statuses, wall_time
+
+
+def main():
+    args = parse_args()
+    apply_llm_overrides(args)
+
+    event_ids = args.event_ids or select_pending_event_ids(args.events)
+    if not event_ids:
+        print("没有可评估的事件。可先运行 generate_test_data.py 生成测试数据。")
+        return
+
+    print(f"模式: {args.mode}, 提供方: {args.provider}, 事件数: {len(event_ids)}, 并发: {args.concurrency}")
+    latencies, statuses, wall_time = asyncio.run(run_benchmark(event_ids, args.concurrency, args.mode))
+
+    completed = len(latencies)
+    print("\n===== 压测结果 =====")
+    print(f"完成事件数: {completed}, 状态分布: {dict(statuses)}")
+    print(f"总耗时: {wall_time:.2f}s, 吞吐量: {completed / wall_time if wall_time else 0:.3f} 事件/秒")
+    for pct in (50, 95, 99):
+        print(f"p{pct} 延迟: {percentile(latencies, pct):.3f}s")
+    if latencies:
+        print(f"最大延迟: {max(latencies):.3f}s")
+
+    from warehouse_assistant.app.services.ai.agents.risk_agents import llm
+    if hasattr(llm, "usage_summary"):
+        print(f"模拟 token 用量: {llm.usage_summary()}")
+
+
+if __name__ == "__main__":
+    main()
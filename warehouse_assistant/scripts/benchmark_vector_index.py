@@ -0,0 +1,113 @@
+"""
+向量索引对比脚本
+用同一组查询向量分别检索 ChromaDB 集合和 NumPy 快照（float16 / int8），比较单条查询延迟、
+批量查询吞吐量，以及以 ChromaDB 结果为基准的 recall@k。查询只向量化一次，不计入检索耗时。
+
+用法示例:
+    python warehouse_assistant/scripts/benchmark_vector_index.py --queries 200 --k 3
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+import chromadb
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.embedding_backends import create_base_embeddings
+from warehouse_assistant.app.services.ai.event_features import PARAMETER_LABELS, PARAMETER_RANGES
+from warehouse_assistant.app.services.ai.kb_manifest import active_collection_name, load_manifest
+from warehouse_assistant.app.services.ai.vector_snapshot import SNAPSHOT_DTYPES, VectorSnapshot, export_snapshot
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ChromaDB 与 NumPy 快照检索对比")
+    parser.add_argument("--queries", type=int, default=200, help="查询数，默认200")
+    parser.add_argument("--k", type=int, default=3, help="每条查询返回的结果数，默认3")
+    return parser.parse_args()
+
+
+def build_queries(count: int) -> List[str]:
+    """按检索查询的模板生成查询文本"""
+    templates = [
+        f"{operation} {PARAMETER_LABELS.get(param, param)}偏高 工艺参数超出范围"
+        for operation, params in PARAMETER_RANGES.items() for param in params
+    ]
+    n = len(templates)
+    return [templates[i % n] + (f" 批次{i // n}" if i >= n else "") for i in range(count)]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def time_each(search: Callable[[List[float]], List[str]], vectors: List[List[float]]):
+    """逐条检索，返回 (每条延迟列表, 每条结果ID列表)"""
+    latencies, results = [], []
+    for vector in vectors:
+        start = time.perf_counter()
+        results.append(search(vector))
+        latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def report(name: str, latencies: List[float], results: List[List[str]], reference: List[List[str]], k: int) -> None:
+    recall = sum(len(set(r) & set(c)) / max(1, len(r)) for r, c in zip(reference, results)) / len(reference)
+    print(f"\n===== {name} =====")
+    for pct in (50, 95, 99):
+        print(f"单条查询 p{pct} 延迟: {percentile(latencies, pct) * 1000:.3f}ms")
+    print(f"recall@{k}（相对 ChromaDB）: {recall:.3f}")
+
+
+def main():
+    args = parse_args()
+    client = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIRECTORY)
+    manifest = load_manifest() or {}
+    collection = client.get_collection(active_collection_name(manifest), embedding_function=None)
+    print(f"文本块数: {collection.count()}, 查询数: {args.queries}, k={args.k}")
+
+    embeddings = create_base_embeddings()
+    query_vectors = embeddings.embed_documents(build_queries(args.queries))
+
+    def chroma_search(vector):
+        return collection.query(query_embeddings=[vector], n_results=args.k, include=[])["ids"][0]
+
+    chroma_search(query_vectors[0])  # 预热
+    latencies, reference = time_each(chroma_search, query_vectors)
+    report("ChromaDB", latencies, reference, reference, args.k)
+
+    with tempfile.TemporaryDirectory() as root:
+        for dtype in SNAPSHOT_DTYPES:
+            directory = export_snapshot(
+                collection, root, kb_version=manifest.get("kb_version", "benchmark"),
+                embedding_model=manifest.get("embedding_model"), dtype=dtype
+            )
+            snapshot = VectorSnapshot(directory)
+
+            def snapshot_search(vector):
+                return [snapshot.ids[i] for i, _ in snapshot.search([vector], args.k)[0]]
+
+            snapshot_search(query_vectors[0])  # 预热（加载页缓存）
+            latencies, results = time_each(snapshot_search, query_vectors)
+            report(f"NumPy 快照 ({dtype}, {snapshot.vectors.nbytes / 1024:.0f}KB)", latencies, results, reference, args.k)
+
+            start = time.perf_counter()
+            snapshot.search(query_vectors, args.k)
+            elapsed = time.perf_counter() - start
+            print(f"批量检索 {len(query_vectors)} 条: {elapsed * 1000:.2f}ms ({len(query_vectors) / elapsed:.0f} 条/秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+构建预计算知识上下文表
+为每个操作类型的全部固定检索查询预先执行检索，写入 ChromaDB 持久化目录下的 context_table.json。
+init_knowledge_base.py 构建完成后会自动重建；单独修改查询模板或操作类型词表后可运行本脚本。
+服务检测到文件变化后自动加载新表。
+
+用法示例:
+    python warehouse_assistant/scripts/build_context_table.py
+    python warehouse_assistant/scripts/build_context_table.py --show 热轧
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from warehouse_assistant.app.services.ai.context_table import context_table_path, rebuild_context_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="构建预计算知识上下文表")
+    parser.add_argument("--show", metavar="OPERATION_TYPE", help="构建后打印该操作类型的条目")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    table = rebuild_context_table()
+    entry_count = sum(len(entries) for entries in table["entries"].values())
+    print(f"知识上下文表已写入: {context_table_path()}")
+    print(f"知识库版本: {table['kb_version']}，{len(table['entries'])} 个操作类型，{entry_count} 条固定查询，"
+          f"每条 {table['k']} 个结果，耗时 {time.perf_counter() - start:.1f}s")
+
+    if args.show:
+        entries = table["entries"].get(args.show)
+        if entries is None:
+            print(f"操作类型 {args.show} 不在词表中")
+            return
+        for query, results in entries.items():
+            print(f"\n{query}")
+            for result in results:
+                metadata = result["metadata"]
+                label = f"规则 {metadata['rule_id']}" if metadata.get("rule_id") else metadata.get("section", "")
+                print(f"  {result['score']:.4f}  {metadata.get('source', '')} {label}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+导出 ONNX 嵌入模型
+把 EMBEDDING_MODEL_NAME 对应的 transformer 导出为 ONNX 计算图，并生成 int8 动态量化版本，
+供 EMBEDDING_BACKEND=onnx 使用。导出后用若干样例文本对比 torch 后端，输出余弦相似度。
+
+依赖: pip install onnx onnxruntime tokenizers transformers torch
+
+用法示例:
+    python warehouse_assistant/scripts/export_onnx_embedding_model.py
+    python warehouse_assistant/scripts/export_onnx_embedding_model.py --output-dir /data/onnx_models/minilm
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+import numpy as np
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.embedding_backends import (
+    ONNX_CONFIG_FILE, ONNX_MODEL_FILE, ONNX_QUANTIZED_MODEL_FILE, OnnxEmbeddings
+)
+
+SAMPLE_TEXTS = [
+    "如何判断物料存储时间是否正常？",
+    "热处理 加热温度偏高 工艺参数超出范围",
+    "轧制过程中轧制力异常应如何处理",
+    "出库前必须完成质量检验并确认检验结果合格",
+    "Quality inspection failed for batch before shipment",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="导出并量化 ONNX 嵌入模型")
+    parser.add_argument("--model-name", default=settings.EMBEDDING_MODEL_NAME, help="sentence-transformers 模型名称")
+    parser.add_argument("--output-dir", default=settings.EMBEDDING_ONNX_DIR, help="导出目录")
+    parser.add_argument("--opset", type=int, default=14, help="ONNX opset 版本，默认14")
+    return parser.parse_args()
+
+
+def read_max_seq_length(model_name: str) -> int:
+    """读取 sentence-transformers 配置中的最大序列长度，保证与 torch 后端截断一致"""
+    from sentence_transformers import SentenceTransformer
+    return int(SentenceTransformer(model_name, device="cpu").max_seq_length)
+
+
+def export(model_name: str, output_dir: str, opset: int) -> None:
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    # 保存快速分词器（tokenizer.json），ONNX 后端只依赖 tokenizers 库
+    tokenizer.save_pretrained(output_dir)
+    max_seq_length = read_max_seq_length(model_name)
+
+    dummy = tokenizer(["导出样例"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    print(f"导出 ONNX 模型: {model_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    quantized_path = os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE)
+    print(f"生成 int8 动态量化模型: {quantized_path}")
+    quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            "model_name": model_name,
+            "max_seq_length": max_seq_length,
+            "pad_token_id": tokenizer.pad_token_id or 0,
+            "pooling": "mean",
+        }, f, ensure_ascii=False, indent=2)
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+def verify(model_name: str, output_dir: str) -> None:
+    """对比 torch 后端与两个 ONNX 模型的输出"""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    reference = np.array(HuggingFaceEmbeddings(model_name=model_name).embed_documents(SAMPLE_TEXTS))
+    for quantized in (False, True):
+        vectors = np.array(OnnxEmbeddings(output_dir, quantized=quantized).embed_documents(SAMPLE_TEXTS))
+        similarity = cosine(reference, vectors)
+        name = "int8" if quantized else "fp32"
+        print(f"{name}: 与 torch 输出的余弦相似度 最小 {similarity.min():.4f}, 平均 {similarity.mean():.4f}")
+
+
+def main():
+    args = parse_args()
+    export(args.model_name, args.output_dir, args.opset)
+    verify(args.model_name, args.output_dir)
+    print("\n导出完成。设置 EMBEDDING_BACKEND=onnx 后运行 init_knowledge_base.py 重建知识库。")
+
+
+if __name__ == "__main__":
+    main()
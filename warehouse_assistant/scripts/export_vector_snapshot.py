@@ -0,0 +1,42 @@
+"""
+导出向量索引快照
+把当前知识库集合的向量导出为内存映射的 NumPy 快照，供 VECTOR_INDEX_BACKEND=snapshot 使用。
+服务检测到 current.json 变化后自动加载新快照。
+
+用法示例:
+    python warehouse_assistant/scripts/export_vector_snapshot.py
+    python warehouse_assistant/scripts/export_vector_snapshot.py --dtype int8
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.vector_snapshot import (
+    SNAPSHOT_DTYPES, VectorSnapshot, export_knowledge_base_snapshot
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="导出向量索引快照")
+    parser.add_argument("--dtype", choices=SNAPSHOT_DTYPES, default=settings.VECTOR_SNAPSHOT_DTYPE, help="向量精度")
+    parser.add_argument("--output-dir", default=settings.VECTOR_SNAPSHOT_DIRECTORY, help="快照根目录")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    directory = export_knowledge_base_snapshot(root=args.output_dir, dtype=args.dtype)
+    snapshot = VectorSnapshot(directory)
+    size_mb = snapshot.vectors.nbytes / 1024 / 1024
+    print(f"快照已导出: {directory}")
+    print(f"知识库版本: {snapshot.kb_version}, 向量数: {len(snapshot)}, 精度: {snapshot.dtype}, 向量矩阵: {size_mb:.2f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+重建批次风险分脚本
+批次风险分在每次写入风险评估时增量维护；首次启用该功能（已有历史评估结果）或数据修复时，
+运行本脚本由全部事件重新计算 batch_risk_scores 集合。
+
+用法示例:
+    python warehouse_assistant/scripts/rebuild_batch_risk_scores.py
+"""
+import logging
+import sys
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def main():
+    db_service = get_db_service()
+    if db_service.use_local_file:
+        print("本地文件模式下批次风险分按需计算，无需重建")
+        return
+    count = db_service.rebuild_batch_risk_scores()
+    print(f"已重建 {count} 个批次的风险分")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+知识库重建后选择性重新评估脚本
+只把引用了已变更文本块的风险评估重新排队，由轮询监听器重新评估。
+
+用法示例:
+    python warehouse_assistant/scripts/init_knowledge_base.py
+    python warehouse_assistant/scripts/requeue_stale_assessments.py --dry-run
+    python warehouse_assistant/scripts/requeue_stale_assessments.py
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from warehouse_assistant.app.services.background.kb_reassessment import requeue_stale_assessments
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库重建后选择性重新评估")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要重新评估的事件，不写库")
+    args = parser.parse_args()
+
+    stats = requeue_stale_assessments(dry_run=args.dry_run)
+    print(f"知识库版本: {stats['kb_version']}")
+    print(f"检查评估数: {stats['checked']}")
+    print(f"重新排队数: {stats['requeued']}")
+    print(f"无需重新评估: {stats['unchanged']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+启动共享嵌入服务
+在单独的进程中加载一份嵌入模型，供所有 API worker 和脚本通过 EMBEDDING_SERVICE_URL 共用。
+服务端使用本进程的 EMBEDDING_BACKEND 等配置，客户端进程的配置需与之一致（模型标识不一致时客户端拒绝使用）。
+
+用法示例:
+    python warehouse_assistant/scripts/run_embedding_server.py --url unix:///tmp/warehouse_embedding.sock
+    python warehouse_assistant/scripts/run_embedding_server.py --url http://127.0.0.1:8765
+然后为 API 进程设置相同的 EMBEDDING_SERVICE_URL。
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+import uvicorn
+
+from warehouse_assistant.app.core.config import settings
+from warehouse_assistant.app.services.ai.embedding_backends import EMBEDDING_BACKENDS
+from warehouse_assistant.app.services.ai.embedding_client import parse_service_url
+from warehouse_assistant.app.services.ai.embedding_server import create_embedding_app
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="启动共享嵌入服务")
+    parser.add_argument("--url", default=settings.EMBEDDING_SERVICE_URL or DEFAULT_URL,
+                        help=f"监听地址，http://host:port 或 unix:///path/to/socket，默认 EMBEDDING_SERVICE_URL 或 {DEFAULT_URL}")
+    parser.add_argument("--backend", choices=EMBEDDING_BACKENDS, default=settings.EMBEDDING_BACKEND,
+                        help="嵌入模型后端，默认 EMBEDDING_BACKEND")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    host, port, socket_path = parse_service_url(args.url)
+    app = create_embedding_app(args.backend)
+    if socket_path:
+        # 上次异常退出遗留的套接字文件会导致绑定失败
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        print(f"嵌入服务监听 Unix 域套接字: {socket_path}")
+        uvicorn.run(app, uds=socket_path, log_level=settings.LOG_LEVEL.lower())
+    else:
+        print(f"嵌入服务监听: {host}:{port}")
+        uvicorn.run(app, host=host, port=port, log_level=settings.LOG_LEVEL.lower())
+
+
+if __name__ == "__main__":
+    main()
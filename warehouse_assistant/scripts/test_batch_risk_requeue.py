@@ -0,0 +1,126 @@
+"""
+测试重新排队后重新评估时批次风险分的增量维护
+在 MongoDB 中创建一个临时批次，写入评估结果后按知识库更新的方式重新排队并重新评估，检查：
+1. 以相同结果重新评估后批次风险分不变（旧结果被扣除，没有重复计数）；
+2. 重新评估为较低风险后，增量维护的风险分与由全部事件重新计算的结果一致，最高风险等级随之下降。
+测试结束后删除临时数据。
+
+用法示例:
+    python warehouse_assistant/scripts/test_batch_risk_requeue.py
+"""
+import logging
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from bson import ObjectId
+
+from warehouse_assistant.app.services.background.kb_reassessment import requeue_update
+from warehouse_assistant.app.services.database.mongo_service import compute_batch_risk_scores, get_db_service
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 比较的批次风险分字段
+SCORE_FIELDS = ("risk_score", "counts_by_level", "counts_by_type", "assessed_events", "max_level")
+
+
+def _assessment(risk_level: str, risk_type: str) -> dict:
+    return {
+        "risk_level": risk_level,
+        "risk_type": risk_type,
+        "reason": "批次风险分重新排队测试",
+        "knowledge_refs": {"kb_version": "test", "chunk_ids": []},
+    }
+
+
+def _normalized(score: dict) -> dict:
+    """只取比较的字段；增量维护会留下计数为 0 的等级和类型，比较时忽略"""
+    normalized = {field: score.get(field) for field in SCORE_FIELDS}
+    for field in ("counts_by_level", "counts_by_type"):
+        normalized[field] = {key: count for key, count in (normalized[field] or {}).items() if count}
+    return normalized
+
+
+def _score(db_service, batch_id: str) -> dict:
+    return _normalized(db_service.batch_risk_scores.find_one({"_id": batch_id}) or {})
+
+
+def _recomputed_score(db_service, batch_id: str) -> dict:
+    events = list(db_service.trace_events.find({"batch_id": batch_id}))
+    return _normalized(compute_batch_risk_scores(events).get(batch_id, {}))
+
+
+def _requeue(db_service, event_id: str) -> None:
+    event = db_service.trace_events.find_one({"_id": ObjectId(event_id)})
+    db_service.trace_events.update_one(
+        {"_id": event["_id"]},
+        requeue_update(event["risk_assessment"], "test-next", [], datetime.utcnow())
+    )
+
+
+def main() -> int:
+    db_service = get_db_service()
+    if db_service.use_local_file or db_service.batch_risk_scores is None:
+        print("该测试需要连接 MongoDB")
+        return 1
+
+    batch_id = f"TEST-REQUEUE-{int(time.time())}"
+    now = datetime.utcnow()
+    event_ids = [
+        str(db_service.trace_events.insert_one({
+            "batch_id": batch_id, "operation_type": operation_type, "timestamp": now
+        }).inserted_id)
+        for operation_type in ("热轧", "质检")
+    ]
+    failures = []
+    try:
+        db_service.update_event_risk(event_ids[0], _assessment("高", "参数偏差"))
+        db_service.update_event_risk(event_ids[1], _assessment("中", "质量问题"))
+        before = _score(db_service, batch_id)
+        logger.info(f"初始批次风险分: {before}")
+
+        # 1. 重新排队后以相同结果重新评估，风险分不变
+        _requeue(db_service, event_ids[0])
+        requeued = _score(db_service, batch_id)
+        if requeued != before:
+            failures.append(f"重新排队后风险分发生变化: {requeued} != {before}")
+        db_service.update_event_risk(event_ids[0], _assessment("高", "参数偏差"))
+        after = _score(db_service, batch_id)
+        if after != before:
+            failures.append(f"以相同结果重新评估后风险分发生变化: {after} != {before}")
+
+        # 2. 重新评估为低风险，增量结果与重新计算一致，最高等级下降
+        _requeue(db_service, event_ids[0])
+        db_service.update_event_risk(event_ids[0], _assessment("低", "参数偏差"))
+        lowered = _score(db_service, batch_id)
+        recomputed = _recomputed_score(db_service, batch_id)
+        if lowered != recomputed:
+            failures.append(f"增量维护的风险分与重新计算不一致: {lowered} != {recomputed}")
+        if lowered["max_level"] != "中":
+            failures.append(f"重新评估为低风险后最高等级应为 中，实际为 {lowered['max_level']}")
+        leftover = db_service.trace_events.count_documents(
+            {"batch_id": batch_id, "previous_risk_assessment": {"$exists": True}}
+        )
+        if leftover:
+            failures.append(f"重新评估后仍有 {leftover} 个事件保留 previous_risk_assessment")
+    finally:
+        db_service.trace_events.delete_many({"batch_id": batch_id})
+        db_service.batch_risk_scores.delete_one({"_id": batch_id})
+
+    if failures:
+        for failure in failures:
+            logger.error(failure)
+        return 1
+    logger.info("重新排队后重新评估的批次风险分检查通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+测试 Change Stream 模式下的重新排队事件拾取
+在 MongoDB 中插入一个已重新排队的临时事件，在事件循环中执行一次拾取，检查：
+1. 事件被拾取并启动重新评估（数据库查询在工作线程中，启动评估任务在事件循环中）；
+2. 评估结束后事件不再处于处理中；
+3. 水位已越过该事件，再次拾取不会重复评估。
+测试结束后删除临时数据。建议设置 LLM_PROVIDER=stub 运行，避免调用真实模型。
+
+用法示例:
+    LLM_PROVIDER=stub python warehouse_assistant/scripts/test_requeue_sweep.py --timeout 120
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from bson import ObjectId
+
+from warehouse_assistant.app.services.background import polling_listener
+from warehouse_assistant.app.services.background.change_stream_listener import sweep_requeued_events_once
+from warehouse_assistant.app.services.background.event_tracker import get_event_tracker
+from warehouse_assistant.app.services.database.mongo_service import get_db_service
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def run_sweep_check(event_id: str, timeout: float) -> list:
+    failures = []
+    event_tracker = get_event_tracker()
+
+    dispatched = await sweep_requeued_events_once()
+    if event_id not in dispatched:
+        failures.append(f"重新排队的事件 {event_id} 未被拾取，拾取到: {dispatched}")
+        return failures
+    if polling_listener.last_requeue_mark[1] != ObjectId(event_id):
+        failures.append(f"拾取后水位未前进到该事件: {polling_listener.last_requeue_mark}")
+
+    deadline = time.monotonic() + timeout
+    while event_tracker.is_processing(event_id) and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    if event_tracker.is_processing(event_id):
+        failures.append(f"事件 {event_id} 在 {timeout} 秒内仍处于处理中")
+        return failures
+    logger.info(f"事件 {event_id} 的重新评估已结束")
+
+    dispatched_again = await sweep_requeued_events_once()
+    if event_id in dispatched_again:
+        failures.append(f"事件 {event_id} 被重复拾取")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="测试 Change Stream 模式下的重新排队事件拾取")
+    parser.add_argument("--timeout", type=float, default=120.0, help="等待重新评估结束的最长时间（秒）")
+    args = parser.parse_args()
+
+    db_service = get_db_service()
+    if db_service.use_local_file or db_service.trace_events is None:
+        print("该测试需要连接 MongoDB")
+        return 1
+
+    now = datetime.utcnow()
+    event_id = str(db_service.trace_events.insert_one({
+        "batch_id": f"TEST-SWEEP-{int(time.time())}",
+        "operation_type": "热轧",
+        "timestamp": now,
+        "risk_assessment": None,
+        "requeue_reason": {"reason": "test", "requeued_at": now},
+    }).inserted_id)
+    # 水位设在该事件之前，避免库中更早的重新排队事件占满一次拾取的数量
+    polling_listener.last_requeue_mark = (now - timedelta(microseconds=1), ObjectId("0" * 24))
+    try:
+        failures = asyncio.run(run_sweep_check(event_id, args.timeout))
+    finally:
+        db_service.trace_events.delete_one({"_id": ObjectId(event_id)})
+
+    if failures:
+        for failure in failures:
+            logger.error(failure)
+        return 1
+    logger.info("重新排队事件拾取检查通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
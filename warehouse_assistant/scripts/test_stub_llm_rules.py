@@ -0,0 +1,91 @@
+"""
+测试桩模型的风险等级推导规则
+按分析步骤的格式拼出完整提示词（含 Agent 目标、检索到的规则原文和输出格式说明），检查规则只作用于事件数据段：
+1. 参数正常、没有缺陷的热轧事件得到 无；
+2. 备注中有延迟的事件得到 低/操作延迟；
+3. 质检不合格的事件得到 中；
+4. 质检发现严重缺陷的事件得到 高。
+
+用法示例:
+    python warehouse_assistant/scripts/test_stub_llm_rules.py
+"""
+import json
+import logging
+import sys
+from pathlib import Path
+
+# 设置Python路径
+script_dir = Path(__file__).parent
+project_root = script_dir.parent.parent
+sys.path.insert(0, str(project_root))
+
+from warehouse_assistant.app.services.ai.agents.risk_agents import risk_analyzer_agent
+from warehouse_assistant.app.services.ai.crews.risk_crew import RISK_OUTPUT_INSTRUCTIONS
+from warehouse_assistant.app.services.ai.llm_provider import derive_risk_assessment
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 检索到的规则原文中常见的词不应影响推导结果
+KNOWLEDGE = (
+    "[1] 来源: 质量管理规范.pdf 规则 2.2\n"
+    "质检结果为不合格的批次不得入库，发现严重缺陷时应立即隔离；工序间操作延迟超过 2 小时需记录原因。"
+)
+
+
+def _prompt(event: dict) -> str:
+    """按 RiskAssessmentCrew._analyze_risk 的格式拼出提示词，前面附上 Agent 的目标和背景"""
+    return (
+        f"{risk_analyzer_agent.goal}\n{risk_analyzer_agent.backstory}\n\n"
+        "分析以下事件数据和知识库信息，评估潜在风险并提出建议。\n\n"
+        f"事件数据：\n{json.dumps(event, ensure_ascii=False)}\n\n"
+        f"知识库信息：\n{KNOWLEDGE}\n\n"
+        f"{RISK_OUTPUT_INSTRUCTIONS}"
+    )
+
+
+def _event(**overrides) -> dict:
+    event = {
+        "batch_id": "TEST-STUB-001",
+        "operation_type": "热轧",
+        "location": "热轧车间",
+        "parameters": {"temperature": 1150, "rolling_force": 2000},
+        "notes": "热轧 阶段记录。",
+    }
+    event.update(overrides)
+    return event
+
+
+CASES = [
+    ("参数正常的热轧事件", _event(), ("无", "无")),
+    ("备注中有延迟", _event(notes="热轧 阶段记录。 轻微延迟。"), ("低", "操作延迟")),
+    ("质检不合格", _event(
+        operation_type="质检",
+        quality_check={"overall_result": "不合格", "defect_info": {"has_defect": True, "severity": "轻微"}}
+    ), ("中", "质量问题")),
+    ("严重缺陷", _event(
+        operation_type="质检",
+        quality_check={"overall_result": "不合格", "defect_info": {"has_defect": True, "severity": "严重"}}
+    ), ("高", "质量问题")),
+]
+
+
+def main() -> int:
+    failures = []
+    for name, event, expected in CASES:
+        assessment = derive_risk_assessment(_prompt(event))
+        actual = (assessment["risk_level"], assessment["risk_type"])
+        logger.info(f"{name}: {actual[0]}/{actual[1]}")
+        if actual != expected:
+            failures.append(f"{name}: 期望 {expected[0]}/{expected[1]}，实际 {actual[0]}/{actual[1]}")
+
+    if failures:
+        for failure in failures:
+            logger.error(failure)
+        return 1
+    logger.info("桩模型风险等级推导规则检查通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())